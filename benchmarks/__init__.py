@@ -0,0 +1,11 @@
+"""
+Performance benchmarks for the datamodel.
+
+The benchmarks use the test datamodel in tests/spectroscopy_datamodel.py
+and write their results to a JSON file so that runs can be compared::
+
+    python -m benchmarks --sizes 1000 10000 --output results.json
+
+Large synthetic datasets and raw instrument files for scale testing are
+written by :mod:`benchmarks.synthetic`.
+"""
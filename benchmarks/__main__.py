@@ -0,0 +1,3 @@
+from benchmarks.datamodel import main
+
+main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+"""
+Benchmarks for opening, writing, reading, tagging, merging and closing
+datasets built with the test datamodel.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The package's sources and the test datamodel, also used by the benchmarks
+# that run in a fresh interpreter
+_PATH = [os.path.join(_root, 'src'), os.path.join(_root, 'tests')]
+for _p in reversed(_PATH):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+
+import numpy as np
+import tables
+
+import spectroscopy_datamodel
+from spectroscopy_datamodel import (GasFlowBuffer, InstrumentBuffer,
+                                    MethodBuffer, RawDataBuffer, TargetBuffer)
+
+import dataset
+dataset.set_datamodel(spectroscopy_datamodel)
+from dataset import Dataset
+
+NCHANNELS = 2048
+
+# Opens a dataset in a fresh interpreter and prints the time it took
+_COLD_OPEN = """
+import sys, time
+sys.path[:0] = {path!r}
+import spectroscopy_datamodel, dataset
+dataset.set_datamodel(spectroscopy_datamodel)
+t0 = time.time()
+d = dataset.Dataset({filename!r}, mode='r', lazy={lazy!r})
+print(time.time() - t0)
+d.close()
+"""
+
+# Imports the package, and then the Dataset class, in a fresh interpreter
+_IMPORT = """
+import sys, time
+sys.path[:0] = {path!r}
+t0 = time.time()
+import dataset
+t1 = time.time()
+dataset.Dataset
+print('%f %f' % (t1 - t0, time.time() - t1))
+"""
+
+
+def _result(name, size, seconds, ops, **kwargs):
+    r = {'name': name, 'size': size, 'seconds': seconds, 'ops': ops,
+         'ops_per_second': ops / seconds if seconds > 0 else None}
+    r.update(kwargs)
+    return r
+
+
+def _best(func, repeat):
+    """
+    Return the shortest of several runs of func.
+    """
+    times = []
+    for i in range(repeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+
+def _spectrum(i):
+    return RawDataBuffer(d_var=np.random.rand(1, NCHANNELS),
+                         datetime=[datetime.datetime(2017, 1, 1) +
+                                   datetime.timedelta(seconds=i)])
+
+
+def build(filename, size, nchannels=NCHANNELS):
+    """
+    Write a dataset with the given number of elements: one instrument, one
+    target and spectra of nchannels channels referring to both.
+    """
+    d = Dataset(filename, mode='w')
+    i = d.new(InstrumentBuffer(sensor_id='I0'), pedantic=False)
+    t = d.new(TargetBuffer(target_id='T0'), pedantic=False)
+    for k in range(size - 2):
+        rb = RawDataBuffer(instrument=i, target=t,
+                           d_var=np.zeros((1, nchannels)),
+                           datetime=[datetime.datetime(2017, 1, 1) +
+                                     datetime.timedelta(seconds=k)])
+        d.new(rb, pedantic=False)
+    d.close()
+
+
+def bench_import(repeat):
+    """
+    Time importing the package and the Dataset class in a new process.
+    """
+    code = _IMPORT.format(path=_PATH)
+    times = []
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', code])
+        times.append([float(t) for t in out.split()])
+    package, cls = [min(t) for t in zip(*times)]
+    return [_result('import_package', 0, package, 1),
+            _result('import_dataset_class', 0, cls, 1)]
+
+
+def bench_open(filename, size, repeat):
+    """
+    Time opening a dataset in a new process (cold) and again in this
+    process (warm), eagerly and lazily, and closing it.
+    """
+    results = []
+    for lazy in (False, True):
+        label = 'lazy' if lazy else 'eager'
+        code = _COLD_OPEN.format(path=_PATH, filename=filename,
+                                 lazy=lazy)
+        out = subprocess.check_output([sys.executable, '-c', code])
+        results.append(_result('open_cold_' + label, size,
+                               float(out.split()[-1]), 1))
+
+        def _open():
+            Dataset(filename, mode='r', lazy=lazy).close()
+        results.append(_result('open_warm_' + label, size,
+                               _best(_open, repeat), 1))
+    d = Dataset(filename, mode='r')
+    t0 = time.time()
+    d.close()
+    results.append(_result('close', size, time.time() - t0, 1))
+    return results
+
+
+def bench_new(workdir, count):
+    """
+    Time creating RawData elements holding one 2048 channel spectrum.
+    """
+    d = Dataset(os.path.join(workdir, 'new.h5'), mode='w')
+    buffers = [_spectrum(i) for i in range(count)]
+    t0 = time.time()
+    for rb in buffers:
+        d.new(rb, pedantic=False)
+    dt = time.time() - t0
+    d.close()
+    nbytes = count * NCHANNELS * 8
+    return [_result('new_rawdata', count, dt, count,
+                    mb_per_second=nbytes / dt / 1e6)]
+
+
+def bench_append(workdir, count):
+    """
+    Time appending 2048 channel spectra to a single RawData element.
+    """
+    d = Dataset(os.path.join(workdir, 'append.h5'), mode='w')
+    r = d.new(_spectrum(0), pedantic=False, expected_entries=count + 1)
+    buffers = [_spectrum(i) for i in range(1, count + 1)]
+    t0 = time.time()
+    for rb in buffers:
+        r.append(rb, pedantic=False)
+    dt = time.time() - t0
+    d.close()
+    nbytes = count * NCHANNELS * 8
+    return [_result('append_rawdata', count, dt, count,
+                    mb_per_second=nbytes / dt / 1e6)]
+
+
+def bench_access(filename, size, count):
+    """
+    Time reading a scalar property, following a single reference and
+    following an array of references.
+    """
+    results = []
+    d = Dataset(filename, mode='r')
+    r = d.elements['RawData'][0]
+    t = d.elements['Target'][0]
+
+    t0 = time.time()
+    for i in range(count):
+        t.target_id
+    results.append(_result('scalar_access', size, time.time() - t0, count))
+
+    t0 = time.time()
+    for i in range(count):
+        r.target
+    results.append(_result('reference_access', size, time.time() - t0, count))
+
+    t0 = time.time()
+    for i in range(count):
+        r.d_var[0]
+    results.append(_result('array_row_access', size, time.time() - t0, count))
+    d.close()
+
+    d = Dataset(tempfile.mktemp(suffix='.h5', dir=os.path.dirname(filename)))
+    ms = [d.new(MethodBuffer(name='M%d' % i), pedantic=False)
+          for i in range(10)]
+    gf = d.new(GasFlowBuffer(methods=ms), pedantic=False)
+    t0 = time.time()
+    for i in range(count):
+        gf.methods
+    results.append(_result('reference_array_access', 10, time.time() - t0,
+                           count))
+    d.close()
+    return results
+
+
+def bench_tagging(workdir, count):
+    """
+    Time tagging elements one at a time and in one batch.
+    """
+    results = []
+    d = Dataset(os.path.join(workdir, 'tags.h5'), mode='w')
+    d.register_tags(['single', 'batch'])
+    ts = [d.new(TargetBuffer(target_id='T%d' % i), pedantic=False)
+          for i in range(count)]
+    t0 = time.time()
+    for t in ts:
+        t.tags.add('single')
+    results.append(_result('tag_single', count, time.time() - t0, count))
+    t0 = time.time()
+    d.tag(ts, ['batch'])
+    results.append(_result('tag_batch', count, time.time() - t0, count))
+    t0 = time.time()
+    d.untag(ts, ['batch'])
+    results.append(_result('untag_batch', count, time.time() - t0, count))
+    d.close()
+    return results
+
+
+def bench_merge(filename, size, workdir):
+    """
+    Time adding a dataset to another one by copying (+=) and by linking
+    (merge).
+    """
+    results = []
+    other = Dataset(filename, mode='r')
+    d = Dataset(os.path.join(workdir, 'iadd.h5'), mode='w')
+    t0 = time.time()
+    d += other
+    results.append(_result('iadd', size, time.time() - t0, size))
+    d.close()
+    other.close()
+    fn = os.path.join(workdir, 'merge.h5')
+    d = Dataset(fn, mode='w')
+    t0 = time.time()
+    d.merge(filename)
+    dt = time.time() - t0
+    d.close()
+    results.append(_result('merge_link', size, dt, size,
+                           file_bytes=os.path.getsize(fn)))
+    return results
+
+
+def run(sizes, count=1000, repeat=3, workdir=None, nchannels=NCHANNELS):
+    """
+    Run all benchmarks and return the results.
+
+    :type sizes: list
+    :param sizes: Numbers of elements of the datasets to open, read from
+        and merge.
+    :type count: int
+    :param count: Number of operations for the throughput and latency
+        benchmarks.
+    :type repeat: int
+    :param repeat: Number of repetitions of the warm open benchmarks.
+    :type workdir: str
+    :param workdir: Directory for the benchmark files. Datasets of the
+        given sizes that already exist there are reused. A temporary
+        directory is used and removed afterwards if None.
+    :type nchannels: int
+    :param nchannels: Number of channels of the spectra in the datasets
+        to open, read from and merge.
+    """
+    cleanup = workdir is None
+    if workdir is None:
+        workdir = tempfile.mkdtemp()
+    elif not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    results = []
+    try:
+        results.extend(bench_import(repeat))
+        results.extend(bench_new(workdir, count))
+        results.extend(bench_append(workdir, count))
+        results.extend(bench_tagging(workdir, count))
+        for size in sizes:
+            fn = os.path.join(workdir, 'dataset_{:d}_{:d}.h5'.format(
+                size, nchannels))
+            if not os.path.isfile(fn):
+                t0 = time.time()
+                build(fn, size, nchannels)
+                results.append(_result('build', size, time.time() - t0, size))
+            results.extend(bench_open(fn, size, repeat))
+            results.extend(bench_access(fn, size, count))
+            results.extend(bench_merge(fn, size, workdir))
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help='Numbers of elements of the benchmark datasets.')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='Number of operations per throughput benchmark.')
+    parser.add_argument('--channels', type=int, default=NCHANNELS,
+                        help='Number of channels of the spectra in the '
+                        'benchmark datasets.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Repetitions of the warm open benchmarks.')
+    parser.add_argument('--workdir', default=None,
+                        help='Directory to keep the benchmark datasets in.')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='JSON file to write the results to.')
+    args = parser.parse_args(argv)
+    results = run(args.sizes, args.count, args.repeat, args.workdir,
+                  args.channels)
+    info = {'date': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'tables': tables.__version__,
+            'hdf5': tables.hdf5_version}
+    with open(args.output, 'w') as fh:
+        json.dump({'info': info, 'results': results}, fh, indent=2,
+                  sort_keys=True)
+    for r in results:
+        print('{name:>24s} {size:>8d} {seconds:12.6f} s'.format(**r))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+"""
+Deterministic generator for large synthetic datasets and raw instrument
+files.
+
+The generated graphs mimic a MiniDOAS network: instruments scanning a
+target, one RawData and one Concentration element per instrument and day,
+gas flow forecasts on a regular grid and fluxes derived from the scans.
+All values come from a seeded random number generator, so the same
+arguments always produce the same data (resource identifiers and HDF5
+metadata still differ between runs)::
+
+    python -m benchmarks.synthetic dataset.h5 --days 365 --instruments 2
+
+prints the expected size before writing. The raw file writers produce
+input for the 'minidoas-raw', 'minidoas-scan' and 'flyspec' plugins.
+"""
+import argparse
+import codecs
+import datetime
+import os
+import sys
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _p in (os.path.join(_root, 'src'), os.path.join(_root, 'tests')):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+
+import numpy as np
+
+import spectroscopy_datamodel
+from spectroscopy_datamodel import (ConcentrationBuffer, FluxBuffer,
+                                    GasFlowBuffer, InstrumentBuffer,
+                                    MethodBuffer, RawDataBuffer,
+                                    RawDataTypeBuffer, TargetBuffer)
+
+import dataset
+dataset.set_datamodel(spectroscopy_datamodel)
+from dataset import Dataset
+
+# Number of channels of a MiniDOAS spectrum and of a FlySpec spectrum
+MINIDOAS_CHANNELS = 482
+FLYSPEC_CHANNELS = 2048
+
+# White Island vent in WGS84 and NZMG
+_TARGET = (177.183, -37.521, 321.)
+_TARGET_NZMG = (2880800., 6400500.)
+
+
+def _scan_times(start, nscans, nspectra, interval=600., step=2.):
+    """
+    Return the times of all spectra of a day's scans as datetime64[ms].
+    """
+    offsets = (np.arange(nscans)[:, np.newaxis] * interval +
+               np.arange(nspectra)[np.newaxis, :] * step)
+    t0 = np.datetime64(start, 'ms')
+    return t0 + (offsets.ravel() * 1e3).astype('timedelta64[ms]')
+
+
+def _datetimes(times):
+    """
+    Convert datetime64 values into the datetime objects buffers expect.
+    """
+    return times.astype('datetime64[us]').tolist()
+
+
+def _spectra(rs, angles, nchannels):
+    """
+    Return counts that peak when the scanner points at the plume.
+    """
+    base = 2000. + 1500. * np.sin(np.linspace(0, np.pi, nchannels))
+    plume = np.exp(-(angles / 20.) ** 2)
+    counts = base[np.newaxis, :] * (1. - 0.2 * plume[:, np.newaxis])
+    counts += rs.normal(0., 20., counts.shape)
+    return counts
+
+
+def estimate_size(days=1, instruments=2, scans=48, spectra=60,
+                  nchannels=MINIDOAS_CHANNELS):
+    """
+    Return the approximate uncompressed size in bytes of the spectra
+    written by :func:`generate`.
+    """
+    return days * instruments * scans * spectra * nchannels * 8
+
+
+def generate(filename, days=1, instruments=2, scans=48, spectra=60,
+             nchannels=MINIDOAS_CHANNELS, grid=(10, 10, 5), seed=0,
+             start=datetime.datetime(2016, 11, 1)):
+    """
+    Write a synthetic dataset through the Dataset API.
+
+    :type filename: str
+    :param filename: Name of the HDF5 file to write. An existing file is
+        overwritten.
+    :type days: int
+    :param days: Number of days of measurements.
+    :type instruments: int
+    :param instruments: Number of scanning instruments.
+    :type scans: int
+    :param scans: Number of scans per instrument and day.
+    :type spectra: int
+    :param spectra: Number of spectra per scan.
+    :type nchannels: int
+    :param nchannels: Number of channels per spectrum.
+    :type grid: tuple
+    :param grid: Number of grid points of the hourly gas flow forecasts in
+        x, y and z.
+    :type seed: int
+    :param seed: Seed of the random number generator.
+    :type start: :class:`datetime.datetime`
+    :param start: Time of the first measurement.
+    :rtype: dict
+    :returns: The number of elements written per class.
+    """
+    rs = np.random.RandomState(seed)
+    d = Dataset(filename, mode='w')
+    t = d.new(TargetBuffer(target_id='WI001', name='White Island main vent',
+                           position=[_TARGET]), pedantic=False)
+    m_ws = d.new(MethodBuffer(name='WS2PV',
+                              description='Plume velocity from wind speed'),
+                 pedantic=False)
+    m_nwp = d.new(MethodBuffer(name='NWP', description='Wind model forecast'),
+                  pedantic=False)
+    m_doas = d.new(MethodBuffer(name='DOAS'), pedantic=False)
+    rdt = d.new(RawDataTypeBuffer(d_var_unit='ppm-m', ind_var_unit='nm',
+                                  name='measurement',
+                                  acquisition='stationary'), pedantic=False)
+    insts = [d.new(InstrumentBuffer(sensor_id='MD%03d' % i,
+                                    name='MiniDOAS %d' % i,
+                                    location='Station %d' % i),
+                   pedantic=False)
+             for i in range(instruments)]
+
+    nx, ny, nz = grid
+    gx, gy, gz = np.meshgrid(_TARGET[0] + np.linspace(-0.1, 0.1, nx),
+                             _TARGET[1] + np.linspace(-0.1, 0.1, ny),
+                             np.linspace(500., 3000., nz), indexing='ij')
+    grid_position = np.column_stack([gx.ravel(), gy.ravel(), gz.ravel()])
+    wavelengths = np.linspace(290., 330., nchannels)
+    angles = np.tile(np.linspace(-90., 90., spectra), scans)
+
+    for day in range(days):
+        day_start = start + datetime.timedelta(days=day)
+        hours = np.datetime64(day_start, 's') + \
+            np.arange(24).astype('timedelta64[h]')
+        npts = grid_position.shape[0]
+        speed = rs.uniform(2., 15., 24)
+        bearing = np.radians(rs.uniform(0., 360., 24))
+        gfb = GasFlowBuffer(methods=[m_nwp], unit='m/s',
+                            vx=np.repeat(speed * np.sin(bearing), npts),
+                            vy=np.repeat(speed * np.cos(bearing), npts),
+                            vz=np.zeros(24 * npts),
+                            position=np.tile(grid_position, (24, 1)),
+                            datetime=_datetimes(np.repeat(hours, npts)))
+        gf = d.new(gfb, pedantic=False)
+
+        for inst in insts:
+            times = _scan_times(day_start + datetime.timedelta(hours=6),
+                                scans, spectra)
+            counts = _spectra(rs, angles, nchannels)
+            # write the first scan with new and the rest with append as an
+            # instrument streaming data would
+            r = None
+            for k in range(scans):
+                sl = slice(k * spectra, (k + 1) * spectra)
+                rb = RawDataBuffer(d_var=counts[sl],
+                                   inc_angle=angles[sl],
+                                   datetime=_datetimes(times[sl]),
+                                   integration_time=np.full(spectra, 200.))
+                if r is None:
+                    rb.ind_var = wavelengths
+                    rb.instrument = inst
+                    rb.target = t
+                    rb.type = rdt
+                    r = d.new(rb, pedantic=False,
+                              expected_entries=scans * spectra)
+                else:
+                    r.append(rb, pedantic=False)
+
+            plume = np.exp(-(angles / 20.) ** 2)
+            values = plume * rs.uniform(50., 500.) + \
+                rs.normal(0., 5., angles.size)
+            cb = ConcentrationBuffer(rawdata=[r], method=m_doas,
+                                     gasflow=gf, gas_species='SO2',
+                                     unit='ppm-m',
+                                     rawdata_indices=np.arange(angles.size),
+                                     value=values,
+                                     value_error=np.full(angles.size, 5.),
+                                     datetime=_datetimes(times))
+            c = d.new(cb, pedantic=False)
+
+            flux = values.reshape(scans, spectra).sum(axis=1) * 0.1
+            fb = FluxBuffer(method=m_ws, concentration=c, gasflow=gf,
+                            concentration_indices=np.arange(scans) * spectra,
+                            value=flux, value_error=0.2 * flux, unit='t/d',
+                            datetime=_datetimes(times[::spectra]))
+            d.new(fb, pedantic=False)
+    counts = dict((k, len(v)) for k, v in d.elements.items())
+    d.close()
+    return counts
+
+
+def write_minidoas_raw(filename, date=datetime.date(2016, 11, 1),
+                       station='NE', scans=48, spectra=60, seed=0):
+    """
+    Write a MiniDOAS raw data file as read by the 'minidoas-raw' plugin.
+
+    Each line holds the station, date, seconds of the day, scan step,
+    scan angle in radians, integration time, number of co-added spectra,
+    the incoming light estimate and the counts of all channels. The file
+    starts with a byte order mark like the instrument output.
+    """
+    rs = np.random.RandomState(seed)
+    nrows = scans * spectra
+    angles = np.tile(np.linspace(-90., 90., spectra), scans)
+    secs = 6 * 3600. + (np.arange(scans)[:, np.newaxis] * 600. +
+                        np.arange(spectra)[np.newaxis, :] * 2.).ravel()
+    counts = _spectra(rs, angles, MINIDOAS_CHANNELS).astype(int)
+    steps = np.tile(np.arange(1, spectra + 1), scans)
+    specin = counts.mean(axis=1)
+    datestr = date.strftime('%Y%m%d')
+    with codecs.open(filename, 'w', encoding='utf-8-sig') as fh:
+        for i in range(nrows):
+            fh.write(u'%s,%s,%.3f,%d,%.6f,%d,%d,%.2f,%s\n' % (
+                station, datestr, secs[i], steps[i], np.radians(angles[i]),
+                200, 10, specin[i], ','.join(map(str, counts[i]))))
+    return nrows
+
+
+def write_minidoas_scans(filename, station='NE', scans=48, seed=0):
+    """
+    Write a MiniDOAS scan summary file as read by the 'minidoas-scan'
+    plugin.
+    """
+    rs = np.random.RandomState(seed)
+    header = ('StartTime,WindSpeed,WindDir,R2,SO2Start,SO2Max,SO2End,'
+              'PlumeRange,PlumeWidth,PlumeHeight,Easting,Northing,Track,'
+              'Emission,Station,EmissionSE')
+    with open(filename, 'w') as fh:
+        fh.write(header + '\n')
+        for k in range(scans):
+            secs = 6 * 3600 + k * 600
+            so2 = rs.uniform(1., 3., 3)
+            emission = rs.uniform(50., 500.)
+            fh.write('%02d:%02d:%02d,%.2f,%.0f,%.3f,%.3f,%.3f,%.3f,%.1f,'
+                     '%.1f,%.0f,%.0f,%.0f,%.3f,%.2f,%s,%.2f\n' % (
+                         secs // 3600, secs % 3600 // 60, secs % 60,
+                         rs.uniform(2., 15.), rs.uniform(0., 360.),
+                         rs.uniform(0.5, 1.), so2[0], so2.max(), so2[2],
+                         rs.uniform(200., 500.), rs.uniform(500., 900.),
+                         rs.uniform(200., 600.),
+                         _TARGET_NZMG[0] + rs.uniform(-100., 100.),
+                         _TARGET_NZMG[1] + rs.uniform(-100., 100.),
+                         rs.uniform(0., 360.), emission, station,
+                         0.3 * emission))
+    return scans
+
+
+def write_flyspec(filename, spectra_file=None, nrows=1000, seed=0,
+                  start=datetime.datetime(2016, 6, 11, 8, 30)):
+    """
+    Write a FlySpec traverse as read by the 'flyspec' plugin and
+    optionally the matching binary file of 2048 channel float32 spectra.
+
+    The traverse follows a straight line south of the target; positions
+    are written as degrees and decimal minutes with hemisphere letters.
+    """
+    rs = np.random.RandomState(seed)
+    lat = -37.55 + np.linspace(0., -0.05, nrows)
+    lon = 177.1 + np.linspace(0., 0.2, nrows)
+    so2 = 500. * np.exp(-((np.arange(nrows) - nrows / 2.) /
+                          (nrows / 10.)) ** 2) + rs.normal(0., 10., nrows)
+    with open(filename, 'w') as fh:
+        for i in range(nrows):
+            t = start + datetime.timedelta(seconds=1.5 * i)
+            alat, alon = abs(lat[i]), abs(lon[i])
+            fh.write('%d %d %2d %2d %2d %2d %6.3f %02d%02d%02d.000 '
+                     '%d%07.4f %s %d%07.4f %s %.1f 0 %.2f 1500 %.2f %d '
+                     '%.1f %.2f %.2f\n' % (
+                         i, t.year, t.month, t.day, t.hour, t.minute,
+                         t.second + t.microsecond / 1e6,
+                         t.hour, t.minute, t.second,
+                         int(alat), (alat % 1) * 60.,
+                         'S' if lat[i] < 0 else 'N',
+                         int(alon), (alon % 1) * 60.,
+                         'W' if lon[i] < 0 else 'E',
+                         rs.uniform(0., 50.), rs.uniform(50000., 60000.),
+                         so2[i], rs.randint(0, 180), 8.4, 12.5,
+                         rs.uniform(1., 2.)))
+    if spectra_file is not None:
+        angles = rs.uniform(-10., 10., nrows)
+        counts = _spectra(rs, angles, FLYSPEC_CHANNELS)
+        counts.astype(np.float32).tofile(spectra_file)
+    return nrows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic dataset.')
+    parser.add_argument('filename', help='HDF5 file to write.')
+    parser.add_argument('--days', type=int, default=1)
+    parser.add_argument('--instruments', type=int, default=2)
+    parser.add_argument('--scans', type=int, default=48,
+                        help='Scans per instrument and day.')
+    parser.add_argument('--spectra', type=int, default=60,
+                        help='Spectra per scan.')
+    parser.add_argument('--nchannels', type=int, default=MINIDOAS_CHANNELS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    nbytes = estimate_size(args.days, args.instruments, args.scans,
+                           args.spectra, args.nchannels)
+    print('Writing about {:.1f} MB of spectra to {}'.format(
+        nbytes / 1e6, args.filename))
+    counts = generate(args.filename, args.days, args.instruments, args.scans,
+                      args.spectra, args.nchannels, seed=args.seed)
+    for k in sorted(counts):
+        print('{:>16s} {:d}'.format(k, counts[k]))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,23 @@
-import _dataset
+from dataset import _dataset
+from dataset._dataset import Dataset
+from dataset._sharded import ShardedDataset
+
+# Datamodel module installed with set_datamodel
+_datamodel = None
 
 
 def set_datamodel(datamodel_module):
+    global _datamodel
     _dataset._all_classes = datamodel_module.all_classes
-    
-    
-Dataset = _dataset.Dataset
\ No newline at end of file
+    _datamodel = datamodel_module
+
+
+def get_datamodel():
+    """
+    Return the datamodel module installed with :func:`set_datamodel`.
+    Plugins create their data buffers from it.
+    """
+    if _datamodel is None:
+        raise ValueError("dataset.set_datamodel() must be called prior to "
+                         "reading data with a plugin")
+    return _datamodel
@@ -1,17 +1,169 @@
-import hashlib
+import cPickle
+import datetime
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from uuid import uuid4
 import warnings
+import weakref
 
-import numpy as np
-import tables
-from tables.exceptions import NoSuchNodeError, NodeError
+from dataset._lazy import LazyModule
+from dataset.class_factory import (StitchedArray, _ElementContext,
+                                   _NO_LOCK, _Registry, _Stats,
+                                   _remove_tag_entries)
+from dataset.plugins import (DatasetPluginBaseException,
+                             get_registered_plugins)
 
-from dataset.class_factory import ResourceIdentifier
-from dataset.plugins import get_registered_plugins
+np = LazyModule('numpy', __name__)
+tables = LazyModule('tables', __name__)
 
 _all_classes = None
 
+# Read-only Dataset opened by each Dataset.map worker process
+_worker_dataset = None
 
+# Default number of element objects a lazily opened Dataset keeps in memory
+_CACHE_SIZE = 10000
 
+# Serialises changes of HDF5_USE_FILE_LOCKING around the open calls of
+# read-only datasets in SWMR mode
+_LOCKING_ENV_LOCK = threading.Lock()
+
+# Rows of the reverse reference index: element 'referrer' of type 'etype'
+# refers to element 'target' through its reference 'field'
+_REFERRER_DTYPE = [('target', 'S64'), ('etype', 'S32'),
+                   ('referrer', 'S64'), ('field', 'S32')]
+
+# State of the files followed with Dataset.follow: for every buffer the
+# plugin returns for a file, the element it is written to, plus how far the
+# file has been read and the latest time read from it
+_FOLLOW_DTYPE = [('path', 'S256'), ('format', 'S32'), ('key', 'S32'),
+                 ('dest', 'S32'), ('element', 'S64'), ('offset', 'i8'),
+                 ('last', 'S32')]
+
+
+def _rows_after(buffer, last):
+    """
+    Remove the rows of a buffer that aren't later than the given time and
+    return the number of rows left, or None if the buffer has no times.
+    """
+    dts = getattr(buffer, 'datetime', None)
+    if dts is None:
+        return None
+    dts = np.asarray(dts)
+    if last == '':
+        return len(dts)
+    keep = dts.astype('datetime64[us]') > np.datetime64(last, 'us')
+    if not keep.all():
+        n = len(dts)
+        # only array properties are extended row by row; fixed properties
+        # and references are left alone
+        for k, t in buffer._property_dict.items():
+            v = getattr(buffer, k)
+            if t[0] != np.ndarray or v is None or np.shape(v)[:1] != (n,):
+                continue
+            v = np.asarray(v)[keep]
+            if t[1] == datetime.datetime:
+                # the setter only accepts datetime objects for times
+                v = v.astype('datetime64[us]').tolist()
+            setattr(buffer, k, v)
+    return int(keep.sum())
+
+
+def _init_map_worker(all_classes, filename):
+    global _all_classes, _worker_dataset
+    _all_classes = all_classes
+    _worker_dataset = Dataset(filename, mode='r')
+
+
+def _read_file(args):
+    """
+    Read a file with a plugin in an ingest worker process. Exceptions are
+    returned instead of raised so that one bad file doesn't stop the
+    others.
+    """
+    fmt, filename, kwargs = args
+    try:
+        return get_registered_plugins()[fmt]().read(None, filename, **kwargs)
+    except Exception, e:
+        try:
+            cPickle.dumps(e)
+        except Exception:
+            e = DatasetPluginBaseException('{}: {}'.format(type(e).__name__, e))
+        return e
+
+
+class _HandleCall(object):
+    """
+    Picklable callable that resolves an ElementHandle in a worker process
+    and applies the user function to the element.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, handle):
+        return self.func(handle.resolve(_worker_dataset))
+
+
+def _flush_loop(ref, interval, stop):
+    """
+    Flush an in-memory Dataset to its backing file every interval seconds
+    until it is closed or garbage collected.
+    """
+    while not stop.wait(interval):
+        d = ref()
+        if d is None:
+            return
+        with d._ctx.lock:
+            if not d._f.isopen:
+                return
+            d._f.flush()
+        del d
+
+
+class _ElementList(object):
+    """
+    List of the elements of one type of a lazily opened Dataset.
+
+    Only the resource ids are kept; the elements are loaded through the
+    dataset's registry when they are accessed, holding the dataset's lock.
+    """
+
+    def __init__(self, registry, dest, rids=(), lock=_NO_LOCK):
+        self._registry = registry
+        self._dest = dest
+        self._lock = lock
+        self.ids = list(rids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for rid in list(self.ids):
+            with self._lock:
+                e = self._registry.resolve(rid, self._dest)
+            yield e
+
+    def __getitem__(self, key):
+        with self._lock:
+            if isinstance(key, slice):
+                return self._registry.resolve_many(self.ids[key], self._dest)
+            return self._registry.resolve(self.ids[key], self._dest)
+
+    def __contains__(self, e):
+        return getattr(e, '_resource_id', None) in self.ids
+
+    def append(self, e):
+        self.ids.append(e._resource_id)
+
+    def remove(self, e):
+        self.ids.remove(e._resource_id)
+
+    def __repr__(self):
+        return '<{:d} {:s} elements>'.format(len(self.ids), self._dest)
 
 
 class Dataset(object):
@@ -20,6 +172,53 @@ class Dataset(object):
     from the raw measurements, over instruments and information on gas plumes
     to the final gas flux results.
 
+    :type filename: str
+    :param filename: Name of the HDF5 file.
+    :type mode: str
+    :param mode: Mode in which to open the file. 'r' opens an existing file
+        read-only, 'a' (the default) opens it for reading and writing and
+        creates it if it doesn't exist.
+    :type threadsafe: bool
+    :param threadsafe: If True, all HDF5 calls of the dataset and its elements
+        are serialised through a lock so that elements can be read from
+        several threads at the same time.
+    :type swmr: bool
+    :param swmr: Single-writer/multiple-reader mode. A writer in this mode
+        flushes the file after every new element and every append. Readers
+        open the file without HDF5 file locking, so that they can open it
+        while a writer in another process holds it, and call :meth:`refresh`
+        to see the new data. HDF5 is only told through the
+        HDF5_USE_FILE_LOCKING environment variable, which is set for the
+        duration of the reader's own open call. PyTables has no access to
+        HDF5's SWMR file flags, so a reader only sees a consistent state of
+        the file after it has been reopened by :meth:`refresh`.
+    :type in_memory: bool
+    :param in_memory: If True, the file is kept in memory using HDF5's core
+        driver. If a filename is given, an existing file is loaded into memory
+        and the contents are written back to it by :meth:`flush` and
+        :meth:`close`. If filename is None, nothing is ever written to disk.
+    :type flush_interval: float
+    :param flush_interval: For in-memory datasets with a backing file, write
+        the contents to disk every this many seconds in a background thread.
+        This implies thread-safe mode.
+    :type registry: :class:`_Registry`
+    :param registry: Registry of element resource ids to share with other
+        datasets, e.g. the shards of a :class:`ShardedDataset`, so that
+        references between their elements can be resolved. By default each
+        dataset has its own registry.
+    :type lazy: bool
+    :param lazy: If True, elements are only loaded from the file when they
+        are accessed, either through :attr:`elements` or by following a
+        reference, instead of all at once when the file is opened.
+    :type cache_size: int
+    :param cache_size: Number of element objects a lazily opened dataset
+        keeps in memory. The least recently used ones are dropped and loaded
+        again when needed, so the same element may be returned as different
+        objects.
+    :type collect_stats: bool
+    :param collect_stats: If True, call counts, wall time, and rows and
+        bytes written and read are recorded per datamodel class and
+        operation. See :meth:`stats`.
     :type preferredFluxIDs: list
     :param preferredFluxIDs: IDs of the best/final flux estimate. As a dataset
         can contain analyses from different targets, there can be more than one
@@ -39,11 +238,19 @@ class Dataset(object):
     :param flux: List of all flux estimates that are part of the dataset.
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, mode='a', threadsafe=False, swmr=False,
+                 in_memory=False, flush_interval=None, registry=None,
+                 lazy=False, cache_size=_CACHE_SIZE, collect_stats=False):
         
         if _all_classes is None:
             raise ValueError("dataset.set_datamodel() must be called prior to " 
                              "creating a Dataset object")
+        if filename is None and not in_memory:
+            raise ValueError("A filename is required unless in_memory=True.")
+        if flush_interval is not None and (filename is None or
+                                           not in_memory or mode == 'r'):
+            raise ValueError("flush_interval requires a writable in-memory "
+                             "dataset with a backing file.")
         
         self.elements = {}
         self.base_elements = {}
@@ -53,17 +260,49 @@ class Dataset(object):
             self.elements[c.__dest__] = []
             self.base_elements[name] = c
             
-        self._rids = {}
-        
+        lock = None
+        if threadsafe or flush_interval is not None:
+            lock = threading.RLock()
+            # datetime.strptime imports this on first use, which fails in
+            # threads that race for the import lock (Python issue 7980)
+            import _strptime
+        self._owns_registry = registry is None
+        if registry is None:
+            registry = _Registry(cache_size if lazy else None)
+        self._ctx = _ElementContext(lock, autoflush=swmr and mode != 'r',
+                                    registry=registry,
+                                    stats=_Stats() if collect_stats else None)
+        self._lazy = lazy
+        if lazy:
+            for dest in self.elements:
+                self.elements[dest] = _ElementList(registry, dest,
+                                                   lock=self._ctx.lock)
+        self._swmr = swmr
+        # read-only handles of the files that merged elements link to
+        self._extfiles = {}
+        self._driver_kwargs = {}
+        if in_memory:
+            self._driver_kwargs['driver'] = 'H5FD_CORE'
+            self._driver_kwargs['driver_core_backing_store'] = \
+                int(filename is not None)
+            if filename is None:
+                # the name only has to be unique within this process
+                filename = 'dataset-{:s}.h5'.format(uuid4())
         
-        self._f = tables.open_file(filename, 'a')
+        self._f = self._open(filename, mode, **self._driver_kwargs)
         # Create an array of sha224 hash values; when
         # opening an existing file this will throw an
         # exception
-        try:
-            self._f.create_earray('/','hash',tables.StringAtom(itemsize=28),(0,))
-        except NodeError:
-            pass
+        if mode != 'r':
+            try:
+                self._f.create_earray('/','hash',tables.StringAtom(itemsize=28),(0,))
+            except tables.NodeError:
+                pass
+            else:
+                # only a new file starts with an empty reference index; for
+                # older files it is built on first use
+                self._create_referrers(np.zeros(0, dtype=_REFERRER_DTYPE))
+        self._referrer_cache = None
         
         
         valid_names = [n[:-6] for n in self.base_elements] #names without "Buffer" suffix
@@ -79,15 +318,33 @@ class Dataset(object):
             except KeyError:
                 continue
                  
+        # number of elements per type, to find the types that have new
+        # elements when the file is refreshed
+        self._group_sizes = {}
         for group in self._f.walk_groups('/'):
             if group._v_name is '/' or group._v_name not in valid_names:
                 continue
-            for sgroup in group._v_groups.keys():
+            self._group_sizes[group._v_name] = group._v_nchildren
+            if lazy:
+                self.elements[group._v_name].ids.extend(
+                    self._element_names(group))
+                continue
+            for sgroup in self._element_nodes(group):
                 class_name = dest_name_map[group._v_name]
                 
                 _C = self.base_elements[class_name]
-                e = _C(group._v_groups[sgroup])
+                e = _C(sgroup, context=self._ctx)
                 self.elements[group._v_name].append(e)
+        registry.add_loader(self)
+
+        self._flush_timer = None
+        if flush_interval is not None:
+            self._flush_timer = threading.Event()
+            t = threading.Thread(target=_flush_loop,
+                                 args=(weakref.ref(self), flush_interval,
+                                       self._flush_timer))
+            t.daemon = True
+            t.start()
         
             
     #add context manager methods to allow Dataset objects to be used with the 'with' statement 
@@ -100,7 +357,13 @@ class Dataset(object):
     
     
     def __del__(self):
+        if getattr(self, '_flush_timer', None) is not None:
+            self._flush_timer.set()
+        if not hasattr(self, '_f'):
+            # __init__ failed before opening the file
+            return
         self._f.close()
+        self._close_external()
     
     def __add__(self, other):
         msg = "__add__ is undefined as the return value would "
@@ -132,8 +395,157 @@ class Dataset(object):
                             ref[0] = np.array(newentry)
                         else:
                             ref[0] = rid_dict[ref[0]]
+        self._add_referrers(update_refs)
+        return self
+
+    def merge(self, other):
+        """
+        Add the elements of another dataset by linking to them instead of
+        copying them.
+
+        Every element group of the other file is mounted into this file as
+        an HDF5 external link, so the merged file only holds the links. The
+        elements keep their resource IDs, so references between them are
+        resolved as before without being rewritten. Linked elements are
+        read-only and the other file has to stay where it is.
+
+        :type other: :class:`Dataset` or str
+        :param other: Dataset or name of the HDF5 file to merge. A Dataset
+            that is still open in this process has to be opened read-only.
+        """
+        if isinstance(other, Dataset):
+            other = other._f.filename
+        filename = os.path.abspath(other)
+        if filename == os.path.abspath(self._f.filename):
+            raise ValueError("You can't add a dataset to itself.")
+        with self._ctx.lock:
+            f = self._external(filename)
+            merged = []
+            for dest in self.elements:
+                try:
+                    group = f.get_node('/' + dest)
+                except tables.NoSuchNodeError:
+                    continue
+                try:
+                    self._f.create_group('/', dest)
+                except tables.NodeError:
+                    pass
+                _C = self._dest_class(dest)
+                for node in self._element_nodes(group):
+                    name = node._v_name
+                    target = '{:s}:{:s}'.format(node._v_file.filename,
+                                                node._v_pathname)
+                    try:
+                        link = self._f.get_node('/' + dest, name)
+                    except tables.NoSuchNodeError:
+                        pass
+                    else:
+                        if getattr(link, 'target', None) == target:
+                            # merged before
+                            continue
+                        raise ValueError("Element {:s} already exists in this "
+                                         "dataset.".format(name))
+                    self._f.create_external_link('/' + dest, name, target)
+                    e = self._ctx.registry.get(name)
+                    if e is None or e._root is not node:
+                        e = _C(node, context=self._ctx)
+                    self.elements[dest].append(e)
+                    merged.append(e)
+            self._add_referrers(merged)
+            self._ctx.maybe_flush(self._f)
         return self
 
+    def _element_nodes(self, group):
+        """
+        Return the element groups below a destination group, following
+        external links to merged elements.
+        """
+        return [self._element_node(group, name)
+                for name in self._element_names(group)]
+
+    def _element_names(self, group):
+        """
+        Return the resource ids of the elements below a destination group.
+        """
+        names = group._v_groups.keys()
+        for name, link in group._v_links.items():
+            if isinstance(link, tables.link.ExternalLink):
+                names.append(name)
+        return names
+
+    def _element_node(self, group, name):
+        """
+        Return the group of the element with the given resource id below a
+        destination group or None if there is none.
+        """
+        # the children dictionaries load their nodes in __getitem__ only
+        if name in group._v_groups:
+            return group._v_groups[name]
+        if name in group._v_links:
+            link = group._v_links[name]
+            if isinstance(link, tables.link.ExternalLink):
+                # the target is 'filename:/path'; relative filenames are
+                # relative to the directory of the file holding the link
+                filename, sep, path = link.target.rpartition(':/')
+                filename = os.path.join(
+                    os.path.dirname(group._v_file.filename), filename)
+                return self._external(filename).get_node(sep[1:] + path)
+        return None
+
+    def _dest_class(self, dest):
+        """
+        Return the element class stored in the given destination group.
+        """
+        return [c for c in self.base_elements.values()
+                if c.__dest__ == dest][0]
+
+    def _load(self, rids, dest):
+        """
+        Load the elements with the given resource ids from the file.
+
+        :returns: Dictionary mapping the ids of the elements found in this
+            dataset to the elements.
+        """
+        loaded = {}
+        with self._ctx.lock:
+            if not self._f.isopen:
+                return loaded
+            try:
+                group = self._f.get_node('/' + dest)
+            except tables.NoSuchNodeError:
+                return loaded
+            _C = self._dest_class(dest)
+            for rid in rids:
+                node = self._element_node(group, rid)
+                if node is not None:
+                    loaded[rid] = _C(node, context=self._ctx)
+        return loaded
+
+    def _external(self, filename):
+        """
+        Return a read-only handle of a file that elements are linked to.
+        """
+        filename = os.path.abspath(filename)
+        f = self._extfiles.get(filename)
+        if f is None or not f.isopen:
+            f = self._open(filename, 'r')
+            self._extfiles[filename] = f
+        return f
+
+    def _node(self, filename, path):
+        """
+        Return a node of this file or of a file that elements are linked to.
+        """
+        if filename == self._f.filename:
+            return self._f.get_node(path)
+        return self._external(filename).get_node(path)
+
+    def _close_external(self):
+        for f in self._extfiles.values():
+            if f.isopen:
+                f.close()
+        self._extfiles = {}
+
     def _newdst_group(self, dstgroup, title='', filters=None):
         """
         Create the destination group in a new HDF5 file.
@@ -146,7 +558,7 @@ class Dataset(object):
             # First try if possible intermediate groups already exist.
             try:
                 group2 = self._f.get_node(group, nodename)
-            except NoSuchNodeError:
+            except tables.NoSuchNodeError:
                 # The group does not exist. Create it.
                 with warnings.catch_warnings():
                     warnings.simplefilter('ignore')
@@ -165,7 +577,7 @@ class Dataset(object):
         srcgroup = src._root
         # assign a new resource ID so that both objects can 
         # be referred to within the same session
-        dstgroup = srcgroup._v_parent._v_pathname+'/'+ str(ResourceIdentifier())
+        dstgroup = srcgroup._v_parent._v_pathname+'/'+ str(uuid4())
         
         # Create the new group
         dstgroup = self._newdst_group(dstgroup, title, filters)
@@ -185,7 +597,7 @@ class Dataset(object):
             msg += "duplicated in destination, and if so, enable "
             msg += "overwriting nodes if desired."
             raise RuntimeError(msg)
-        return type(src)(dstgroup)
+        return type(src)(dstgroup, context=self._ctx)
 
     def new(self, data_buffer, pedantic=True, expected_entries=None):
         """
@@ -195,6 +607,11 @@ class Dataset(object):
                                  hold.
         :type expected_entries: integer or None
         """
+        cls = type(data_buffer).__name__[:-6]
+        with self._ctx.lock, self._ctx.timer(cls, 'new'):
+            return self._new(data_buffer, pedantic, expected_entries)
+
+    def _new(self, data_buffer, pedantic, expected_entries):
         if pedantic:
             # If data buffer is incomplete raise an exception
             for k,v in data_buffer.__dict__.iteritems():
@@ -205,27 +622,757 @@ class Dataset(object):
 
         _C = self.base_elements[type(data_buffer).__name__[:-6]] #strip 'Buffer' suffix
         group_name = _C.__dest__#_C.__name__.strip('_')
-        rid = ResourceIdentifier()
+        rid = str(uuid4())
         try:
             self._f.create_group('/',group_name)
         except tables.NodeError:
             pass
         with warnings.catch_warnings():
             warnings.simplefilter('ignore')
-            group = self._f.create_group('/'+group_name,str(rid))
-        e = _C(group,data_buffer, pedantic=pedantic, expected_entries=expected_entries)
+            group = self._f.create_group('/'+group_name,rid)
+        try:
+            e = _C(group,data_buffer, pedantic=pedantic, expected_entries=expected_entries,
+                   context=self._ctx)
+        except:
+            self._ctx.registry.discard(rid)
+            raise
         self.elements[group_name].append(e)
+        self._add_referrers([e])
+        self._ctx.maybe_flush(self._f)
         return e         
     
 
+    def referrers(self, element, etype=None):
+        """
+        Return the elements that refer to the given element.
+
+        The lookup uses an index of all references that is kept up to date
+        by :meth:`new`, :meth:`merge` and ``+=``, so it only costs as much as the number of
+        referrers found.
+
+        :type element: element
+        :param element: The referenced element, e.g. an Instrument.
+        :type etype: str
+        :param etype: Only return referrers of this type (e.g. 'RawData').
+        :returns: List of elements.
+        """
+        with self._ctx.lock:
+            rows = self._referrer_rows(element._resource_id)
+            if etype is not None:
+                rows = rows[rows['etype'] == etype]
+            retval = []
+            for dest in np.unique(rows['etype']):
+                rids = list(np.unique(rows['referrer'][rows['etype'] == dest]))
+                retval.extend(self._ctx.registry.resolve_many(rids, dest))
+        return [e for e in retval if e is not None]
+
+    def _referrer_rows(self, rid):
+        """
+        Return the rows of the reverse reference index for the given
+        resource id.
+        """
+        if 'referrers' in self._f.root:
+            return self._f.root.referrers.read_where(
+                'target == rid', condvars={'rid': rid})
+        # files written before the index existed
+        if self._referrer_cache is None:
+            rows = self._scan_references()
+            if self._f.mode != 'r':
+                self._create_referrers(rows)
+                return self._referrer_rows(rid)
+            self._referrer_cache = rows
+        rows = self._referrer_cache
+        return rows[rows['target'] == rid]
+
+    def _scan_references(self):
+        """
+        Collect the references of all elements by reading every element.
+        """
+        rows = []
+        for dest in self.elements:
+            if len(self._dest_class(dest)._reference_keys) == 0:
+                continue
+            for e in self.elements[dest]:
+                rows.extend(self._reference_rows(e))
+        return np.array(rows, dtype=_REFERRER_DTYPE)
+
+    def _reference_rows(self, e):
+        """
+        Return the reverse reference index rows of an element.
+        """
+        rows = []
+        table = getattr(e._root, 'data', None)
+        if table is None or len(e._reference_keys) == 0:
+            return rows
+        entry = table[0]
+        for k in e._reference_keys:
+            if k not in table.colnames:
+                continue
+            val = entry[k]
+            targets = val if isinstance(val, np.ndarray) else [val]
+            for target in targets:
+                if target != '':
+                    rows.append((target, e.__dest__, e._resource_id, k))
+        return rows
+
+    def _create_referrers(self, rows):
+        """
+        Create the reverse reference index from the given rows.
+        """
+        t = self._f.create_table('/', 'referrers', np.dtype(_REFERRER_DTYPE))
+        if len(rows) > 0:
+            t.append(rows)
+        t.cols.target.create_index()
+        t.flush()
+        return t
+
+    def _add_referrers(self, elements):
+        """
+        Add the references of new elements to the reverse reference index.
+        """
+        if 'referrers' not in self._f.root:
+            # the index of older files is built by referrers()
+            return
+        rows = []
+        for e in elements:
+            rows.extend(self._reference_rows(e))
+        if len(rows) > 0:
+            t = self._f.root.referrers
+            t.append(np.array(rows, dtype=_REFERRER_DTYPE))
+            t.flush()
+
+    def map(self, func, elements, processes=None):
+        """
+        Apply a function to each of the given elements in a pool of worker
+        processes and return the results in order.
+
+        Every worker opens its own read-only copy of the dataset and
+        resolves the elements from picklable handles, so `func` has to be
+        picklable too (e.g. a module level function). A writable HDF5 file
+        is closed in this process while the workers are running; the
+        dataset's lock is held meanwhile, so other threads wait for the
+        file to be reopened.
+
+        :type func: callable
+        :param func: Function taking a single element as argument.
+        :type elements: list
+        :param elements: Elements of this dataset.
+        :type processes: int
+        :param processes: Number of worker processes (default: number of
+            CPUs).
+        """
+        if self._driver_kwargs.get('driver_core_backing_store') == 0:
+            raise ValueError("In-memory datasets without a backing file "
+                             "can't be shared with worker processes.")
+        handles = [e.handle() for e in elements]
+        for h in handles:
+            if h.filename != self._f.filename and \
+                    h.filename not in self._extfiles:
+                raise ValueError("Element {:s} is not part of this "
+                                 "dataset.".format(h.path))
+        with self._ctx.lock:
+            filename = self._f.filename
+            mode = self._f.mode
+            # workers can open a read-only file next to this process, a
+            # writable one has to be closed while they are running
+            reopen = mode != 'r'
+            if reopen:
+                paths = self._element_paths()
+                self._f.close()
+                self._close_external()
+            try:
+                pool = multiprocessing.Pool(processes, _init_map_worker,
+                                            (_all_classes, filename))
+                try:
+                    return pool.map(_HandleCall(func), handles)
+                finally:
+                    pool.close()
+                    pool.join()
+            finally:
+                if reopen:
+                    if mode == 'w':
+                        # don't truncate the file when reopening it
+                        mode = 'a'
+                    self._f = self._open(filename, mode,
+                                         **self._driver_kwargs)
+                    self._rebind_elements(paths)
+
+    def ingest(self, paths, format, processes=None, append=False,
+               pedantic=False, **kwargs):
+        """
+        Read files with a plugin and add their contents to the dataset.
+
+        The files are parsed in a pool of worker processes while this
+        process writes the buffers they return, one file at a time and in
+        the order of `paths`. A file that fails to read or write is skipped
+        and its exception returned in place of its elements. Nothing of a
+        file that fails to write is kept: the elements created for it are
+        removed again and the rows appended to existing elements are
+        truncated. As after a failed :meth:`new`, the space is only
+        reclaimed by :meth:`compact`.
+
+        :type paths: list
+        :param paths: Files to read.
+        :type format: str
+        :param format: Format of a registered plugin, e.g. 'flyspec'.
+        :type processes: int
+        :param processes: Number of worker processes (default: number of
+            CPUs). With 1 the files are read in this process and the plugin
+            gets this dataset as its `dataset` argument; workers pass None.
+        :type append: bool
+        :param append: If True, buffers of extendable classes are appended
+            to the element created from the first file with the same plugin
+            output key instead of creating a new element per file.
+        :type pedantic: bool
+        :param pedantic: Passed on to :meth:`new` and ``append``.
+        :param kwargs: Passed on to the plugin's read method.
+        :returns: A list with an entry per path: a dictionary of the
+            elements created or appended to, keyed like the plugin output,
+            or the exception raised for that file.
+        """
+        # fail early and import the plugin before forking
+        plugin = get_registered_plugins()[format]
+        if processes == 1:
+            def _read(filename):
+                try:
+                    return plugin().read(self, filename, **kwargs)
+                except Exception, e:
+                    return e
+            return self._ingest((_read(p) for p in paths), append, pedantic)
+        self.flush()
+        pool = multiprocessing.Pool(processes)
+        try:
+            tasks = [(format, p, kwargs) for p in paths]
+            return self._ingest(pool.imap(_read_file, tasks), append,
+                                pedantic)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _ingest(self, results, append, pedantic):
+        """
+        Write the plugin output of each file as it becomes available.
+        """
+        ctx = self._ctx
+        targets = {}
+        retval = []
+        for buffers in results:
+            if isinstance(buffers, Exception):
+                retval.append(buffers)
+                continue
+            with ctx.lock:
+                # flush once per file instead of after every element
+                autoflush = ctx.autoflush
+                ctx.autoflush = False
+                elements = {}
+                created = []
+                sizes = []
+                nrows = self._index_sizes()
+                try:
+                    for key in sorted(buffers):
+                        b = buffers[key]
+                        e = targets.get(key)
+                        if e is not None:
+                            sizes.append((e, self._array_sizes(e)))
+                            e.append(b, pedantic=pedantic)
+                        else:
+                            e = self.new(b, pedantic=pedantic)
+                            created.append(e)
+                            if append and e._extendable:
+                                targets[key] = e
+                        elements[key] = e
+                except Exception, e:
+                    self._rollback(created, sizes, nrows)
+                    for key in list(targets):
+                        if targets[key] in created:
+                            del targets[key]
+                    retval.append(e)
+                else:
+                    retval.append(elements)
+                finally:
+                    ctx.autoflush = autoflush
+                ctx.maybe_flush(self._f)
+        return retval
+
+    def _index_sizes(self):
+        """
+        Return the number of rows of the hash and reverse reference index.
+        """
+        nrows = {}
+        for name in ('hash', 'referrers'):
+            if name in self._f.root:
+                nrows[name] = self._f.root._f_get_child(name).nrows
+        return nrows
+
+    @staticmethod
+    def _array_sizes(e):
+        """
+        Return the number of rows of each array property of an element.
+        """
+        sizes = {}
+        for k in e._property_keys:
+            if e._property_dict[k][0] == np.ndarray and k in e._root:
+                sizes[k] = getattr(e._root, k).nrows
+        return sizes
+
+    def _rollback(self, created, sizes, nrows):
+        """
+        Remove the elements created and the rows appended since the sizes
+        were recorded with :meth:`_array_sizes` and :meth:`_index_sizes`.
+        """
+        for e, n in sizes:
+            for k, size in n.items():
+                getattr(e._root, k).truncate(size)
+        for e in created:
+            self.untag([e], list(e.tags))
+            self._ctx.registry.discard(e._resource_id)
+            self._ctx.live.discard(e)
+            self.elements[e.__dest__].remove(e)
+            e._root._f_remove(recursive=True)
+        for name, size in nrows.items():
+            node = self._f.root._f_get_child(name)
+            if node.nrows <= size:
+                continue
+            if name == 'hash':
+                node.truncate(size)
+            else:
+                node.remove_rows(size, node.nrows)
+
+    def follow(self, filename, format, pedantic=False, **kwargs):
+        """
+        Read the lines added to a growing text log file since the last call.
+
+        The first call reads the whole file with the plugin for `format` and
+        creates elements from its output. Later calls only parse the new
+        complete lines, read with the plugin's ``read_from`` method, and
+        append them to the same RawData, Concentration
+        or other extendable elements. Outputs of classes that can't be
+        extended, e.g. a Flux, get a new element for every call that reads
+        rows later than before. Rows that aren't later than the
+        latest time read before for the same plugin output are dropped, so
+        a log that was truncated or replaced is read from the start without
+        duplicating data. Outputs without times, e.g. a Method, are then
+        only used to create elements that don't exist yet. How far
+        each file has been read is stored in the dataset, so a cron job can
+        reopen the dataset and continue where the previous run stopped.
+
+        :type filename: str
+        :param filename: Log file written line by line.
+        :type format: str
+        :param format: Format of a registered plugin, e.g. 'minidoas-raw'.
+        :type pedantic: bool
+        :param pedantic: Passed on to :meth:`new` and ``append``.
+        :param kwargs: Passed on to the plugin's read method.
+        :returns: Dictionary of the elements created or appended to, keyed
+            like the plugin output. Empty if there were no new lines.
+        """
+        plugin = get_registered_plugins()[format]
+        path = os.path.abspath(filename)
+        with self._ctx.lock:
+            state = {}
+            idx = []
+            if 'follow' in self._f.root:
+                t = self._f.root.follow
+                idx = t.get_where_list('path == p', condvars={'p': path})
+                for row in t.read_coordinates(idx):
+                    state[row['key']] = row
+            offset = 0
+            if len(state) > 0:
+                offset = int(state.values()[0]['offset'])
+            # the latest time read so far, kept for every plugin output
+            # separately as they needn't cover the same times
+            lasts = dict((key, row['last']) for key, row in state.items())
+        reset = os.path.getsize(path) < offset
+        if reset:
+            # truncated or replaced
+            offset = 0
+        buffers, offset = plugin().read_from(self, path, offset, **kwargs)
+        if buffers is None:
+            return {}
+
+        elements = {}
+        new_rows = []
+        targets = {}
+        with self._ctx.lock:
+            for key in sorted(buffers):
+                b = buffers[key]
+                nrows = _rows_after(b, lasts.get(key, ''))
+                if nrows == 0:
+                    continue
+                e = None
+                if key in state:
+                    e = self._ctx.registry.resolve(state[key]['element'],
+                                                   state[key]['dest'])
+                if nrows is not None:
+                    dts = np.asarray(b.datetime).astype('datetime64[us]')
+                    lasts[key] = max(lasts.get(key, ''), str(dts.max()))
+                if e is not None and not e._extendable:
+                    if nrows is None:
+                        # e.g. the RawDataType of a log doesn't change
+                        continue
+                    # the new rows of e.g. a Flux get an element of their own
+                    e = None
+                if e is None:
+                    e = self.new(b, pedantic=pedantic)
+                    targets[key] = (e.__dest__, e._resource_id)
+                    if key not in state:
+                        new_rows.append((path, format, key, e.__dest__,
+                                         e._resource_id, 0, ''))
+                elif nrows is None and reset:
+                    # without times the rows read before can't be told
+                    # apart from new ones
+                    continue
+                else:
+                    e.append(b, pedantic=pedantic)
+                elements[key] = e
+            if 'follow' not in self._f.root:
+                self._f.create_table('/', 'follow', np.dtype(_FOLLOW_DTYPE))
+            t = self._f.root.follow
+            if len(new_rows) > 0:
+                t.append(np.array(new_rows, dtype=_FOLLOW_DTYPE))
+            idx = t.get_where_list('path == p', condvars={'p': path})
+            rows = t.read_coordinates(idx)
+            rows['offset'] = offset
+            for row in rows:
+                row['last'] = lasts.get(row['key'], row['last'])
+                if row['key'] in targets:
+                    row['dest'], row['element'] = targets[row['key']]
+            t.modify_coordinates(idx, rows)
+            self._ctx.maybe_flush(self._f)
+        return elements
+
+    def _open(self, filename, mode, **kwargs):
+        """
+        Open the HDF5 file, without file locking in SWMR mode.
+        """
+        if not self._swmr or mode != 'r':
+            return tables.open_file(filename, mode, **kwargs)
+        # PyTables has no option to open a single file without locking, but
+        # HDF5 reads this variable whenever it opens a file
+        with _LOCKING_ENV_LOCK:
+            old = os.environ.get('HDF5_USE_FILE_LOCKING')
+            os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+            try:
+                return tables.open_file(filename, mode, **kwargs)
+            finally:
+                if old is None:
+                    del os.environ['HDF5_USE_FILE_LOCKING']
+                else:
+                    os.environ['HDF5_USE_FILE_LOCKING'] = old
+
+    def refresh(self):
+        """
+        Pick up new elements and new rows that a writer in another process
+        has added since a read-only dataset was opened.
+
+        The file has to be reopened for HDF5 to read its changed metadata.
+        Existing elements are kept and see the new rows of their arrays.
+        Only the groups of element types whose number of elements changed
+        are searched for new elements.
+        """
+        if self._f.mode != 'r':
+            raise ValueError("Only read-only datasets can be refreshed.")
+        with self._ctx.lock:
+            filename = self._f.filename
+            paths = self._element_paths()
+            self._f.close()
+            self._close_external()
+            self._f = self._open(filename, 'r', **self._driver_kwargs)
+            self._rebind_elements(paths)
+            self._referrer_cache = None
+            for dest in self.elements:
+                try:
+                    group = self._f.get_node('/' + dest)
+                except tables.NoSuchNodeError:
+                    continue
+                if group._v_nchildren == self._group_sizes.get(dest):
+                    continue
+                self._group_sizes[dest] = group._v_nchildren
+                if self._lazy:
+                    known = set(self.elements[dest].ids)
+                else:
+                    known = set([e._root._v_name for e in self.elements[dest]])
+                _C = self._dest_class(dest)
+                for name in self._element_names(group):
+                    if name in known:
+                        continue
+                    if self._lazy:
+                        self.elements[dest].ids.append(name)
+                        continue
+                    e = _C(self._element_node(group, name), context=self._ctx)
+                    self.elements[dest].append(e)
+
+    def stitch(self, name, elements, view=None):
+        """
+        Return a read-only array that concatenates an array property of the
+        given elements in time order.
+
+        Elements are ordered by their first timestamp if they have a
+        datetime property. A slice of the returned array reads across
+        element boundaries directly into one output array.
+
+        :type name: str
+        :param name: Name of the array property (e.g. 'd_var').
+        :type elements: list
+        :param elements: Elements of this dataset, all of the same type.
+        :type view: str
+        :param view: If given, the view is stored in the file under this name
+            and can be reopened later with :meth:`stitched`.
+        :returns: :class:`StitchedArray`
+        """
+        elements = list(elements)
+        for e in elements:
+            if e._root._v_file is not self._f and \
+                    e._root._v_file.filename not in self._extfiles:
+                raise ValueError("Element {:s} is not part of this "
+                                 "dataset.".format(e._root._v_pathname))
+            if str(e) != str(elements[0]):
+                raise ValueError("All elements have to be of the same type.")
+            if name not in e._property_keys or \
+                    e._property_dict[name][0] != np.ndarray:
+                msg = "{0:s} is not an array property of class {1:s}"
+                raise AttributeError(msg.format(name, type(e).__name__))
+        with self._ctx.lock:
+            if len(elements) > 0 and 'datetime' in elements[0]._property_keys:
+                # ISO 8601 strings sort in time order
+                def _first(e):
+                    try:
+                        dts = e._root.datetime
+                    except tables.NoSuchNodeError:
+                        return ''
+                    return dts[0] if dts.nrows > 0 else ''
+                elements.sort(key=_first)
+            sa = StitchedArray(elements, name, self._ctx.lock)
+            if view is not None:
+                try:
+                    self._f.create_group('/', 'views')
+                except tables.NodeError:
+                    pass
+                paths = [e._root._v_pathname for e in elements]
+                itemsize = max([len(p) for p in paths] + [1])
+                rows = np.zeros(len(paths), dtype=[('path', 'S%d' % itemsize),
+                                                   ('nrows', np.int64)])
+                rows['path'] = paths
+                rows['nrows'] = np.diff(sa.offsets)
+                try:
+                    t = self._f.create_table('/views', view, rows)
+                except tables.NodeError:
+                    raise ValueError("View '{:s}' already exists.".format(view))
+                t.attrs.name = name
+                self._ctx.maybe_flush(self._f)
+        return sa
+
+    def stitched(self, view):
+        """
+        Reopen a view stored by :meth:`stitch`.
+        """
+        with self._ctx.lock:
+            try:
+                t = self._f.get_node('/views', view)
+            except tables.NoSuchNodeError:
+                raise ValueError("View '{:s}' doesn't exist.".format(view))
+            rows = t.read()
+            name = t.attrs.name
+            elements = []
+            for p in rows['path']:
+                dest, rid = p.split('/')[-2:]
+                elements.append(self._ctx.registry.resolve(rid, dest))
+            return StitchedArray(elements, name, self._ctx.lock,
+                                 nrows=rows['nrows'])
+
+    def _element_paths(self):
+        """
+        Return the HDF5 paths of all elements.
+        """
+        paths = []
+        for e in self._loaded_elements():
+            paths.append((e, e._root._v_file.filename,
+                          e._root._v_pathname))
+        return paths
+
+    def _loaded_elements(self):
+        """
+        Return all element objects of this dataset that are still alive,
+        whether or not the registry still holds them.
+        """
+        return list(self._ctx.live)
+
+    def _rebind_elements(self, paths):
+        """
+        Point all elements to their groups in the currently open file.
+        """
+        for e, filename, path in paths:
+            e._rebind(self._node(filename, path))
+
+    def compact(self, target=None):
+        """
+        Copy all live elements into a fresh file to reclaim the space left
+        behind by removed tags and failed inserts.
+
+        Empty tag slots and elements of failed inserts are dropped, the
+        hash array is rebuilt, and array properties are recompressed with
+        the element classes' current filters. Stored views and links to
+        merged elements are kept.
+
+        :type target: str
+        :param target: Name of the file to write the compacted dataset to.
+            If None, the dataset's own file is replaced and reopened.
+            Readers in other processes have to reopen the file afterwards.
+        :returns: Number of bytes saved.
+        """
+        in_place = target is None
+        if in_place and self._f.mode == 'r':
+            raise ValueError("Read-only datasets can only be compacted "
+                             "into a new target file.")
+        if in_place and \
+                self._driver_kwargs.get('driver_core_backing_store') == 0:
+            raise ValueError("In-memory datasets without a backing file can "
+                             "only be compacted into a new target file.")
+        with self._ctx.lock:
+            self._f.flush()
+            before = self._f.get_filesize()
+            filename = self._f.filename
+            if in_place:
+                fd, target = tempfile.mkstemp(
+                    suffix='.h5', dir=os.path.dirname(os.path.abspath(filename)))
+                os.close(fd)
+            dead, live = self._write_compacted(target)
+            after = os.path.getsize(target)
+            if in_place:
+                # objects of failed inserts may still be alive, too
+                paths = [p for p in self._element_paths()
+                         if p[0]._resource_id in live]
+                for e in dead:
+                    self._ctx.registry.discard(e._resource_id)
+                for e in dead:
+                    self.elements[e.__dest__].remove(e)
+                mode = self._f.mode
+                if mode == 'w':
+                    mode = 'a'
+                self._f.close()
+                self._close_external()
+                shutil.move(target, filename)
+                self._f = self._open(filename, mode, **self._driver_kwargs)
+                self._rebind_elements(paths)
+        return before - after
+
+    def _write_compacted(self, target):
+        """
+        Write the live contents of the dataset to a new file and return the
+        elements that were left out and the resource ids of the ones kept.
+        """
+        dead = []
+        live = set()
+        known = set(self._f.root.hash[:]) if 'hash' in self._f.root else set()
+        hashes = []
+        with tables.open_file(target, 'w') as f:
+            ha = f.create_earray('/', 'hash', tables.StringAtom(itemsize=28),
+                                 (0,))
+            for dest in self.elements:
+                for e in self.elements[dest]:
+                    src = e._root
+                    if src._v_file is not self._f:
+                        # element merged from another file
+                        f.create_external_link(
+                            '/' + dest, src._v_name,
+                            '{:s}:{:s}'.format(src._v_file.filename,
+                                               src._v_pathname),
+                            createparents=True)
+                        live.add(src._v_name)
+                        continue
+                    table = getattr(src, 'data', None)
+                    if table is None or table.nrows < 1:
+                        # left behind by a failed insert
+                        dead.append(e)
+                        continue
+                    dst = f.create_group('/' + dest, src._v_name,
+                                         createparents=True)
+                    src._v_attrs._f_copy(dst)
+                    for node in src._f_iter_nodes():
+                        filters = e.filters
+                        if node._v_name == 'data':
+                            filters = None
+                        node._f_copy(dst, filters=filters)
+                    live.add(src._v_name)
+                    h = table[0]['hash']
+                    if h in known:
+                        hashes.append(h)
+            if len(hashes) > 0:
+                ha.append(np.array(hashes, dtype='S28'))
+            if 'tags' in self._f.root:
+                f.create_group('/', 'tags')
+                for tag, ea in self._f.root.tags._v_children.items():
+                    rids = ea[:]
+                    rids = rids[np.array([r in live for r in rids],
+                                         dtype=bool)]
+                    nea = f.create_earray('/tags', tag,
+                                          tables.StringAtom(itemsize=60), (0,))
+                    if len(rids) > 0:
+                        nea.append(rids)
+            if 'views' in self._f.root:
+                self._f.root.views._f_copy(f.root, recursive=True)
+            if 'follow' in self._f.root:
+                self._f.root.follow._f_copy(f.root)
+            if 'referrers' in self._f.root:
+                rows = self._f.root.referrers.read()
+                rows = rows[np.array([r in live for r in rows['referrer']],
+                                     dtype=bool)]
+                t = f.create_table('/', 'referrers', np.dtype(_REFERRER_DTYPE))
+                if len(rows) > 0:
+                    t.append(rows)
+                t.cols.target.create_index()
+            self._f.root._v_attrs._f_copy(f.root)
+        return dead, live
+
+    def flush(self):
+        """
+        Write all buffered data to disk. For in-memory datasets with a
+        backing file this writes the whole file.
+        """
+        with self._ctx.lock, self._ctx.timer('Dataset', 'flush'):
+            self._f.flush()
+
+    def stats(self):
+        """
+        Return the statistics recorded for a dataset opened with
+        collect_stats=True.
+
+        :returns: Dictionary mapping datamodel class names (and 'Dataset'
+            for file level operations) to dictionaries mapping operations
+            ('new', 'create_arrays', 'hash', 'append', 'getattr', 'read',
+            'flush') to the number of 'calls', the wall 'time' in seconds
+            and the number of 'rows' and 'bytes' written or read.
+        """
+        if self._ctx.stats is None:
+            raise ValueError("Statistics are only recorded for datasets "
+                             "opened with collect_stats=True.")
+        with self._ctx.lock:
+            return self._ctx.stats.as_dict()
+
+    def reset_stats(self):
+        """
+        Clear the statistics recorded so far.
+        """
+        if self._ctx.stats is not None:
+            with self._ctx.lock:
+                self._ctx.stats.clear()
+
     def close(self):
         """
-        Close the HDF5 file and clear the ResourceIdentifiers.
+        Close the HDF5 file and release the resource id registry.
         """
-        for g in self.elements:
-            for e in self.elements[g]:
-                del e._resource_id
-        self._f.close()
+        if self._flush_timer is not None:
+            self._flush_timer.set()
+        with self._ctx.lock:
+            registry = self._ctx.registry
+            registry.remove_loader(self)
+            if self._owns_registry:
+                registry.clear()
+            else:
+                for e in self._loaded_elements():
+                    registry.discard(e._resource_id)
+            self._f.close()
+            self._close_external()
 
     def register_tags(self, tags):
         """
@@ -233,12 +1380,12 @@ class Dataset(object):
         """
         try:
             self._f.create_group('/','tags')
-        except NodeError:
+        except tables.NodeError:
             pass
         for tag in tags:
             try:
                 self._f.create_earray('/tags', tag, tables.StringAtom(itemsize=60), (0,))
-            except NodeError:
+            except tables.NodeError:
                 raise ValueError("Tag '{:s}' has already been registered".format(tag))
 
     def remove_tags(self, tags):
@@ -246,14 +1393,93 @@ class Dataset(object):
         Remove one or more tag names. This will also remove the tag from every
         element that had been tagged.
         """
-        for tag in tags:
-            try:
-                ea = self._f.root.tags._v_children[tag]
-                for rid in ea[:]:
-                    e = ResourceIdentifier(rid).get_referred_object()
-                    e.tags.remove(tag)
-            except (KeyError, NoSuchNodeError):
-                warnings.warn("Can't remove tag {} as it doesn't exist.".format(tag)) 
+        with self._ctx.lock:
+            # including the elements a lazy dataset's cache has dropped but
+            # that are still held elsewhere
+            elements = self._loaded_elements()
+            for tag in tags:
+                try:
+                    ea = self._f.root.tags._v_children[tag]
+                except (KeyError, tables.NoSuchNodeError):
+                    warnings.warn("Can't remove tag {} as it doesn't exist.".format(tag))
+                    continue
+                rids = set(ea[:])
+                for e in elements:
+                    if e._resource_id in rids:
+                        set.discard(e.tags, tag)
+                self._f.remove_node(ea)
+            self._ctx.maybe_flush(self._f)
+
+    def _tag_array(self, tag):
+        """
+        Return the array holding the elements with the given tag.
+        """
+        try:
+            return self._f.root.tags._v_children[tag]
+        except (KeyError, tables.NoSuchNodeError):
+            msg = "Tag {:s} has not been registered yet. "
+            msg += "Use the 'Dataset.register_tags' function first."
+            raise ValueError(msg.format(tag))
+
+    def _local_elements(self, elements):
+        """
+        Check that the elements are stored in this dataset's own file.
+        """
+        elements = list(elements)
+        for e in elements:
+            if e._root._v_file is not self._f:
+                raise ValueError("Element {:s} is not part of this "
+                                 "dataset.".format(e._root._v_pathname))
+        return elements
+
+    def tag(self, elements, tags):
+        """
+        Add one or more tags to several elements at once.
+
+        Each tag array is extended with a single write.
+
+        :type elements: list
+        :param elements: Elements of this dataset.
+        :type tags: list
+        :param tags: Names of registered tags.
+        """
+        elements = self._local_elements(elements)
+        with self._ctx.lock:
+            arrays = [self._tag_array(tag) for tag in tags]
+            for tag, ea in zip(tags, arrays):
+                new = [e for e in elements if tag not in e.tags]
+                if len(new) == 0:
+                    continue
+                ea.append(np.array([e._root._v_name for e in new],
+                                   dtype='S60'))
+                for e in new:
+                    set.add(e.tags, tag)
+            self._ctx.maybe_flush(self._f)
+
+    def untag(self, elements, tags):
+        """
+        Remove one or more tags from several elements at once.
+
+        Each tag array is changed with a single write. As with
+        :meth:`H5Set.remove`, a tag that no element has anymore is
+        unregistered.
+
+        :type elements: list
+        :param elements: Elements of this dataset.
+        :type tags: list
+        :param tags: Names of registered tags.
+        """
+        elements = self._local_elements(elements)
+        with self._ctx.lock:
+            arrays = [self._tag_array(tag) for tag in tags]
+            for tag, ea in zip(tags, arrays):
+                old = [e for e in elements if tag in e.tags]
+                if len(old) == 0:
+                    continue
+                _remove_tag_entries(ea, [e._root._v_name for e in old])
+                for e in old:
+                    set.discard(e.tags, tag)
+            self._ctx.maybe_flush(self._f)
 
     def select(self, *args, **kargs):
         """
@@ -0,0 +1,43 @@
+"""
+Deferred imports of the heavy dependencies of the package.
+"""
+import importlib
+import sys
+
+
+class LazyModule(object):
+    """
+    Placeholder for a module that is only imported once one of its
+    attributes is used, e.g. numpy or PyTables, so that importing the
+    package stays cheap.
+
+    On first use the placeholder is replaced by the module in the globals
+    of the module that created it, so later uses don't go through it::
+
+        np = LazyModule('numpy', __name__)
+
+    :type name: str
+    :param name: Absolute name of the module to import.
+    :type owner: str
+    :param owner: Name of the module holding the placeholder.
+    """
+
+    def __init__(self, name, owner):
+        self.__dict__['_name'] = name
+        self.__dict__['_owner'] = owner
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        owner = sys.modules.get(self._owner)
+        if owner is not None:
+            for key, value in list(vars(owner).items()):
+                if value is self:
+                    setattr(owner, key, module)
+        return getattr(module, attr)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Module {:s} hasn't been imported yet."
+                             .format(self._name))
+
+    def __repr__(self):
+        return '<lazily imported module {!r}>'.format(self._name)
@@ -0,0 +1,279 @@
+import copy
+import datetime
+import os
+
+from dataset import _dataset
+from dataset.class_factory import _Registry
+from dataset.util import parse_iso_8601
+
+
+class ShardedDataset(object):
+    """
+    A dataset that is split into one HDF5 file per day or per month.
+
+    Elements with a datetime property are stored in the shard that covers
+    the first timestamp of their data buffer. All other elements (e.g.
+    instruments, targets, and methods) are shared between the shards and
+    are stored in a separate metadata file. Shards are only opened once
+    they are needed.
+
+    :type directory: str
+    :param directory: Directory holding the metadata file and the shards. It
+        is created if it doesn't exist.
+    :type period: str
+    :param period: Time span covered by each shard, either 'day' or
+        'month'.
+    :type kwargs: dict
+    :param kwargs: Additional keyword arguments (e.g. mode) are passed on to
+        every :class:`Dataset` that is opened.
+    """
+
+    metadata_filename = 'metadata.h5'
+
+    def __init__(self, directory, period='day', **kwargs):
+        if period not in ('day', 'month'):
+            raise ValueError("period has to be either 'day' or 'month'.")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.period = period
+        self._kwargs = kwargs
+        # elements in the shards refer to the shared elements, so all files
+        # resolve references through the same registry
+        maxsize = None
+        if kwargs.get('lazy'):
+            maxsize = kwargs.get('cache_size', _dataset._CACHE_SIZE)
+        self._registry = _Registry(maxsize)
+        self._meta = _dataset.Dataset(
+            os.path.join(directory, self.metadata_filename),
+            registry=self._registry, **kwargs)
+        self._shards = {}
+        # references to elements in shards that haven't been opened yet are
+        # resolved by opening them
+        self._registry.add_loader(self)
+        # element types that don't have a timestamp are shared between the
+        # shards
+        self._timed = set()
+        for name, c in self._meta.base_elements.items():
+            if 'datetime' in c._property_keys:
+                self._timed.add(c.__dest__)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def _key(self, timestamp):
+        """
+        Return the name of the shard covering the given ISO 8601 timestamp.
+        """
+        if self.period == 'day':
+            return timestamp[:10]
+        return timestamp[:7]
+
+    def _span(self, key):
+        """
+        Return the start and end of the time span covered by a shard.
+        """
+        if self.period == 'day':
+            start = datetime.datetime.strptime(key, '%Y-%m-%d')
+            return start, start + datetime.timedelta(days=1)
+        start = datetime.datetime.strptime(key, '%Y-%m')
+        if start.month == 12:
+            return start, start.replace(year=start.year + 1, month=1)
+        return start, start.replace(month=start.month + 1)
+
+    def shard_keys(self):
+        """
+        Return the names of all shards in chronological order without
+        opening them.
+        """
+        keys = []
+        for fn in os.listdir(self.directory):
+            if fn == self.metadata_filename or not fn.endswith('.h5'):
+                continue
+            keys.append(fn[:-3])
+        return sorted(keys)
+
+    def _shard(self, key):
+        """
+        Return the shard with the given name, opening it if necessary.
+        """
+        try:
+            return self._shards[key]
+        except KeyError:
+            pass
+        fn = os.path.join(self.directory, key + '.h5')
+        d = _dataset.Dataset(fn, registry=self._registry, **self._kwargs)
+        if d._f.mode != 'r':
+            for tag in self._registered_tags():
+                try:
+                    d.register_tags([tag])
+                except ValueError:
+                    pass
+        self._shards[key] = d
+        return d
+
+    def _registered_tags(self):
+        try:
+            return list(self._meta._f.root._v_attrs.shard_tags)
+        except AttributeError:
+            return []
+
+    def _dataset_for(self, data_buffer):
+        """
+        Return the Dataset a data buffer has to be written to.
+        """
+        _C = self._meta.base_elements[type(data_buffer).__name__[:-6]]
+        if _C.__dest__ not in self._timed:
+            return self._meta
+        dts = getattr(data_buffer, 'datetime', None)
+        if dts is None or len(dts) < 1:
+            raise ValueError("{:s} buffers need a datetime to be stored in "
+                             "a ShardedDataset.".format(str(data_buffer)))
+        return self._shard(self._key(str(dts[0])))
+
+    def new(self, data_buffer, pedantic=True, expected_entries=None):
+        """
+        Create a new element in the shard covering the data buffer's first
+        timestamp or, for elements without timestamps, in the metadata file.
+        """
+        d = self._dataset_for(data_buffer)
+        return d.new(data_buffer, pedantic=pedantic,
+                     expected_entries=expected_entries)
+
+    def append(self, element, data_buffer, pedantic=True):
+        """
+        Append a data buffer to an element.
+
+        If the buffer's first timestamp falls into a different shard than
+        the element, a new element is created in that shard instead. It
+        continues the element: fixed properties, references and tags that
+        the buffer doesn't set are copied from the element.
+
+        :returns: The element the data was appended to.
+        """
+        d = self._dataset_for(data_buffer)
+        if d._f.filename == element._root._v_file.filename:
+            element.append(data_buffer, pedantic=pedantic)
+            return element
+        return d.new(self._continuation(element, data_buffer), pedantic=False)
+
+    def _continuation(self, element, data_buffer):
+        """
+        Return a copy of the data buffer completed with the fixed
+        properties, references and tags of the element it continues.
+        """
+        buf = copy.copy(data_buffer)
+        # fixed properties are the columns of the element's table, whereas
+        # array properties are extended row by row
+        columns = element._root.data.colnames
+        for key in element._property_keys + element._reference_keys:
+            if key in columns and getattr(buf, key) is None:
+                setattr(buf, key, getattr(element, key))
+        if 'tags' in element._property_keys and buf.tags is None:
+            buf.tags = set(element.tags)
+        return buf
+
+    def register_tags(self, tags):
+        """
+        Register one or more tag names in the metadata file and all shards.
+        """
+        self._meta.register_tags(tags)
+        self._meta._f.root._v_attrs.shard_tags = \
+            self._registered_tags() + list(tags)
+        for key in self.shard_keys():
+            self._shard(key).register_tags(tags)
+
+    @property
+    def elements(self):
+        """
+        All elements of the metadata file and all shards. This opens every
+        shard; use :meth:`select` to only open the ones needed.
+        """
+        return self.select()
+
+    def select(self, etype=None, start=None, end=None):
+        """
+        Return the elements overlapping the given time range.
+
+        Only shards overlapping the time range are opened. Shared elements
+        are always included.
+
+        :type etype: str
+        :param etype: Only return elements of this type (e.g. 'RawData').
+        :type start: :class:`datetime.datetime`
+        :param start: Start of the time range. Open ended if None.
+        :type end: :class:`datetime.datetime`
+        :param end: End of the time range. Open ended if None.
+        :returns: Dictionary mapping element types to lists of elements.
+        """
+        retval = {}
+        for dest, elements in self._meta.elements.items():
+            if etype is None or dest == etype:
+                retval[dest] = list(elements)
+        for key in self.shard_keys():
+            s, e = self._span(key)
+            if (end is not None and s > end) or \
+                    (start is not None and e <= start):
+                continue
+            d = self._shard(key)
+            for dest in self._timed:
+                if etype is not None and dest != etype:
+                    continue
+                for el in d.elements[dest]:
+                    if start is not None or end is not None:
+                        dts = el._root.datetime
+                        if dts.nrows < 1:
+                            continue
+                        if end is not None and parse_iso_8601(dts[0]) > end:
+                            continue
+                        if start is not None and parse_iso_8601(dts[-1]) < start:
+                            continue
+                    retval[dest].append(el)
+        return retval
+
+    def _load(self, rids, dest):
+        """
+        Load elements stored in the shards from the shards that haven't
+        been opened yet.
+
+        :returns: Dictionary mapping the ids of the elements found to the
+            elements.
+        """
+        loaded = {}
+        if dest not in self._timed:
+            return loaded
+        for key in self.shard_keys():
+            if len(rids) == 0:
+                break
+            if key in self._shards:
+                continue
+            loaded.update(self._shard(key)._load(rids, dest))
+            rids = [rid for rid in rids if rid not in loaded]
+        return loaded
+
+    def referrers(self, element, etype=None):
+        """
+        Return the elements in the metadata file and all shards that refer
+        to the given element.
+
+        :type etype: str
+        :param etype: Only return referrers of this type (e.g. 'RawData').
+        """
+        retval = self._meta.referrers(element, etype)
+        for key in self.shard_keys():
+            retval.extend(self._shard(key).referrers(element, etype))
+        return retval
+
+    def close(self):
+        """
+        Close the metadata file and all open shards.
+        """
+        for d in self._shards.values():
+            d.close()
+        self._shards = {}
+        self._meta.close()
+        self._registry.clear()
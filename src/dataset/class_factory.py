@@ -1,354 +1,347 @@
 import collections
-from copy import deepcopy, copy
 import datetime
 import hashlib
-import inspect
-from uuid import uuid4
-import warnings
+import threading
+import time
 import weakref
 
-import numpy as np
-import tables
-
+from dataset._lazy import LazyModule
 import dataset.util
 
-class ResourceIdentifier(object):
+np = LazyModule('numpy', __name__)
+tables = LazyModule('tables', __name__)
+
+
+class _NoLock(object):
+    """
+    Stand-in for a lock when a Dataset is not opened in thread-safe mode.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NO_LOCK = _NoLock()
+
+
+class _Registry(object):
     """
-    Unique identifier of any resource so it can be referred to.
-
-    All elements of a Dataset instance have a unique id that other elements
-    use to refer to it. This is called a ResourceIdentifier.
-
-    In this class it can be any hashable object, e.g. most immutable objects
-    like numbers and strings.
-
-    :type id: str, optional
-    :param id: A unique identifier of the element it refers to. It is
-        not verified, that it actually is unique. The user has to take care of
-        that. If no resource_id is given, uuid.uuid4() will be used to
-        create one which assures uniqueness within one Python run.
-        If no fixed id is provided, the ID will be built from prefix
-        and a random uuid hash. The random hash part can be regenerated by the
-        referred object automatically if it gets changed.
-    :type prefix: str, optional
-    :param prefix: An optional identifier that will be put in front of any
-        automatically created resource id. The prefix will only have an effect
-        if `id` is not specified (for a fixed ID string). Makes automatically
-        generated resource ids more reasonable.
-    :type referred_object: Python object, optional
-    :param referred_object: The object this instance refers to. All instances
-        created with the same resource_id will be able to access the object as
-        long as at least one instance actual has a reference to it.
-
-    .. rubric:: General Usage
-
-    >>> ResourceIdentifier('2012-04-11--385392')
-    ResourceIdentifier(id="2012-04-11--385392")
-    >>> # If 'id' is not specified it will be generated automatically.
-    >>> ResourceIdentifier()  # doctest: +ELLIPSIS
-    ResourceIdentifier(id="...")
-    >>> # Supplying a prefix will simply prefix the automatically generated ID
-    >>> ResourceIdentifier(prefix='peru09')  # doctest: +ELLIPSIS
-    ResourceIdentifier(id="peru09_...")
-
-    ResourceIdentifiers can, and oftentimes should, carry a reference to the
-    object they refer to. This is a weak reference which means that if the
-    object gets deleted or runs out of scope, e.g. gets garbage collected, the
-    reference will cease to exist.
-
-    >>> class A(object): pass
-    >>> a = A()
-    >>> import sys
-    >>> ref_count = sys.getrefcount(a)
-    >>> res_id = ResourceIdentifier(referred_object=a)
-    >>> # The reference does not change the reference count of the object.
-    >>> print(ref_count == sys.getrefcount(a))
-    True
-    >>> # It actually is the same object.
-    >>> print(a is res_id.get_referred_object())
-    True
-    >>> # Deleting it, or letting the garbage collector handle the object will
-    >>> # invalidate the reference.
-    >>> del a
-    >>> print(res_id.get_referred_object())
-    None
-
-    The most powerful ability (and reason why one would want to use a resource
-    identifier class in the first place) is that once a ResourceIdentifier with
-    an attached referred object has been created, any other ResourceIdentifier
-    instances with the same ID can retrieve that object. This works
-    across all ResourceIdentifiers that have been instantiated within one
-    Python run.
-    This enables, e.g. the resource references between the different elements
-    to work in a rather natural way.
-
-    >>> a = A()
-    >>> obj_id = id(a)
-    >>> res_id = "someid"
-    >>> ref_a = ResourceIdentifier(res_id)
-    >>> # The object is refers to cannot be found yet. Because no instance that
-    >>> # an attached object has been created so far.
-    >>> print(ref_a.get_referred_object())
-    None
-    >>> # This instance has an attached object.
-    >>> ref_b = ResourceIdentifier(res_id, referred_object=a)
-    >>> ref_c = ResourceIdentifier(res_id)
-    >>> # All ResourceIdentifiers will refer to the same object.
-    >>> assert(id(ref_a.get_referred_object()) == obj_id)
-    >>> assert(id(ref_b.get_referred_object()) == obj_id)
-    >>> assert(id(ref_c.get_referred_object()) == obj_id)
-
-
-    ResourceIdentifiers are considered identical if the IDs are
-    the same.
-
-    >>> # Create two different resource identifiers.
-    >>> res_id_1 = ResourceIdentifier()
-    >>> res_id_2 = ResourceIdentifier()
-    >>> assert(res_id_1 != res_id_2)
-    >>> # Equalize the IDs. NEVER do this. This is just an example.
-    >>> res_id_2.id = res_id_1.id = "smi:local/abcde"
-    >>> assert(res_id_1 == res_id_2)
-
-    ResourceIdentifier instances can be used as dictionary keys.
-
-    >>> dictionary = {}
-    >>> res_id = ResourceIdentifier(id="foo")
-    >>> dictionary[res_id] = "bar1"
-    >>> # The same ID can still be used as a key.
-    >>> dictionary["foo"] = "bar2"
-    >>> items = sorted(dictionary.items(), key=lambda kv: kv[1])
-    >>> for k, v in items:  # doctest: +ELLIPSIS
-    ...     print repr(k), v
-    ResourceIdentifier(id="foo") bar1
-    ...'foo' bar2
+    Maps the resource ids of the elements of one or more Datasets to the
+    element objects.
+
+    Ids are interned strings, so the registry, the element groups' names
+    and the reference columns read back from the file share one copy of
+    each id. The registry holds the elements themselves rather than weak
+    references and is emptied in one go when its dataset is closed.
+
+    Elements that aren't registered are loaded from the datasets that have
+    been added with :meth:`add_loader`.
+
+    :type maxsize: int
+    :param maxsize: If given, only this many elements are kept and the least
+        recently used ones are dropped, to be loaded again when needed.
+
+    The registry can be shared by threads and by several datasets, so it
+    guards its mapping with a lock of its own. The lock is never held
+    while elements are loaded, which takes the loading dataset's lock.
     """
-    # Class (not instance) attribute that keeps track of all resource
-    # identifier throughout one Python run. Will only store weak references and
-    # therefore does not interfere with the garbage collection.
-    # DO NOT CHANGE THIS FROM OUTSIDE THE CLASS.
-    __resource_id_weak_dict = weakref.WeakValueDictionary()
-    # Use an additional dictionary to track all resource ids.
-    __resource_id_tracker = collections.defaultdict(int)
-
-    def __init__(self, oid=None, prefix=None,
-                 referred_object=None):
-        # Create a resource id if None is given and possibly use a prefix.
-        if oid is None:
-            self.fixed = False
-            self._prefix = prefix
-            self._uuid = str(uuid4())
+
+    __slots__ = ('_elements', '_loaders', '_lock', 'maxsize')
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        if maxsize is None:
+            self._elements = {}
         else:
-            self.fixed = True
-            self.id = oid
-        # Append the referred object in case one is given to the class level
-        # reference dictionary.
-        if referred_object is not None:
-            self.set_referred_object(referred_object)
-
-        # Increment the counter for the current resource id.
-        ResourceIdentifier.__resource_id_tracker[self.id] += 1
-
-    def __del__(self):
-        if self.id not in ResourceIdentifier.__resource_id_tracker:
-            return
-        # Decrement the resource id counter.
-        ResourceIdentifier.__resource_id_tracker[self.id] -= 1
-        # If below or equal to zero, delete it and also delete it from the weak
-        # value dictionary.
-        if ResourceIdentifier.__resource_id_tracker[self.id] <= 0:
-            del ResourceIdentifier.__resource_id_tracker[self.id]
-            try:
-                del ResourceIdentifier.__resource_id_weak_dict[self.id]
-            except KeyError:
-                pass
+            self._elements = collections.OrderedDict()
+        self._loaders = []
+        self._lock = threading.Lock()
 
-    def get_referred_object(self):
+    def register(self, rid, element):
         """
-        Returns the object associated with the resource identifier.
-
-        This works as long as at least one ResourceIdentifier with the same
-        ID as this instance has an associate object.
+        Register an element under the given id and return the interned id.
+        An element already registered under the same id is replaced.
+        """
+        rid = intern(str(rid))
+        with self._lock:
+            if self.maxsize is not None:
+                self._elements.pop(rid, None)
+                while len(self._elements) >= self.maxsize:
+                    self._elements.popitem(last=False)
+            self._elements[rid] = element
+        return rid
+
+    def get(self, rid):
+        """
+        Return the element with the given id or None if it isn't loaded.
+        """
+        with self._lock:
+            if self.maxsize is None:
+                return self._elements.get(rid)
+            e = self._elements.pop(rid, None)
+            if e is not None:
+                self._elements[rid] = e
+            return e
+
+    def resolve(self, rid, dest):
+        """
+        Return the element with the given id, loading it if necessary.
+
+        :type rid: str
+        :param rid: Resource id of the element.
+        :type dest: str
+        :param dest: Group holding elements of the element's type (e.g.
+            'Target').
+        :returns: The element or None if none of the datasets has it.
+        """
+        return self.resolve_many([rid], dest)[0]
 
-        Will return None if no object could be found.
+    def resolve_many(self, rids, dest):
         """
-        try:
-            return ResourceIdentifier.__resource_id_weak_dict[self.id]
-        except KeyError:
-            return None
+        Return the elements with the given ids in one go, loading all the
+        ones that aren't registered with one call per dataset.
+        """
+        found = [self.get(rid) for rid in rids]
+        missing = [rid for rid, e in zip(rids, found) if e is None]
+        for ref in self._loaders:
+            if len(missing) == 0:
+                break
+            d = ref()
+            if d is None:
+                continue
+            loaded = d._load(missing, dest)
+            missing = [rid for rid in missing if rid not in loaded]
+            found = [loaded.get(rid, e) if e is None else e
+                     for rid, e in zip(rids, found)]
+        return found
 
-    def set_referred_object(self, referred_object):
+    def add_loader(self, dataset):
         """
-        Sets the object the ResourceIdentifier refers to.
+        Load missing elements from the given dataset. Only a weak reference
+        to the dataset is kept.
+        """
+        self._loaders.append(weakref.ref(dataset))
+
+    def remove_loader(self, dataset):
+        self._loaders = [ref for ref in self._loaders
+                         if ref() is not None and ref() is not dataset]
 
-        If it already a weak reference it will be used, otherwise one will be
-        created. If the object is None, None will be set.
+    def values(self):
+        with self._lock:
+            return list(self._elements.values())
 
-        Will also append self again to the global class level reference list so
-        everything stays consistent.
+    def discard(self, rid):
+        with self._lock:
+            self._elements.pop(rid, None)
+
+    def clear(self):
+        with self._lock:
+            self._elements.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._elements)
+
+
+class _Timer(object):
+    """
+    Context manager adding a call and its wall time to a :class:`_Stats`
+    counter.
+    """
+
+    __slots__ = ('_counter', '_t0')
+
+    def __init__(self, counter):
+        self._counter = counter
+
+    def __enter__(self):
+        self._t0 = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self._counter[0] += 1
+        self._counter[1] += time.time() - self._t0
+        return False
+
+
+class _Stats(object):
+    """
+    Call counts, wall time, rows and bytes per datamodel class and
+    operation.
+    """
+
+    __slots__ = ('_counters',)
+
+    def __init__(self):
+        self._counters = {}
+
+    def _counter(self, cls, op):
+        key = (cls, op)
+        c = self._counters.get(key)
+        if c is None:
+            # calls, seconds, rows, bytes
+            c = self._counters[key] = [0, 0., 0, 0]
+        return c
+
+    def timer(self, cls, op):
+        return _Timer(self._counter(cls, op))
+
+    def add(self, cls, op, rows=0, nbytes=0):
         """
-        # If it does not yet exists simply set it.
-        if self.id not in ResourceIdentifier.__resource_id_weak_dict:
-            ResourceIdentifier.__resource_id_weak_dict[self.id] = \
-                referred_object
-            return
-        # Otherwise check if the existing element the same as the new one. If
-        # it is do nothing, otherwise raise a warning and set the new object as
-        # the referred object.
-        if ResourceIdentifier.__resource_id_weak_dict[self.id] == \
-                referred_object:
-            return
-        msg = "The resource identifier '%s' already exists and points to " + \
-              "another object: '%s'." + \
-              "It will now point to the object referred to by the new " + \
-              "resource identifier."
-        msg = msg % (
-            self.id,
-            repr(ResourceIdentifier.__resource_id_weak_dict[self.id]))
-        # Always raise the warning!
-        warnings.warn_explicit(msg, UserWarning, __file__,
-                               inspect.currentframe().f_back.f_lineno)
-        ResourceIdentifier.__resource_id_weak_dict[self.id] = \
-            referred_object
-
-    def copy(self):
+        Add rows and bytes read or written to a counter.
         """
-        Returns a copy of the ResourceIdentifier.
-
-        >>> res_id = ResourceIdentifier()
-        >>> res_id_2 = res_id.copy()
-        >>> print(res_id is res_id_2)
-        False
-        >>> print(res_id == res_id_2)
-        True
+        c = self._counter(cls, op)
+        c[2] += rows
+        c[3] += nbytes
+
+    def add_data(self, cls, op, val):
+        """
+        Add the rows and bytes of a value read or written to a counter.
         """
-        return deepcopy(self)
+        if isinstance(val, np.ndarray):
+            self.add(cls, op, val.shape[0] if val.ndim > 0 else 1, val.nbytes)
+        else:
+            self.add(cls, op, 1, len(val) if isinstance(val, str) else 8)
 
-    @property
-    def id(self):
+    def add_arrays(self, cls, op, avals):
         """
-        Unique identifier of the current instance.
+        Add the array properties written from one buffer to a counter.
+        Bytes are summed over all arrays, whereas the rows are counted once:
+        the length of the datetime array if there is one, otherwise the
+        length of the longest array.
         """
-        if self.fixed:
-            return self.__dict__.get("id")
+        if len(avals) == 0:
+            return
+        nbytes = sum([val.nbytes for val in avals.values()])
+        if 'datetime' in avals:
+            rows = len(avals['datetime'])
         else:
-            oid = self.prefix
-            if oid is not None and not oid.endswith("_"):
-                oid += "_"
-                oid += self.uuid
-                return oid
-            return self.uuid
-
-    @id.deleter
-    def id(self):
-        msg = "The resource id cannot be deleted."
-        raise Exception(msg)
-
-    @id.setter
-    def id(self, value):
-        self.fixed = True
-        # XXX: no idea why I had to add bytes for PY2 here
-        if not isinstance(value, (str, bytes)):
-            msg = "attribute id needs to be a string."
-            raise TypeError(msg)
-        self.__dict__["id"] = value
+            rows = max([val.shape[0] if val.ndim > 0 else 1
+                        for val in avals.values()])
+        self.add(cls, op, rows, nbytes)
 
-    @property
-    def prefix(self):
-        return self._prefix
+    def as_dict(self):
+        retval = {}
+        for (cls, op), c in self._counters.items():
+            retval.setdefault(cls, {})[op] = {'calls': c[0], 'time': c[1],
+                                              'rows': c[2], 'bytes': c[3]}
+        return retval
 
-    @prefix.deleter
-    def prefix(self):
-        self._prefix = ""
+    def clear(self):
+        self._counters.clear()
 
-    @prefix.setter
-    def prefix(self, value):
-        if not isinstance(value, str):
-            msg = "prefix id needs to be a string."
-            raise TypeError(msg)
-        self._prefix = value
 
-    @property
-    def uuid(self):
-        return self._uuid
+class _ElementContext(object):
+    """
+    State a Dataset shares with all of its elements.
+
+    :type lock: :class:`threading.RLock`
+    :param lock: Lock that every HDF5 call of the dataset's elements has to
+        acquire. If None, no locking is done.
+    :type autoflush: bool
+    :param autoflush: If True, the HDF5 file is flushed after every change
+        so that readers in other processes see complete data.
+    :type registry: :class:`_Registry`
+    :param registry: Registry used to resolve references between elements.
+        A new one is created if None.
+    :type stats: :class:`_Stats`
+    :param stats: Counters to record the time spent in each operation in.
+        If None, nothing is recorded.
+
+    All element objects created in the context are tracked in
+    :attr:`live` until they are garbage collected, including the ones a
+    size-limited registry has dropped but that are still held elsewhere.
+    """
 
-    @uuid.deleter
-    def uuid(self):
+    def __init__(self, lock=None, autoflush=False, registry=None, stats=None):
+        if lock is None:
+            lock = _NO_LOCK
+        if registry is None:
+            registry = _Registry()
+        self.lock = lock
+        self.autoflush = autoflush
+        self.registry = registry
+        self.stats = stats
+        # a set rather than a mapping by id, as an element evicted from the
+        # registry and loaded again exists as more than one object
+        self.live = weakref.WeakSet()
+
+    def timer(self, cls, op):
         """
-        Deleting is uuid hash is forbidden and will not work.
+        Return a context manager timing an operation, or one that does
+        nothing if no stats are collected.
         """
-        msg = "The uuid cannot be deleted."
-        raise Exception(msg)
+        if self.stats is None:
+            return _NO_LOCK
+        return self.stats.timer(cls, op)
 
-    @uuid.setter
-    def uuid(self, value):  # @UnusedVariable
+    def maybe_flush(self, f):
         """
-        Setting is uuid hash is forbidden and will not work.
+        Flush the HDF5 file in autoflush mode.
         """
-        msg = "The uuid cannot be set manually."
-        raise Exception(msg)
-
-    @property
-    def resource_id(self):
-        return self.id
+        if self.autoflush:
+            with self.timer('Dataset', 'flush'):
+                f.flush()
 
-    @resource_id.deleter
-    def resource_id(self):
-        del self.id
 
-    @resource_id.setter
-    def resource_id(self, value):
-        self.id = value
+class ElementHandle(object):
+    """
+    Picklable reference to a data element that can be sent to another
+    process and resolved there against that process' own Dataset.
+
+    :type filename: str
+    :param filename: Name of the HDF5 file holding the element.
+    :type path: str
+    :param path: Path of the element's group within the HDF5 file.
+    :type etype: str
+    :param etype: Name of the element's datamodel class (e.g. 'RawData').
+    """
 
-    def __str__(self):
-        return self.id
+    def __init__(self, filename, path, etype):
+        self.filename = filename
+        self.path = path
+        self.etype = etype
 
-    def _repr_pretty_(self, p, cycle):
-        p.text(str(self))
+    def resolve(self, dataset):
+        """
+        Return the element this handle refers to from the given Dataset.
+        """
+        node = dataset._node(self.filename, self.path)
+        e = dataset._ctx.registry.get(node._v_name)
+        if e is None or str(e) != self.etype:
+            e = dataset.base_elements[self.etype](node, context=dataset._ctx)
+        return e
 
     def __repr__(self):
-        return 'ResourceIdentifier(id="%s")' % self.id
+        return 'ElementHandle(filename="%s", path="%s", etype="%s")' % (
+            self.filename, self.path, self.etype)
 
     def __eq__(self, other):
-        if self.id == other:
-            return True
-        if not isinstance(other, ResourceIdentifier):
+        if not isinstance(other, ElementHandle):
             return False
-        if self.id == other.id:
-            return True
-        return False
+        return (self.filename, self.path, self.etype) == \
+            (other.filename, other.path, other.etype)
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    def __hash__(self):
-        """
-        Uses the same hash as the resource id. This means that class instances
-        can be used in dictionaries and other hashed types.
-
-        Both the object and it's id can still be independently used as
-        dictionary keys.
-        """
-        # "Salt" the hash with a string so the hash of the object and a
-        # string identical to the id can both be used as individual
-        # dictionary keys.
-        return hash("RESOURCE_ID") + self.id.__hash__()
-
-    def regenerate_uuid(self):
-        """
-        Regenerates the uuid part of the ID. Does nothing for resource
-        identifiers with a user-set, fixed id.
-        """
-        self._uuid = str(uuid4())
-
 
 class RetVal(object):
     """
     Wrapper to make tables.array.Array read only.
+
+    If a lock is given, reading from the wrapped object is done while
+    holding it. If stats are given, reads are recorded under the name of
+    the element's class.
     """
 
-    def __init__(self, wrapped_object):
+    def __init__(self, wrapped_object, lock=_NO_LOCK, stats=None, cls=None):
         self.__dict__['_wrapped_object'] = wrapped_object
+        self.__dict__['_lock'] = lock
+        self.__dict__['_stats'] = stats
+        self.__dict__['_cls'] = cls
         attributes = dir(wrapped_object)
         for attr in attributes:
             if hasattr(self, attr):
@@ -365,15 +358,35 @@ class RetVal(object):
         raise AttributeError('Data type is read only.')
 
     def __getattribute__(self, key):
-        if key in ['_wrapped_object', '__dict__', '__class__']:
+        if key in ['_wrapped_object', '_lock', '_stats', '_cls', '__dict__',
+                   '__class__', '_read']:
             return object.__getattribute__(self, key)
-        return getattr(self._wrapped_object, key)
+        val = getattr(self._wrapped_object, key)
+        lock = self._lock
+        if lock is not _NO_LOCK and callable(val):
+            # e.g. read() or iterrows() also have to hold the lock
+            def _locked(*args, **kwargs):
+                with lock:
+                    return val(*args, **kwargs)
+            return _locked
+        return val
 
     def __getitem__(self,key):
-        return self._wrapped_object.__getitem__(key)
+        return self._read(key)
+
+    def _read(self, key):
+        stats = self._stats
+        if stats is None:
+            with self._lock:
+                return self._wrapped_object.__getitem__(key)
+        with self._lock, stats.timer(self._cls, 'read'):
+            val = self._wrapped_object.__getitem__(key)
+        stats.add_data(self._cls, 'read', val)
+        return val
 
     def __str__(self):
-        return self._wrapped_object.__str__()
+        with self._lock:
+            return self._wrapped_object.__str__()
 
 
 class RetValDatetime(RetVal):
@@ -382,9 +395,140 @@ class RetValDatetime(RetVal):
     Python datetime objects.
     """
     def __getitem__(self, key):
+        val = self._read(key)
+        if isinstance(key, slice):
+            return np.array([dataset.util.parse_iso_8601(i) for i in val])
+        return dataset.util.parse_iso_8601(val)
+
+
+class StitchedArray(object):
+    """
+    Read only view that concatenates an array property of several elements
+    along the first axis.
+
+    Slicing reads the rows of every element overlapping the slice straight
+    into one preallocated array, so no intermediate arrays have to be
+    concatenated. The view is a snapshot of the element sizes at the time it
+    was created; rows appended to the elements later are not part of it.
+
+    :type elements: list
+    :param elements: Elements in the order their rows are to be stitched.
+    :type name: str
+    :param name: Name of the array property (e.g. 'd_var').
+    :type lock: lock
+    :param lock: Lock to hold while reading from the HDF5 file.
+    :type nrows: list
+    :param nrows: Number of rows to use from each element (default: all
+        rows the elements have now).
+    """
+
+    def __init__(self, elements, name, lock=_NO_LOCK, nrows=None):
+        self.elements = list(elements)
+        self.name = name
+        self._lock = lock
+        if nrows is None:
+            nrows = [getattr(e._root, name).nrows for e in self.elements]
+        # offsets[i] is the first row of element i in the stitched array
+        self.offsets = np.concatenate(([0], np.cumsum(nrows))).astype(np.int64)
+        if len(self.elements) > 0:
+            node = getattr(self.elements[0]._root, name)
+            self.dtype = node.atom.dtype
+            self._rowshape = tuple(node.shape[1:])
+            prop = self.elements[0]._property_dict[name]
+            self._datetime = prop[1] == datetime.datetime
+        else:
+            self.dtype = np.dtype(np.float64)
+            self._rowshape = ()
+            self._datetime = False
+
+    @property
+    def shape(self):
+        return (int(self.offsets[-1]),) + self._rowshape
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def read(self, start=None, stop=None):
+        """
+        Return the rows start to stop of the stitched array.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        out = np.empty((stop - start,) + self._rowshape, dtype=self.dtype)
+        first = np.searchsorted(self.offsets, start, side='right') - 1
+        last = np.searchsorted(self.offsets, stop, side='left')
+        if len(self.elements) == 0:
+            return out
+        ctx = self.elements[0]._ctx
+        cls = str(self.elements[0])
+        with self._lock, ctx.timer(cls, 'read'):
+            for i in range(max(first, 0), min(last, len(self.elements))):
+                lo = max(start, self.offsets[i])
+                hi = min(stop, self.offsets[i + 1])
+                if hi <= lo:
+                    continue
+                node = getattr(self.elements[i]._root, self.name)
+                node.read(lo - self.offsets[i], hi - self.offsets[i],
+                          out=out[lo - start:hi - start])
+        if ctx.stats is not None:
+            ctx.stats.add_data(cls, 'read', out)
+        return out
+
+    def __getitem__(self, key):
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                val = self.read(start, stop)
+            else:
+                rows = np.arange(start, stop, step)
+                if len(rows) == 0:
+                    val = self.read(0, 0)
+                else:
+                    lo = rows.min()
+                    val = self.read(lo, rows.max() + 1)[rows - lo]
+        else:
+            key = int(key)
+            if key < 0:
+                key += len(self)
+            if key < 0 or key >= len(self):
+                raise IndexError("Index out of range.")
+            val = self.read(key, key + 1)[0]
+        if rest:
+            if isinstance(key, slice):
+                rest = (slice(None),) + rest
+            val = val[rest]
+        if not self._datetime:
+            return val
         if isinstance(key, slice):
-            return np.array([dataset.util.parse_iso_8601(i) for i in self._wrapped_object.__getitem__(key)])
-        return dataset.util.parse_iso_8601(self._wrapped_object.__getitem__(key))
+            return np.array([dataset.util.parse_iso_8601(i) for i in val])
+        return dataset.util.parse_iso_8601(val)
+
+    def __setitem__(self, key, value):
+        raise AttributeError('Data type is read only.')
+
+
+def _remove_tag_entries(ea, names):
+    """
+    Empty the slots of the given element names in a tag array.
+
+    The array is rewritten without empty slots once more than half of them
+    are empty and is removed once all of them are.
+    """
+    entries = ea[:]
+    idx = np.where(np.in1d(entries, np.array(names, dtype='S60')))[0]
+    if len(idx) > 0:
+        entries[idx] = ''
+    live = entries[entries != '']
+    if len(live) == 0:
+        ea._v_file.remove_node(ea)
+    elif len(live) < len(entries) / 2:
+        ea.truncate(0)
+        ea.append(live)
+    elif len(idx) > 0:
+        ea[idx] = entries[idx]
 
 
 class H5Set(set):
@@ -392,8 +536,9 @@ class H5Set(set):
     An hdf5 set class for tags.
     """
 
-    def __init__(self, h5node):
+    def __init__(self, h5node, lock=_NO_LOCK):
         self.h5node = h5node
+        self.lock = lock
         # check for already existing tags e.g. when 
         # reading in a file
         f = self.h5node._v_file
@@ -407,6 +552,10 @@ class H5Set(set):
             pass
 
     def add(self, val):
+        with self.lock:
+            self._add(val)
+
+    def _add(self, val):
         f = self.h5node._v_file
         if val in self:
             return
@@ -421,16 +570,10 @@ class H5Set(set):
             msg = "Tag {:s} has not been registered yet. "
             msg += "Use the 'Dataset.register_tags' function first."
             raise ValueError(msg.format(val))
-        found = False
-        for i in range(ea.nrows):
-            if ea[i] == '':
-                ea[i] = np.array(
-                    self.h5node._v_name, dtype='S60')
-                found = True
-                break
-        if not found:
-            ea.append(
-                np.array([self.h5node._v_name], dtype='S60'))
+        # Tags are only ever appended; slots freed by remove() are
+        # reclaimed in bulk there
+        ea.append(
+            np.array([self.h5node._v_name], dtype='S60'))
 
     def append(self, val):
         """
@@ -439,13 +582,14 @@ class H5Set(set):
         self.add(val)
 
     def remove(self, val):
+        with self.lock:
+            self._remove(val)
+
+    def _remove(self, val):
         f = self.h5node._v_file
         super(H5Set,self).remove(val)
-        ea = f.root.tags._v_children[val]
-        ea[np.where(ea[:] == self.h5node._v_name.encode())] = np.array(
-            [''], dtype='S60')
-        if np.all(ea[:] == np.array('', dtype='S60')):
-            f.remove_node('/tags/' + val)
+        _remove_tag_entries(f.root.tags._v_children[val],
+                            [self.h5node._v_name])
 
     def pop(self):
         val = set.pop(self)
@@ -483,6 +627,8 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
         """
         A base class with type checking for non-extendable elements in the datamodel.
         """
+        _extendable = False
+
         # Assign properties of the data element including the expected data types
         _properties = []
         for item in class_attributes:
@@ -506,16 +652,24 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
                  np.int64: tables.IntAtom(),
                  np.string_: tables.StringAtom(itemsize=128)}
 
-        def __init__(self, h5node, data_buffer=None, pedantic=True, expected_entries=None):
+        # Compression used for array properties
+        filters = tables.Filters(complib='zlib', complevel=5)
+
+        def __init__(self, h5node, data_buffer=None, pedantic=True, expected_entries=None,
+                     context=None):
             # Set the parent HDF5 group after type checking
             if (type(h5node) is not tables.group.Group):
                 raise Exception("%s and %s are incompatible types." %
                                 (type(h5node), tables.group.Group))
+            if context is None:
+                context = _ElementContext()
+            self.__dict__['_ctx'] = context
             self.__dict__['_root'] = h5node
-            self.__dict__['_tags'] = H5Set(h5node)
-            # Every time a new object is created it gets a new resource ID
-            self.__dict__['_resource_id'] = ResourceIdentifier(oid=h5node._v_name,
-                                                              referred_object=self)
+            self.__dict__['_tags'] = H5Set(h5node, context.lock)
+            # The resource ID is the name of the element's group
+            self.__dict__['_resource_id'] = context.registry.register(
+                h5node._v_name, self)
+            context.live.add(self)
             if not hasattr(h5node._v_attrs, 'creation_time'):
                 self.__dict__['creation_time'] = datetime.datetime.utcnow().isoformat()
                 h5node._v_attrs.creation_time = self.creation_time
@@ -585,17 +739,22 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
                         entry[key]  = val
                         s.update('{}'.format(val))
                     
-                    self._create_arrays(h5node, avals, expected_entries, s)
+                    cls = str(self)
+                    with context.timer(cls, 'create_arrays'):
+                        self._create_arrays(h5node, avals, expected_entries, s)
+                    if context.stats is not None:
+                        context.stats.add_arrays(cls, 'create_arrays', avals)
                     
-                    h = s.digest()
-                    entry['hash'] = h
-                    f = self._root._v_file
-                    ea = f.root.hash
-                    if pedantic and h in ea:
-                        msg = ("You can't add the same dataset "
-                               "more than once if 'pedantic=True'.")
-                        raise ValueError(msg)
-                    ea.append(np.array([h],dtype='S28'))
+                    with context.timer(cls, 'hash'):
+                        h = s.digest()
+                        entry['hash'] = h
+                        f = self._root._v_file
+                        ea = f.root.hash
+                        if pedantic and h in ea:
+                            msg = ("You can't add the same dataset "
+                                   "more than once if 'pedantic=True'.")
+                            raise ValueError(msg)
+                        ea.append(np.array([h],dtype='S28'))
                     entry.append()
                     table.flush() 
         
@@ -611,8 +770,7 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
                     vl = f.create_carray(h5node, key, 
                                          atom=self.dtmap[val.dtype.type],
                                          shape=val.shape,
-                                         filters=tables.Filters(complib='zlib', 
-                                                                complevel=5))
+                                         filters=self.filters)
                     vl[:] = val
                 except Exception, e:
                     print key, val
@@ -626,6 +784,21 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
         def tags(self):
             return self._tags
 
+        def handle(self):
+            """
+            Return a picklable :class:`ElementHandle` for this element.
+            """
+            return ElementHandle(self._root._v_file.filename,
+                                 self._root._v_pathname, str(self))
+
+        def _rebind(self, h5node):
+            """
+            Point the element to the given HDF5 group after its file has
+            been reopened.
+            """
+            self.__dict__['_root'] = h5node
+            self._tags.h5node = h5node
+
         def __str__(self):
             return class_name.strip('_')
 
@@ -635,28 +808,63 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
                 '{} attributes are read only. Use append method instead.'.format(type(self).__name__))
 
         def __getattr__(self, name):
-            table = getattr(self._root,'data')
-            if name in self._property_keys:
-                if self._property_dict[name][0] == np.ndarray:
-                    if self._property_dict[name][1] == datetime.datetime:
-                        return RetValDatetime(getattr(self._root,name))
-                    return RetVal(getattr(self._root,name))
-                
-                if self._property_dict[name][0] == datetime.datetime:
-                    return RetValDatetime(getattr(table.cols,name))[0]
-                return RetVal(getattr(table.cols,name))[0]
-            
-            elif name in self._reference_keys:
-                if self._reference_dict[name][0] == np.ndarray:
-                    _t = []
-                    for val in table[0][name]:
-                        _t.append(ResourceIdentifier(val).get_referred_object())
-                    return _t
+            ctx = self._ctx
+            lock = ctx.lock
+            stats = ctx.stats
+            cls = str(self)
+            with lock, ctx.timer(cls, 'getattr'):
+                table = getattr(self._root,'data')
+                if name in self._property_keys:
+                    if self._property_dict[name][0] == np.ndarray:
+                        if self._property_dict[name][1] == datetime.datetime:
+                            return RetValDatetime(getattr(self._root,name), lock,
+                                                  stats, cls)
+                        return RetVal(getattr(self._root,name), lock, stats, cls)
+
+                    if self._property_dict[name][0] == datetime.datetime:
+                        return RetValDatetime(getattr(table.cols,name), lock,
+                                              stats, cls)[0]
+                    return RetVal(getattr(table.cols,name), lock, stats, cls)[0]
+
+                elif name in self._reference_keys:
+                    registry = self._ctx.registry
+                    if self._reference_dict[name][0] == np.ndarray:
+                        dest = self._reference_dict[name][1].__dest__
+                        return registry.resolve_many(list(table[0][name]), dest)
+                    else:
+                        dest = self._reference_dict[name][0].__dest__
+                        return registry.resolve(table[0][name], dest)
                 else:
-                    return ResourceIdentifier(table[0][name]).get_referred_object()
-            else:
-                msg = "{0:s} is not a property or reference of class {1:s}"
+                    msg = "{0:s} is not a property or reference of class {1:s}"
+                    raise AttributeError(msg.format(name, type(self).__name__))
+
+        def read_into(self, name, out, start=None, stop=None):
+            """
+            Read the rows start to stop of an array property into a
+            preallocated numpy array instead of allocating a new one.
+
+            :type name: str
+            :param name: Name of the array property (e.g. 'd_var').
+            :type out: :class:`numpy.ndarray`
+            :param out: Array to fill. Its shape has to match the selected
+                rows and its dtype the stored dtype. Datetime properties are
+                stored as ISO 8601 strings and are filled in as such.
+            :type start: int
+            :param start: First row to read (default: 0).
+            :type stop: int
+            :param stop: Row after the last row to read (default: all rows).
+            :returns: out
+            """
+            if name not in self._property_keys or \
+                    self._property_dict[name][0] != np.ndarray:
+                msg = "{0:s} is not an array property of class {1:s}"
                 raise AttributeError(msg.format(name, type(self).__name__))
+            ctx = self._ctx
+            with ctx.lock, ctx.timer(str(self), 'read'):
+                getattr(self._root, name).read(start, stop, out=out)
+            if ctx.stats is not None:
+                ctx.stats.add_data(str(self), 'read', out)
+            return out
 
         def __repr__(self):
             msg = ''
@@ -685,10 +893,17 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
         """
         A base class with type checking for extendable elements in the datamodel.
         """
-        def __init__(self, h5node, data_buffer=None, pedantic=True, expected_entries=None):
-            super(ExpandableDataElement,self).__init__(h5node,data_buffer,pedantic)
-            self.__dict__['modification_time'] = self.creation_time 
-            h5node._v_attrs.modification_time = self.modification_time
+        _extendable = True
+
+        def __init__(self, h5node, data_buffer=None, pedantic=True, expected_entries=None,
+                     context=None):
+            super(ExpandableDataElement,self).__init__(h5node,data_buffer,pedantic,
+                                                       expected_entries, context)
+            if not hasattr(h5node._v_attrs, 'modification_time'):
+                self.__dict__['modification_time'] = self.creation_time
+                h5node._v_attrs.modification_time = self.modification_time
+            else:
+                self.__dict__['modification_time'] = h5node._v_attrs.modification_time
         
         def _create_arrays(self, h5node, avals, expected_nrows, hash_obj):
             
@@ -701,8 +916,7 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
                                          atom=self.dtmap[val.dtype.type],
                                          expectedrows=expected_nrows,
                                          shape=tuple(shape),
-                                         filters=tables.Filters(complib='zlib', 
-                                                                complevel=5))
+                                         filters=self.filters)
                 except Exception, e:
                     print key, val
                     print val.dtype.type
@@ -728,6 +942,10 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
             return msg
 
         def append(self, databuffer, pedantic=True):
+            with self._ctx.lock, self._ctx.timer(str(self), 'append'):
+                self._append(databuffer, pedantic)
+
+        def _append(self, databuffer, pedantic):
             table = getattr(self._root, 'data')
             #s = hashlib.sha1()
             entry = table.row
@@ -767,7 +985,7 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
                         prop_type = self._reference_dict[key]
                         
                         if prop_type[0] == np.ndarray:
-                            ids = set([ResourceIdentifier(j).id for j in table[0][key]])
+                            ids = set(table[0][key])
                             
                             if ids != set(val):
                                 msg = ("{} contains a list of references called {} with "
@@ -777,19 +995,21 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
                                    "".format(str(databuffer), key,val, ids)
                                    )
                         
-                        elif ResourceIdentifier(table[0][key]).id != val:
+                        elif table[0][key] != val:
                             msg = ("{} contains a reference to an {} with "
                                    "resource id {} which does"
                                    " not match the corresponding entry in the "
                                    "dataset with resource id {}"
                                    "".format(str(databuffer), 
-                                             str(ResourceIdentifier(table[0][key]).get_referred_object(),
-                                             val, ResourceIdentifier(table[0][key]).id))
+                                             str(self._ctx.registry.resolve(
+                                                 table[0][key], prop_type[0].__dest__)),
+                                             val, table[0][key])
                                    )
                             raise ValueError(msg)
         
                     
             
+            avals = {}
             for key,val in databuffer.__dict__.iteritems():
                 
                 if val is not None:
@@ -801,10 +1021,14 @@ def _class_factory(class_name, class_type='base', class_attributes=[], class_ref
                     if prop_type[0] == np.ndarray:
                         vl = getattr(self._root,key)
                         vl.append(val)
+                        avals[key] = val
+            if self._ctx.stats is not None:
+                self._ctx.stats.add_arrays(str(self), 'append', avals)
     
             table.flush()
             self.__dict__['modification_time'] = datetime.datetime.utcnow().isoformat()
             self._root._v_attrs.modification_time = self.modification_time
+            self._ctx.maybe_flush(self._root._v_file)
 
 
     class DataElementBuffer(object):
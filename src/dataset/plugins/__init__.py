@@ -1,6 +1,10 @@
+import ast
+import collections
+import importlib
 import os
+import shutil
+import tempfile
 import warnings
-import numpy as np
 
 
 class DatasetPluginBaseException(Exception):
@@ -12,9 +16,50 @@ class DatasetPluginBase(object):
     Default plugin to keep a Dataset instance in memory.
     """
 
+    # Number of header lines at the start of the text files the plugin
+    # reads, which read_from repeats before the new lines of a file
+    header_lines = 0
+
     def read(self, dataset, filename, **kargs ):
         raise Exception("'read' is undefined")
 
+    def read_from(self, dataset, filename, offset, **kargs):
+        """
+        Read the complete lines of a growing text file that follow the
+        given byte offset.
+
+        The default writes the file's header lines and the new lines to a
+        temporary file with the same name and passes it to :meth:`read`.
+        Plugins that can parse part of a file directly can override it.
+
+        :type offset: int
+        :param offset: Byte offset of the first line to read, 0 for the
+            whole file.
+        :returns: The output of :meth:`read`, or None if there are no new
+            complete lines, and the offset after the last line read.
+        """
+        with open(filename, 'rb') as fh:
+            header = [fh.readline() for i in range(self.header_lines)]
+            fh.seek(offset)
+            chunk = fh.read()
+        # leave an incomplete last line for the next call
+        chunk = chunk[:chunk.rfind('\n') + 1]
+        if offset == 0:
+            header = []
+            if chunk.count('\n') <= self.header_lines:
+                return None, offset
+        if len(chunk) == 0:
+            return None, offset
+        tmpdir = tempfile.mkdtemp()
+        try:
+            tmp = os.path.join(tmpdir, os.path.basename(filename))
+            with open(tmp, 'wb') as fh:
+                fh.writelines(header)
+                fh.write(chunk)
+            return self.read(dataset, tmp, **kargs), offset + len(chunk)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def write(self, dataset, filename, **kargs ):
         raise Exception("'write' is undefined")
 
@@ -26,62 +71,165 @@ class DatasetPluginBase(object):
         return 'base'
 
 
-def load_all_plugins():
+def _plugin_modules(directory):
     """
-    Loads all installed spectroscopy dataset plug-ins. Plugins that cannot be loaded
-    will be skipped and a warning message issued.
+    Return the names and source files of the plugin modules and packages
+    in the given directory.
     """
-    # import all the plugins from the plugins directory
-    plugins_directory = __path__[0]
-
-    cur_dir = os.getcwd()
-    os.chdir(plugins_directory)
-
-    # only attempt to import python files and directories
-    plugin_list = []
-    for f in [f for f in os.listdir(os.path.curdir)]:
+    modules = []
+    for f in sorted(os.listdir(directory)):
         # exclude any hidden files
-        if f.startswith('.'):
+        if f.startswith('.') or f == '__init__.py':
             continue
-
-        # include any python modules
+        path = os.path.join(directory, f)
         if f.endswith('.py'):
-            plugin_list.append(f)
-            continue
+            modules.append((f[:-3], path))
+        elif os.path.isfile(os.path.join(path, '__init__.py')):
+            # include directories only if they are Python packages
+            modules.append((f, os.path.join(path, '__init__.py')))
+    return modules
+
 
-        # include directories only if they are Python packages (look
-        # for __init__.py file)
-        if os.path.isdir(f):
-            if '__init__.py' in os.listdir(f):
-                plugin_list.append(f)
+def _scan_source(filename):
+    """
+    Find the plugin classes defined in a source file without importing it.
+
+    A plugin class derives, directly or through other classes in the same
+    file, from DatasetPluginBase and returns a string literal from its
+    get_format method.
 
-    for plugin in plugin_list:
+    :rtype: dict
+    :returns: Class names keyed by format.
+    """
+    with open(filename) as fh:
+        tree = ast.parse(fh.read(), filename)
+    plugins = {}
+    bases = set(['DatasetPluginBase'])
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        names = [getattr(b, 'id', getattr(b, 'attr', None))
+                 for b in node.bases]
+        if not bases.intersection(names):
+            continue
+        bases.add(node.name)
+        for item in node.body:
+            if (isinstance(item, ast.FunctionDef) and
+                    item.name == 'get_format'):
+                for stmt in item.body:
+                    if (isinstance(stmt, ast.Return) and
+                            isinstance(stmt.value, ast.Str)):
+                        plugins[stmt.value.s] = node.name
+    return plugins
+
+
+def scan_plugins(directory=None):
+    """
+    Map plugin formats to the modules and classes implementing them by
+    scanning the plugin sources. Nothing is imported.
+
+    :type directory: str
+    :param directory: Directory to scan. Defaults to the directory of this
+        package.
+    :rtype: dict
+    :returns: (module, class name) tuples keyed by format.
+    """
+    if directory is None:
+        directory = __path__[0]
+    manifest = {}
+    for module, filename in _plugin_modules(directory):
         try:
-            __import__("spectroscopy.plugins." + plugin.rstrip(".py"),
-                       fromlist=["spectroscopy.plugins"], globals=globals(),
-                       locals=locals())
-        except Exception, e:
-            # skip over any plugins that we cannot import
-            warnings.warn('Failed to import plug-in \'%s\'. \n\nregister() '
-                          'raised the exception: \'%s\'.' % (plugin, e.args[0]))
+            found = _scan_source(filename)
+        except (IOError, SyntaxError), e:
+            warnings.warn('Failed to scan plug-in \'%s\': %s' % (module, e))
+            continue
+        for fmt, cls in found.iteritems():
+            if fmt in manifest:
+                raise DatasetPluginBaseException(
+                    "Format '%s' is registered by %s.%s and %s.%s" %
+                    ((fmt,) + manifest[fmt] + (module, cls)))
+            manifest[fmt] = (module, cls)
+    return manifest
 
-    # return to the old working dir
-    os.chdir(cur_dir)
 
-    registered_plugins = {}
+class PluginRegistry(collections.Mapping):
+    """
+    Read-only mapping from format to plugin class that imports a plugin
+    module the first time one of its formats is looked up.
+
+    Formats are taken from a manifest of (module, class name) tuples as
+    returned by :func:`scan_plugins`. Subclasses of DatasetPluginBase that
+    have been imported by other means are registered as well.
+    """
 
-    for c in DatasetPluginBase.__subclasses__():
-        assert c.get_format() not in registered_plugins
+    def __init__(self, manifest, package=__name__):
+        self._manifest = dict(manifest)
+        self._package = package
+        self._classes = {}
 
-        registered_plugins[c.get_format()] = c
+    def _subclasses(self):
+        return dict((c.get_format(), c)
+                    for c in DatasetPluginBase.__subclasses__())
 
+    def __getitem__(self, fmt):
+        try:
+            return self._classes[fmt]
+        except KeyError:
+            pass
+        try:
+            module, cls = self._manifest[fmt]
+        except KeyError:
+            c = self._subclasses()[fmt]
+        else:
+            m = importlib.import_module('%s.%s' % (self._package, module))
+            c = getattr(m, cls)
+        self._classes[fmt] = c
+        return c
+
+    def __iter__(self):
+        formats = set(self._manifest)
+        formats.update(self._subclasses())
+        return iter(sorted(formats))
+
+    def __len__(self):
+        return len(set(self._manifest).union(self._subclasses()))
+
+    def __contains__(self, fmt):
+        return fmt in self._manifest or fmt in self._subclasses()
+
+    def module(self, fmt):
+        """
+        Return the name of the module implementing a format without
+        importing it.
+        """
+        return '%s.%s' % (self._package, self._manifest[fmt][0])
+
+
+def load_all_plugins():
+    """
+    Loads all installed spectroscopy dataset plug-ins. Plugins that cannot be loaded
+    will be skipped and a warning message issued.
+    """
+    registry = get_registered_plugins()
+    registered_plugins = {}
+    for fmt in registry:
+        try:
+            registered_plugins[fmt] = registry[fmt]
+        except Exception, e:
+            # skip over any plugins that we cannot import
+            warnings.warn('Failed to import plug-in \'%s\'. \n\nregister() '
+                          'raised the exception: \'%s\'.' % (fmt, e))
     return registered_plugins
 
 
 def get_registered_plugins():
-
+    """
+    Return the registry of all installed plug-ins. Plug-in modules are only
+    imported when one of their formats is first looked up.
+    """
     if hasattr(get_registered_plugins, 'registered_plugins'):
         return get_registered_plugins.registered_plugins
     else:
-        get_registered_plugins.registered_plugins = load_all_plugins()
+        get_registered_plugins.registered_plugins = \
+            PluginRegistry(scan_plugins())
         return get_registered_plugins.registered_plugins
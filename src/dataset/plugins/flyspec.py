@@ -2,40 +2,98 @@
 Plugin to read FlySpec data.
 """
 import calendar
-import datetime
 import os
-import struct
 
 import numpy as np
 
-from spectroscopy.datamodel import (RawDataBuffer, 
-                                    ConcentrationBuffer,
-                                    RawDataTypeBuffer,
-                                    MethodBuffer,
-                                    FluxBuffer,
-                                    GasFlowBuffer)
-from spectroscopy.plugins import DatasetPluginBase
-from spectroscopy.util import bearing2vec
+from dataset import get_datamodel
+from dataset.plugins import DatasetPluginBase
+from dataset.util import bearing2vec
 
 
 class FlySpecPluginException(Exception):
     pass
 
 
-class FlySpecPlugin(DatasetPluginBase):
+# Number of channels of a FlySpec spectrum
+_NCHANNELS = 2048
+
+
+def _read_spectra(fin):
+    """
+    Read spectra from binary file.
+
+    The file holds the spectra as consecutive blocks of 2048 float32
+    values and is read with a single call. The RawData buffer converts
+    the spectra to float64, the type of d_var in the datamodel.
+
+    :rtype: :class:`numpy.ndarray`
+    :returns: float32 array of shape (number of spectra, 2048).
+    """
+    with open(fin, 'rb') as fh:
+        spectra = np.fromfile(fh, dtype=np.float32)
+    if spectra.size % _NCHANNELS != 0:
+        raise FlySpecPluginException(
+            'File %s is not a multiple of %d spectra channels.'
+            % (os.path.basename(fin), _NCHANNELS))
+    return spectra.reshape(-1, _NCHANNELS)
+
+
+def _todd(x):
+    """
+    Convert degrees and decimal minutes (dddmm.mmmm) to decimal degrees.
+
+    >>> _todd(np.array([3906.3, 17540.8263]))
+    array([ 39.105     , 175.68043833])
+    """
+    deg = np.floor(x / 100.)
+    return deg + (x - deg * 100.) / 60.
 
-    def _read_spectra(self, fin):
-        """
-        Read spectra from binary file.
-        """
-        with open(fin,"rb") as ifp:
-            raw_data = ifp.read()
-        i = 0
-        counts = []
-        while i < len(raw_data):
-            counts.append(struct.unpack("2048f",raw_data[i:i+(2048 * 4)]))
-            i += (2048 * 4)
-        return counts
+
+def _read_log(filename):
+    """
+    Read the first 21 columns of a FlySpec log file.
+
+    The numbers are converted in one go; only the hemisphere columns 9
+    and 11 are text. Latitudes and longitudes in columns 8 and 10 are
+    returned as decimal degrees and the hemispheres as -1 for southern
+    and western and 1 for northern and eastern.
+    """
+    with open(filename) as fh:
+        rows = [l.split()[:21] for l in fh if l.strip()]
+    text = np.array(rows)
+    if text.ndim != 2 or text.shape[1] != 21:
+        raise FlySpecPluginException(
+            'File %s does not have 21 columns on every line.'
+            % os.path.basename(filename))
+    data = np.empty(text.shape)
+    numeric = [i for i in range(21) if i not in (9, 11)]
+    data[:, numeric] = text[:, numeric].astype(np.float)
+    data[:, 8] = _todd(data[:, 8])
+    data[:, 10] = _todd(data[:, 10])
+    data[:, 9] = np.where(np.char.lower(text[:, 9]) == 's', -1., 1.)
+    data[:, 11] = np.where(np.char.lower(text[:, 11]) == 'w', -1., 1.)
+    return data
+
+
+def _datetimes(data):
+    """
+    Combine the year, month, day, hour, minute and decimal seconds
+    columns of a FlySpec log into datetime64 values with microsecond
+    resolution. Fractions of a microsecond are truncated.
+    """
+    ints = data[:, 1:7].astype(int)
+    years, months, days, hours, minutes, seconds = ints.T
+    us = ((data[:, 6] - seconds) * 1e6).astype(int)
+    dates = ((years - 1970).astype('datetime64[Y]') +
+             (months - 1).astype('timedelta64[M]')).astype('datetime64[D]')
+    return (dates + (days - 1).astype('timedelta64[D]') +
+            hours.astype('timedelta64[h]') +
+            minutes.astype('timedelta64[m]') +
+            seconds.astype('timedelta64[s]') + us.astype('timedelta64[us]'))
+
+
+class FlySpecPlugin(DatasetPluginBase):
 
     def read(self, dataset, filename, timeshift=0, **kargs):
         """
@@ -47,29 +105,13 @@ class FlySpecPlugin(DatasetPluginBase):
             `timeshift=12.00` will subtract 12 hours from the recorded time.
 
         """
-        # load data and convert southern hemisphere to negative
-        # latitudes and western hemisphere to negative longitudes
-        def todd(x):
-            """ 
-            Convert degrees and decimal minutes to decimal degrees.
-            """
-            idx = x.find('.')
-            minutes = float(x[idx - 2:]) / 60.
-            deg = float(x[:idx - 2])
-            return deg + minutes
-
-        data = np.loadtxt(filename, usecols=range(0, 21),
-                          converters={
-                              8: todd,
-                              9: lambda x: -1.0 if x.lower() == 's' else 1.0,
-                              10: todd,
-                              11: lambda x: -1.0 if x.lower() == 'w' else 1.0})
+        data = _read_log(filename)
         data = np.atleast_2d(data)
         specfile = kargs.get('spectra', None)
         if specfile is not None:
             wavelengths = kargs.get('wavelengths', None)
             if wavelengths is not None:
-                spectra = np.array(self._read_spectra(specfile))
+                spectra = _read_spectra(specfile)
                 if spectra.shape[0] != data.shape[0]:
                     raise FlySpecPluginException(
                         "Spectra and concentration don't have the same shape.")
@@ -89,34 +131,29 @@ class FlySpecPlugin(DatasetPluginBase):
             pass
         else:
             bearing = np.ones(data.shape[0])*bearing
-        ts = -1. * timeshift * 60. * 60.
-        int_times = np.zeros(data[:, :7].shape, dtype='int')
-        int_times[:, :6] = data[:, 1:7]
-        # convert decimal seconds to microseconds
-        int_times[:, 6] = (data[:, 6] - int_times[:, 5]) * 1e6
         # ToDo: handle timezones properly
-        times = [datetime.datetime(*int_times[i, :]) +
-                 datetime.timedelta(seconds=ts)
-                 for i in range(int_times.shape[0])]
-        unix_times = [i.isoformat() for i in times]
+        unix_times = (_datetimes(data) -
+                      np.timedelta64(int(round(timeshift * 3600e6)), 'us'))
+        unix_times = unix_times.tolist()
         latitude = data[:, 8] * data[:, 9]
         longitude = data[:, 10] * data[:, 11]
         elevation = data[:, 12]
         so2 = data[:, 16]
         angles = data[:, 17]
+        dm = get_datamodel()
         if specfile is not None:
-            rb = RawDataBuffer(inc_angle=angles,
-                               bearing=bearing,
-                               position=np.array([longitude, latitude, elevation]).T,
-                               datetime=unix_times,
-                               ind_var = wavelengths,
-                               d_var = spectra)
+            rb = dm.RawDataBuffer(inc_angle=angles,
+                                  bearing=bearing,
+                                  position=np.array([longitude, latitude, elevation]).T,
+                                  datetime=unix_times,
+                                  ind_var = wavelengths,
+                                  d_var = spectra)
         else:
-            rb = RawDataBuffer(inc_angle=angles,
-                               position=np.array([longitude, latitude, elevation]).T,
-                               datetime=unix_times)
-        rdtb = RawDataTypeBuffer(d_var_unit='ppm m', ind_var_unit='nm', name='measurement')
-        cb = ConcentrationBuffer(gas_species='SO2', value=so2)
+            rb = dm.RawDataBuffer(inc_angle=angles,
+                                  position=np.array([longitude, latitude, elevation]).T,
+                                  datetime=unix_times)
+        rdtb = dm.RawDataTypeBuffer(d_var_unit='ppm m', ind_var_unit='nm', name='measurement')
+        cb = dm.ConcentrationBuffer(gas_species='SO2', value=so2)
         return {str(rb):rb, str(rdtb):rdtb, str(cb):cb}
 
     def close(self, filename):
@@ -145,8 +182,9 @@ class FlySpecFluxPlugin(DatasetPluginBase):
         dtn -= ts
         f = data['flux']
        
-        mb = MethodBuffer(name='GNS FlySpec UI')
-        fb = FluxBuffer(value=f, datetime=dtn.astype(str))
+        dm = get_datamodel()
+        mb = dm.MethodBuffer(name='GNS FlySpec UI')
+        fb = dm.FluxBuffer(value=f, datetime=dtn.tolist())
         return {str(fb):fb, str(mb):mb}
 
     @staticmethod
@@ -156,19 +194,6 @@ class FlySpecFluxPlugin(DatasetPluginBase):
 
 class FlySpecRefPlugin(DatasetPluginBase):
 
-    def _read_spectra(self, fin):
-        """
-        Read spectra from binary file.
-        """
-        with open(fin,"rb") as ifp:
-            raw_data = ifp.read()
-        i = 0
-        counts = []
-        while i < len(raw_data):
-            counts.append(struct.unpack("2048f",raw_data[i:i+(2048 * 4)]))
-            i += (2048 * 4)
-        return counts
-
     def read(self, dataset, filename,  **kargs):
         """
         Read reference spectra for FlySpec.
@@ -179,11 +204,12 @@ class FlySpecRefPlugin(DatasetPluginBase):
         except KeyError:
             raise FlySpecPluginException('Please provide wavelengths and measurement type.')
         
-        spectra = np.array(self._read_spectra(filename))
+        spectra = _read_spectra(filename)
         if spectra.shape[1] != wavelengths.size:
             raise FlySpecPluginException("Spectra and wavelengths don't have the same size.")
-        rb = RawDataBuffer(ind_var=wavelengths, d_var=spectra)
-        rdtb = RawDataTypeBuffer(d_var_unit='ppm m', ind_var_unit='nm', name=mtype)
+        dm = get_datamodel()
+        rb = dm.RawDataBuffer(ind_var=wavelengths, d_var=spectra)
+        rdtb = dm.RawDataTypeBuffer(d_var_unit='ppm m', ind_var_unit='nm', name=mtype)
         return {str(rb):rb, str(rdtb):rdtb}
 
     def close(self, filename):
@@ -229,11 +255,12 @@ class FlySpecWindPlugin(DatasetPluginBase):
         dt -= ts
         description = 'Wind measurements and forecasts by NZ metservice \
         for Te Maari.'
-        mb = MethodBuffer(name='some model')
+        dm = get_datamodel()
+        mb = dm.MethodBuffer(name='some model')
         m = dataset.new(mb)
-        gfb = GasFlowBuffer(methods=[m], vx=vx, vy=vy, vz=vz,
-                            position=position, datetime=dt.astype(str), 
-                            user_notes=description, unit='m/s')
+        gfb = dm.GasFlowBuffer(methods=[m], vx=vx, vy=vy, vz=vz,
+                               position=position, datetime=dt.tolist(), 
+                               user_notes=description, unit='m/s')
         gf = dataset.new(gfb)
         return gf
 
@@ -8,21 +8,80 @@ import os
 import struct
 
 import numpy as np
-import pyproj
 
-from spectroscopy.datamodel import (RawDataBuffer, 
-                                    ConcentrationBuffer,
-                                    RawDataTypeBuffer,
-                                    FluxBuffer,
-                                    MethodBuffer,
-                                    GasFlowBuffer)
-from spectroscopy.plugins import DatasetPluginBase, DatasetPluginBaseException
-from spectroscopy.util import bearing2vec
+from dataset import get_datamodel
+from dataset.plugins import DatasetPluginBase, DatasetPluginBaseException
+from dataset.util import bearing2vec
 
 class MiniDoasException(DatasetPluginBaseException):
     pass
 
 
+# Number of channels of a MiniDOAS spectrum
+_NCHANNELS = 482
+
+# Columns of a raw data file
+_RAW_DTYPE = np.dtype([('station', 'S2'), ('date', 'S10'), ('time', np.float),
+                       ('stept', np.int), ('angle', np.float), ('intt', np.int),
+                       ('nspec', np.int), ('specin', np.float),
+                       ('counts', np.int, (_NCHANNELS,))])
+
+# Number of numeric values per line of a raw data file, i.e. without the
+# station
+_RAW_NVALUES = 7 + _NCHANNELS
+
+
+def _read_raw(filename):
+    """
+    Read a MiniDOAS raw data file.
+
+    Lines hold the station, the date as YYYYMMDD, the seconds of the day,
+    the scan step, the scan angle in radians, the integration time, the
+    number of co-added spectra, the incoming light estimate and the counts
+    of all channels, separated by commas. Only the station is split off
+    in Python; the numbers of all lines are joined into one block and
+    parsed with a single call to :func:`numpy.fromstring`.
+
+    :rtype: :class:`numpy.ndarray`
+    :returns: Structured array of dtype _RAW_DTYPE.
+    """
+    with open(filename, 'rb') as fh:
+        raw = fh.read()
+    if raw.startswith(codecs.BOM_UTF8):
+        raw = raw[len(codecs.BOM_UTF8):]
+    lines = [l.split(',', 1) for l in raw.splitlines() if l.strip()]
+    # a line with a value too many and another with one too few would
+    # still add up to the right total and shift the columns in between
+    for i, l in enumerate(lines):
+        if len(l) < 2 or l[1].count(',') != _RAW_NVALUES - 1:
+            raise MiniDoasException(
+                "Line %d of file %s doesn't have %d values."
+                % (i + 1, filename, _RAW_NVALUES + 1))
+    stations = [l[0] for l in lines]
+    values = np.fromstring(','.join([l[1] for l in lines]), dtype=np.float,
+                           sep=',')
+    if values.size != len(stations) * _RAW_NVALUES:
+        raise MiniDoasException(
+            "File %s doesn't have %d values on every line."
+            % (filename, _RAW_NVALUES + 1))
+    values = values.reshape(len(stations), _RAW_NVALUES)
+    data = np.empty(len(stations), dtype=_RAW_DTYPE)
+    data['station'] = stations
+    # YYYYMMDD -> YYYY-MM-DD
+    date = values[:, 0].astype(int)
+    year = date // 10000
+    month = date // 100 % 100
+    day = date % 100
+    data['date'] = ((year - 1970).astype('datetime64[Y]') +
+                    (month - 1).astype('timedelta64[M]')).astype(
+                        'datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    for i, name in enumerate(['time', 'stept', 'angle', 'intt', 'nspec',
+                              'specin']):
+        data[name] = values[:, i + 1]
+    data['counts'] = values[:, 7:]
+    return data
+
+
 class MiniDoasRaw(DatasetPluginBase):
 
     def read(self, dataset, filename, timeshift=0, **kargs):
@@ -35,13 +94,7 @@ class MiniDoasRaw(DatasetPluginBase):
         else:
             bearing = np.ones(data.shape[0])*bearing
 
-        fh = codecs.open(filename, encoding='utf-8-sig')
-        dt = np.dtype([('station', 'S2'), ('date', 'S10'), ('time', np.float),
-                       ('stept', np.int), ('angle', np.float), ('intt', np.int),
-                       ('nspec', np.int), ('specin', np.float), 
-                       ('counts', np.int, (482,))])
-        data = np.loadtxt(fh, converters={1: lambda x: '%s-%s-%s' %(x[0:4], x[4:6], x[6:8])},
-                          dtype=dt, delimiter=',')
+        data = _read_raw(filename)
         # Construct datetimes
         date = data['date'].astype('datetime64')
         hours = (data['time']/3600.).astype(int)
@@ -54,16 +107,17 @@ class MiniDoasRaw(DatasetPluginBase):
 
         # Convert radians to decimal degrees
         angles = data['angle']*360./(2.*np.pi)
-        rdtb = RawDataTypeBuffer(d_var_unit='ppm-m', 
-                                 ind_var_unit='nm',
-                                 name='measurement',
-                                 acquisition='stationary')
+        dm = get_datamodel()
+        rdtb = dm.RawDataTypeBuffer(d_var_unit='ppm-m', 
+                                    ind_var_unit='nm',
+                                    name='measurement',
+                                    acquisition='stationary')
         wavelengths = np.arange(30,512)
-        rb = RawDataBuffer(inc_angle=angles,
-                           datetime=datetime.astype(str),
-                           ind_var=wavelengths,
-                           d_var=data['counts'],
-                           integration_time=data['intt'])
+        rb = dm.RawDataBuffer(inc_angle=angles,
+                              datetime=datetime.astype('datetime64[us]').tolist(),
+                              ind_var=wavelengths,
+                              d_var=data['counts'],
+                              integration_time=data['intt'])
                             
         return {str(rb):rb, str(rdtb):rdtb}
  
@@ -75,6 +129,8 @@ class MiniDoasRaw(DatasetPluginBase):
 
 class MiniDoasSpectra(DatasetPluginBase):
 
+    header_lines = 1
+
     def read(self, dataset, filename, timeshift=0, **kargs):
         try:
             date=kargs['date']
@@ -90,10 +146,11 @@ class MiniDoasSpectra(DatasetPluginBase):
                           dtype=dt)
         dtm = data['datetime'].astype('datetime64[ms]')
         dtm -= np.timedelta64(int(timeshift), 'h')
-        cb = ConcentrationBuffer(value=data['value'],
-                                 datetime=dtm.astype(str),
-                                 gas_species='SO2',
-                                 unit='ppm-m')
+        cb = get_datamodel().ConcentrationBuffer(
+            value=data['value'],
+            datetime=dtm.astype('datetime64[us]').tolist(),
+            gas_species='SO2',
+            unit='ppm-m')
         return {str(cb):cb}
         
 
@@ -102,34 +159,55 @@ class MiniDoasSpectra(DatasetPluginBase):
         return 'minidoas-spectra'
     
 class MiniDoasScan(DatasetPluginBase):
-    def __init__(self):
-        # setup projection from NZGD49 (NZMG) to WGS84
-        self.destp = pyproj.Proj(init="epsg:4326")
-        self.srcp = pyproj.Proj(init="epsg:27200")
+
+    header_lines = 1
+
+    # Projects arrays of NZMG eastings and northings to WGS84 longitudes and
+    # latitudes; shared by all instances and set up on first use
+    _transform = None
+
+    @classmethod
+    def _nzmg2wgs84(cls, easting, northing):
+        """
+        Project NZGD49 (NZMG) coordinates to WGS84.
+        """
+        if cls._transform is None:
+            import pyproj
+            try:
+                cls._transform = staticmethod(pyproj.Transformer.from_crs(
+                    'epsg:27200', 'epsg:4326', always_xy=True).transform)
+            except AttributeError:
+                # pyproj < 2.1
+                srcp = pyproj.Proj(init='epsg:27200')
+                destp = pyproj.Proj(init='epsg:4326')
+                cls._transform = staticmethod(
+                    lambda x, y: pyproj.transform(srcp, destp, x, y))
+        return cls._transform(easting, northing)
 
     def _plumegeometry2gasflow(self, pheight, pwidth, peasting, pnorthing,
                                ptrack, datetime):
-        position = []
-        time = []
-        vx = []
-        vy = []
-        vz = []
-        for h,w,e,n,t,dt in zip(pheight,pwidth,peasting,pnorthing,ptrack, datetime):
-            lon,lat = pyproj.transform(self.srcp, self.destp, e, n)
-            position.append([lon, lat, h-w/2.])
-            position.append([lon, lat, h])
-            position.append([lon, lat, h+w/2.])
-            time.extend([dt]*3)
-            x,y = bearing2vec(t)
-            vx.extend([x]*3)
-            vy.extend([y]*3)
-            vz.extend([np.nan]*3)
+        # every scan gives the plume velocity at the bottom, centre and top
+        # of the plume
+        lon, lat = self._nzmg2wgs84(np.asarray(peasting, dtype=float),
+                                    np.asarray(pnorthing, dtype=float))
+        pheight = np.asarray(pheight, dtype=float)
+        pwidth = np.asarray(pwidth, dtype=float)
+        heights = (pheight[:, np.newaxis] +
+                   np.outer(pwidth, [-0.5, 0., 0.5])).ravel()
+        position = np.column_stack([np.repeat(lon, 3), np.repeat(lat, 3),
+                                    heights])
+        x, y = bearing2vec(ptrack)
+        vx = np.repeat(x, 3)
+        vy = np.repeat(y, 3)
+        vz = np.tile(np.nan, vx.size)
+        time = np.repeat(np.asarray(datetime).astype('datetime64[us]'), 3)
         description = 'Plume velocity inferred from plume geometry and wind speed'
-        mb = MethodBuffer(name='WS2PV', description=description)
-        gfb = GasFlowBuffer(vx=vx, vy=vy, vz=vz,
-                            position=position,
-                            datetime=np.array(time).astype(str), 
-                            unit='m/s')
+        dm = get_datamodel()
+        mb = dm.MethodBuffer(name='WS2PV', description=description)
+        gfb = dm.GasFlowBuffer(vx=vx, vy=vy, vz=vz,
+                               position=position,
+                               datetime=time.tolist(),
+                               unit='m/s')
         return (mb, gfb) 
 
     def read(self, dataset, filename, timeshift=0, **kargs):
@@ -153,9 +231,10 @@ class MiniDoasScan(DatasetPluginBase):
             idx = np.arange(data.shape[0])
         dtm = data['time'][idx].astype('datetime64[s]')
         dtm -= np.timedelta64(int(timeshift), 'h')
-        fb = FluxBuffer(value=data['Emission'][idx],
-                        value_error=data['EmissionSE'][idx],
-                        datetime=dtm.astype(str))
+        fb = get_datamodel().FluxBuffer(
+            value=data['Emission'][idx],
+            value_error=data['EmissionSE'][idx],
+            datetime=dtm.astype('datetime64[us]').tolist())
         mb, gfb = self._plumegeometry2gasflow(data['PlumeHeight'][idx],
                                               data['PlumeWidth'][idx],
                                               data['Easting'][idx],
@@ -210,10 +289,12 @@ class MiniDoasWind(DatasetPluginBase):
         dtm = data1['datetime'].astype("datetime64[s]")
         dtm -= np.timedelta64(int(timeshift), 'h')
         description = 'Autonomous weather station operated by NZ metservice'
-        mb = MethodBuffer(name='AWS', description=description)
+        dm = get_datamodel()
+        mb = dm.MethodBuffer(name='AWS', description=description)
         m = dataset.new(mb)
-        gfb = GasFlowBuffer(methods=[m], vx=vx, vy=vy, vz=vz,
-                            datetime=dtm.astype(str), unit='m/s')
+        gfb = dm.GasFlowBuffer(methods=[m], vx=vx, vy=vy, vz=vz,
+                               datetime=dtm.astype('datetime64[us]').tolist(),
+                               unit='m/s')
         return {str(gfb): gfb}
 
     @staticmethod
@@ -8,12 +8,10 @@ import os
 import re
 
 import numpy as np
-import pyproj
-from pytz import timezone
 
-from spectroscopy.datamodel import GasFlowBuffer, MethodBuffer
-from spectroscopy.plugins import DatasetPluginBase, DatasetPluginBaseException
-from spectroscopy.util import bearing2vec
+from dataset import get_datamodel
+from dataset.plugins import DatasetPluginBase, DatasetPluginBaseException
+from dataset.util import bearing2vec
 
 
 class NZMetservicePluginException(Exception):
@@ -44,6 +42,7 @@ class NZMetservicePlugin(DatasetPluginBase):
         """
         Parse the forecasts for each volcano.
         """
+        from pytz import timezone
         # get the times
         times = []
         vals = []
@@ -155,7 +154,7 @@ class NZMetservicePlugin(DatasetPluginBase):
         vy = np.zeros(npts)
         vz = np.zeros(npts)
         position = np.zeros((npts, 3))
-        time = np.empty(npts,dtype='S26')
+        time = []
         for _i, _e in enumerate(_mdls[_mod]):
             t, lon, lat, h, d, s = _e
             # if windspeed is 0 give it a tiny value
@@ -167,14 +166,16 @@ class NZMetservicePlugin(DatasetPluginBase):
             vy[_i] = _vy
             vz[_i] = np.nan
             position[_i, :] = lon, lat, h
-            time[_i] = t.isoformat()
+            # the times are in UTC
+            time.append(t.replace(tzinfo=None))
         description = 'Wind measurements and forecasts by NZ metservice \
         for selected sites.'
-        mb = MethodBuffer(name=_mod)
+        dm = get_datamodel()
+        mb = dm.MethodBuffer(name=_mod)
         m = dataset.new(mb)
-        gfb = GasFlowBuffer(methods=[m], vx=vx, vy=vy, vz=vz,
-                            position=position, datetime=time, 
-                            user_notes=description, unit='m/s')
+        gfb = dm.GasFlowBuffer(methods=[m], vx=vx, vy=vy, vz=vz,
+                               position=position, datetime=time, 
+                               user_notes=description, unit='m/s')
         gf = dataset.new(gfb)
         return gf
 
@@ -2,7 +2,9 @@ import calendar
 import datetime
 import math
 
-import numpy as np
+from dataset._lazy import LazyModule
+
+np = LazyModule('numpy', __name__)
 
 
 def bearing2vec(bearing, norm=1.0):
@@ -11,6 +13,8 @@ def bearing2vec(bearing, norm=1.0):
     bearing given unless norm is not 1.0. Bearing in this sense refers to angle
     clockwise from the direction [0, 1].
     So, for example: bearing2vec(90) -> [1, 0]
+    For an array of bearings the result is a (2, N) array of x and y
+    components.
 
     >>> bearing2vec(90)
     array([  1.00000000e+00,   6.12323400e-17])
@@ -18,27 +22,23 @@ def bearing2vec(bearing, norm=1.0):
     array([ 0.70710678,  0.70710678])
     >>> bearing2vec(30,3.0)
     array([ 1.5       ,  2.59807621])
+    >>> bearing2vec([45, 90])
+    array([[  7.07106781e-01,   1.00000000e+00],
+           [  7.07106781e-01,   6.12323400e-17]])
     """
-    if bearing >= 180:
-        x_sign = -1
-        if bearing < 270:
-            y_sign = -1
-            bearing -= 180
-        else:
-            y_sign = 1
-            bearing = 360 - bearing
-    elif bearing > 90:
-        y_sign = -1
-        x_sign = 1
-        bearing = bearing - 90
-    else:
-        y_sign = 1
-        x_sign = 1
-
-    assert bearing <= 90
-
-    y = y_sign * math.cos(math.radians(bearing)) * norm
-    x = x_sign * math.sin(math.radians(bearing)) * norm
+    bearing = np.asarray(bearing, dtype=float)
+    west = bearing >= 180
+    x_sign = np.where(west, -1., 1.)
+    y_sign = np.where(west, np.where(bearing < 270, -1., 1.),
+                      np.where(bearing > 90, -1., 1.))
+    bearing = np.where(west,
+                       np.where(bearing < 270, bearing - 180, 360 - bearing),
+                       np.where(bearing > 90, bearing - 90, bearing))
+
+    assert np.all(bearing <= 90)
+
+    y = y_sign * np.cos(np.radians(bearing)) * norm
+    x = x_sign * np.sin(np.radians(bearing)) * norm
 
     return np.array([x, y])
 
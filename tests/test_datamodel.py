@@ -1,9 +1,17 @@
+import os
+import subprocess
+import sys
 import tempfile
+import threading
+import time
 import unittest
 import warnings
 import datetime
+import pickle
+import shutil
 
 import numpy as np
+import tables
 
 import spectroscopy_datamodel
 from spectroscopy_datamodel import (RawDataBuffer, TargetBuffer,
@@ -14,7 +22,55 @@ from spectroscopy_datamodel import (RawDataBuffer, TargetBuffer,
 
 import dataset
 dataset.set_datamodel(spectroscopy_datamodel)
-from dataset import Dataset
+from dataset import Dataset, ShardedDataset
+from dataset._dataset import _rows_after
+from dataset.class_factory import _Registry
+from dataset.plugins import DatasetPluginBase
+
+
+def _dvar_sum(e):
+    return e.d_var[:].sum()
+
+
+class _TextPlugin(DatasetPluginBase):
+    """
+    Reads one spectrum per line, preceded by its time in seconds.
+    """
+
+    def read(self, dataset, filename, **kargs):
+        data = np.atleast_2d(np.loadtxt(filename))
+        times = [datetime.datetime(2017, 1, 1) + datetime.timedelta(seconds=s)
+                 for s in data[:, 0]]
+        rb = RawDataBuffer(d_var=data[:, 1:], datetime=times)
+        mb = MethodBuffer(name=kargs.get('method', 'text'))
+        if kargs.get('complete_method'):
+            mb.description = mb.settings = mb.reference = filename
+        return {str(rb): rb, str(mb): mb}
+
+    @staticmethod
+    def get_format():
+        return 'test-text'
+
+
+class _HeaderTextPlugin(DatasetPluginBase):
+    """
+    Reads the same lines as _TextPlugin after a header line and names the
+    method after the file.
+    """
+
+    header_lines = 1
+
+    def read(self, dataset, filename, **kargs):
+        data = np.atleast_2d(np.loadtxt(filename, skiprows=1))
+        times = [datetime.datetime(2017, 1, 1) + datetime.timedelta(seconds=s)
+                 for s in data[:, 0]]
+        rb = RawDataBuffer(d_var=data[:, 1:], datetime=times)
+        mb = MethodBuffer(name=os.path.basename(filename))
+        return {str(rb): rb, str(mb): mb}
+
+    @staticmethod
+    def get_format():
+        return 'test-text-header'
 
 
 class DatamodelTestCase(unittest.TestCase):
@@ -121,6 +177,624 @@ class DatamodelTestCase(unittest.TestCase):
         self.assertTrue(np.alltrue(r.d_var[0] < 1))
         self.assertEqual(r.datetime[0],datetime.datetime(2018, 1, 14, 13, 46, 0))
 
+    def test_read_into(self):
+        d = Dataset(tempfile.mktemp())
+        tdelta = datetime.timedelta(seconds=1)
+        times = [datetime.datetime(2018, 1, 14, 13, 46, 0) + i * tdelta for i in range(10)]
+        d_var = np.arange(10 * 2048, dtype=float).reshape((10, 2048))
+        rb = RawDataBuffer(d_var=d_var, ind_var=np.arange(2048),
+                           datetime=times, inc_angle=np.arange(10,110,10))
+        r = d.new(rb, pedantic=False)
+        out = np.empty((3, 2048))
+        self.assertIs(r.read_into('d_var', out, 2, 5), out)
+        np.testing.assert_array_equal(out, d_var[2:5])
+        # the same buffer can be reused for the next window
+        r.read_into('d_var', out, 7, 10)
+        np.testing.assert_array_equal(out, d_var[7:10])
+        angles = np.empty(10)
+        r.read_into('inc_angle', angles)
+        np.testing.assert_array_equal(angles, np.arange(10,110,10))
+        dts = np.empty(2, dtype=r.datetime.dtype)
+        r.read_into('datetime', dts, 0, 2)
+        self.assertEqual(dts[1], times[1].isoformat())
+        with self.assertRaises(ValueError):
+            r.read_into('d_var', out, 0, 2)
+        with self.assertRaises(AttributeError):
+            r.read_into('user_notes', out)
+
+    def test_stitch(self):
+        fn = tempfile.mktemp()
+        d = Dataset(fn)
+        rs = []
+        # create the elements out of time order
+        for i, n in [(2, 3), (0, 2), (1, 4)]:
+            times = [datetime.datetime(2017, 1, 10, 15, i, s) for s in range(n)]
+            rb = RawDataBuffer(d_var=np.ones((n, 2048)) * i,
+                               ind_var=np.arange(2048), datetime=times)
+            rs.append(d.new(rb, pedantic=False))
+        s = d.stitch('d_var', rs, view='jan10')
+        self.assertEqual(s.shape, (9, 2048))
+        np.testing.assert_array_equal(s[:, 0], [0, 0, 1, 1, 1, 1, 2, 2, 2])
+        # slices across element boundaries
+        np.testing.assert_array_equal(s[1:7, 5], [0, 1, 1, 1, 1, 2])
+        np.testing.assert_array_equal(s[::-4, 0], [2, 1, 0])
+        self.assertEqual(s[-1][0], 2)
+        dts = d.stitch('datetime', rs)
+        self.assertEqual(dts[2], datetime.datetime(2017, 1, 10, 15, 1, 0))
+        self.assertEqual(len(dts[1:3]), 2)
+        with self.assertRaises(IndexError):
+            s[9]
+        with self.assertRaises(ValueError):
+            d.stitch('d_var', rs, view='jan10')
+        # views are snapshots of the element sizes
+        rb = RawDataBuffer(d_var=np.ones((1, 2048)) * 3,
+                           datetime=[datetime.datetime(2017, 1, 10, 16)])
+        rs[0].append(rb, pedantic=False)
+        d.close()
+        d = Dataset(fn, mode='r')
+        s = d.stitched('jan10')
+        self.assertEqual(len(s), 9)
+        np.testing.assert_array_equal(s[4:][:, 0], [1, 1, 2, 2, 2])
+        d.close()
+
+
+    def test_map(self):
+        fn = tempfile.mktemp()
+        d = Dataset(fn, threadsafe=True)
+        rs = []
+        for i in range(4):
+            rb = RawDataBuffer(d_var=np.ones((2, 2048)) * i,
+                               ind_var=np.arange(2048),
+                               datetime=[datetime.datetime(2017, 1, 10, 15, 23, i)] * 2)
+            rs.append(d.new(rb, pedantic=False))
+        h = rs[0].handle()
+        self.assertEqual(pickle.loads(pickle.dumps(h)), h)
+        self.assertIs(h.resolve(d), rs[0])
+        # another thread waits for the file to be reopened
+        done = threading.Event()
+        sums = []
+
+        def _read():
+            while True:
+                sums.append(_dvar_sum(rs[1]))
+                if done.is_set():
+                    break
+
+        t = threading.Thread(target=_read)
+        t.start()
+        try:
+            self.assertEqual(d.map(_dvar_sum, rs, processes=2),
+                             [i * 2 * 2048 for i in range(4)])
+        finally:
+            done.set()
+            t.join()
+        self.assertEqual(set(sums), set([2 * 2048]))
+        # the elements are still usable after the workers are done
+        self.assertEqual(rs[3].d_var[0][0], 3)
+        tb = TargetBuffer(target_id='WI001')
+        d.new(tb, pedantic=False)
+        d.close()
+        # a read-only file stays open
+        d = Dataset(fn, mode='r')
+        f = d._f
+        rs = sorted(d.elements['RawData'], key=lambda e: e.d_var[0][0])
+        self.assertEqual(d.map(_dvar_sum, rs, processes=2),
+                         [i * 2 * 2048 for i in range(4)])
+        self.assertIs(d._f, f)
+        self.assertTrue(f.isopen)
+        d.close()
+
+    def test_ingest(self):
+        tmpdir = tempfile.mkdtemp()
+        paths = []
+        for i in range(4):
+            fn = os.path.join(tmpdir, 'spectra_{:d}.txt'.format(i))
+            with open(fn, 'w') as fh:
+                if i == 2:
+                    fh.write('not a spectrum\n')
+                else:
+                    for j in range(3):
+                        fh.write('{:d} {:d} {:d}\n'.format(i * 3 + j, i, j))
+            paths.append(fn)
+        paths.append(os.path.join(tmpdir, 'missing.txt'))
+        d = Dataset(tempfile.mktemp())
+        res = d.ingest(paths, format='test-text', processes=2,
+                       method='ingest')
+        self.assertEqual(len(res), 5)
+        self.assertIsInstance(res[2], Exception)
+        self.assertIsInstance(res[4], Exception)
+        for i in [0, 1, 3]:
+            r = res[i]['RawDataBuffer']
+            np.testing.assert_array_equal(r.d_var[:, 0], [i, i, i])
+            self.assertEqual(r.datetime[0],
+                             datetime.datetime(2017, 1, 1, 0, 0, i * 3))
+            self.assertEqual(res[i]['MethodBuffer'].name, 'ingest')
+        self.assertEqual(len(d.elements['RawData']), 3)
+        # appending to one element, reading in this process
+        res = d.ingest(paths, format='test-text', processes=1, append=True)
+        self.assertIsInstance(res[2], Exception)
+        self.assertIs(res[0]['RawDataBuffer'], res[3]['RawDataBuffer'])
+        np.testing.assert_array_equal(res[0]['RawDataBuffer'].d_var[:, 0],
+                                      [0, 0, 0, 1, 1, 1, 3, 3, 3])
+        self.assertEqual(len(d.elements['RawData']), 4)
+        self.assertEqual(len(d.elements['Method']), 4)
+        with self.assertRaises(KeyError):
+            d.ingest(paths, format='no-such-format')
+        d.close()
+        shutil.rmtree(tmpdir)
+
+    def test_ingest_base(self):
+        """
+        Test that outputs of classes that can't be extended get an element
+        per file when appending.
+        """
+        tmpdir = tempfile.mkdtemp()
+        scans = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'data', 'minidoas', 'NE_2016_11_01_Scans.csv')
+        with open(scans) as fh:
+            lines = fh.readlines()
+        paths = []
+        for i, part in enumerate([lines[1:6], lines[6:]]):
+            paths.append(os.path.join(tmpdir, 'scans%d.csv' % i))
+            with open(paths[-1], 'w') as fh:
+                fh.writelines(lines[:1] + part)
+        d = Dataset(tempfile.mktemp())
+        res = d.ingest(paths, format='minidoas-scan', processes=1,
+                       append=True, date='2016-11-01')
+        self.assertEqual([type(r) for r in res], [dict, dict])
+        self.assertIsNot(res[0]['FluxBuffer'], res[1]['FluxBuffer'])
+        self.assertIs(res[0]['MethodBuffer'], res[1]['MethodBuffer'])
+        self.assertEqual(len(d.elements['Flux']), 2)
+        self.assertEqual(len(d.elements['GasFlow']), 2)
+        d.close()
+        shutil.rmtree(tmpdir)
+
+    def test_ingest_rollback(self):
+        tmpdir = tempfile.mkdtemp()
+        paths = []
+        for i in range(3):
+            fn = os.path.join(tmpdir, 'spectra_{:d}.txt'.format(i))
+            with open(fn, 'w') as fh:
+                for j in range(3):
+                    # the second file has one more column
+                    fh.write(' '.join(['{:d}'.format(i * 3 + j)] +
+                                      ['{:d}'.format(i)] * (2 + (i == 1))))
+                    fh.write('\n')
+            paths.append(fn)
+        d = Dataset(tempfile.mktemp())
+        nhash = d._f.root.hash.nrows
+        # the method is written before the incomplete raw data buffer fails
+        res = d.ingest(paths, format='test-text', processes=1, pedantic=True,
+                       complete_method=True)
+        for r in res:
+            self.assertIsInstance(r, ValueError)
+        self.assertEqual(len(d.elements['Method']), 0)
+        self.assertEqual(len(d.elements['RawData']), 0)
+        self.assertEqual(d._f.root.Method._v_nchildren, 0)
+        self.assertEqual(d._f.root.hash.nrows, nhash)
+        # rows appended before the wider spectra failed are truncated
+        res = d.ingest(paths, format='test-text', processes=1, append=True)
+        self.assertIsInstance(res[1], Exception)
+        r = res[0]['RawDataBuffer']
+        self.assertIs(res[2]['RawDataBuffer'], r)
+        np.testing.assert_array_equal(r.d_var[:, 0], [0, 0, 0, 2, 2, 2])
+        self.assertEqual(r.datetime[:].shape, (6,))
+        self.assertEqual(r.datetime[3],
+                         datetime.datetime(2017, 1, 1, 0, 0, 6))
+        d.close()
+        shutil.rmtree(tmpdir)
+
+    def test_follow(self):
+        tmpdir = tempfile.mkdtemp()
+        log = os.path.join(tmpdir, 'spectra.txt')
+
+        def _write(mode, secs, partial=''):
+            with open(log, mode) as fh:
+                for i in secs:
+                    fh.write('{:d} {:d} 0\n'.format(i, i))
+                fh.write(partial)
+
+        _write('w', range(3))
+        fn = tempfile.mktemp()
+        d = Dataset(fn)
+        e = d.follow(log, 'test-text')
+        r = e['RawDataBuffer']
+        np.testing.assert_array_equal(r.d_var[:, 0], [0, 1, 2])
+        self.assertEqual(d.follow(log, 'test-text'), {})
+        # only complete lines are read
+        _write('a', [3, 4], partial='5 5')
+        e = d.follow(log, 'test-text')
+        self.assertIs(e['RawDataBuffer'], r)
+        np.testing.assert_array_equal(r.d_var[:, 0], [0, 1, 2, 3, 4])
+        # the method is extendable too, so it is appended to as well
+        self.assertEqual(len(d.elements['Method']), 1)
+        d.close()
+
+        # the state is kept in the file
+        _write('a', [], partial=' 0\n')
+        d = Dataset(fn)
+        e = d.follow(log, 'test-text')
+        r = d.elements['RawData'][0]
+        self.assertIs(e['RawDataBuffer'], r)
+        np.testing.assert_array_equal(r.d_var[:, 0], range(6))
+        self.assertEqual(r.datetime[-1], datetime.datetime(2017, 1, 1, 0, 0, 5))
+        # a replaced log is read from the start, without the old times
+        _write('w', [4, 5, 6])
+        d.follow(log, 'test-text')
+        np.testing.assert_array_equal(r.d_var[:, 0], range(7))
+        self.assertEqual(len(d.elements['RawData']), 1)
+        # the state survives compaction
+        d.compact()
+        _write('a', [7])
+        d.follow(log, 'test-text')
+        np.testing.assert_array_equal(d.elements['RawData'][0].d_var[:, 0],
+                                      range(8))
+        d.close()
+        shutil.rmtree(tmpdir)
+
+    def test_follow_header(self):
+        tmpdir = tempfile.mkdtemp()
+        log = os.path.join(tmpdir, 'spectra.txt')
+        with open(log, 'w') as fh:
+            fh.write('seconds counts\n')
+        d = Dataset(tempfile.mktemp())
+        self.assertEqual(d.follow(log, 'test-text-header'), {})
+        with open(log, 'a') as fh:
+            fh.write('0 0\n1 1\n')
+        e = d.follow(log, 'test-text-header')
+        r = e['RawDataBuffer']
+        self.assertEqual(e['MethodBuffer'].name, 'spectra.txt')
+        # the header is repeated before the new lines
+        with open(log, 'a') as fh:
+            fh.write('2 2\n3 3\n')
+        d.follow(log, 'test-text-header')
+        np.testing.assert_array_equal(r.d_var[:, 0], [0, 1, 2, 3])
+        d.close()
+        shutil.rmtree(tmpdir)
+
+    def test_follow_outputs(self):
+        """
+        Test following a format whose plugin returns several buffers with
+        the same times.
+        """
+        tmpdir = tempfile.mkdtemp()
+        scans = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'data', 'minidoas', 'NE_2016_11_01_Scans.csv')
+        with open(scans) as fh:
+            lines = fh.readlines()
+        log = os.path.join(tmpdir, 'NE_2016_11_01_Scans.csv')
+        with open(log, 'w') as fh:
+            fh.writelines(lines[:6])
+        d = Dataset(tempfile.mktemp())
+        e = d.follow(log, 'minidoas-scan', date='2016-11-01')
+        self.assertEqual(sorted(e), ['FluxBuffer', 'GasFlowBuffer',
+                                     'MethodBuffer'])
+        self.assertEqual(len(e['FluxBuffer'].value[:]), 5)
+        self.assertEqual(len(e['GasFlowBuffer'].vx[:]), 15)
+        with open(log, 'a') as fh:
+            fh.writelines(lines[6:])
+        f = e['FluxBuffer']
+        e = d.follow(log, 'minidoas-scan', date='2016-11-01')
+        # fluxes and gas flows can't be extended, so the new scans are
+        # stored in new elements
+        self.assertIsNot(e['FluxBuffer'], f)
+        self.assertEqual(len(e['FluxBuffer'].value[:]), len(lines) - 6)
+        self.assertEqual(len(e['GasFlowBuffer'].vx[:]), 3 * (len(lines) - 6))
+        self.assertEqual(len(d.elements['Flux']), 2)
+        self.assertEqual(len(d.elements['GasFlow']), 2)
+        self.assertEqual(len(d.elements['Method']), 1)
+        # every output keeps its own latest time
+        t = d._f.root.follow
+        self.assertEqual(sorted(t.col('key')), ['FluxBuffer', 'GasFlowBuffer',
+                                                'MethodBuffer'])
+        last = dict(zip(t.col('key'), t.col('last')))
+        self.assertEqual(last['FluxBuffer'], last['GasFlowBuffer'])
+        self.assertEqual(last['MethodBuffer'], '')
+        # nothing is added again from a truncated log
+        with open(log, 'w') as fh:
+            fh.writelines(lines[:4])
+        self.assertEqual(d.follow(log, 'minidoas-scan', date='2016-11-01'), {})
+        self.assertEqual(len(d.elements['Flux']), 2)
+        d.close()
+        shutil.rmtree(tmpdir)
+
+    def test_rows_after(self):
+        d = Dataset(tempfile.mktemp())
+        r = d.new(RawDataBuffer(d_var=np.zeros((1, 2)),
+                                datetime=[datetime.datetime(2017, 1, 1)]),
+                  pedantic=False)
+        times = [datetime.datetime(2017, 1, 1, 0, 0, i) for i in range(3)]
+        cb = ConcentrationBuffer(datetime=times, value=[1., 2., 3.],
+                                 rawdata=[r, r, r], gas_species='SO2')
+        self.assertEqual(_rows_after(cb, '2017-01-01T00:00:00'), 2)
+        np.testing.assert_array_equal(cb.value, [2., 3.])
+        self.assertEqual(list(cb.datetime), ['2017-01-01T00:00:01',
+                                             '2017-01-01T00:00:02'])
+        # references are the same for all rows
+        self.assertEqual(len(cb.rawdata), 3)
+        self.assertEqual(cb.gas_species, 'SO2')
+        self.assertEqual(_rows_after(cb, ''), 2)
+        self.assertIsNone(_rows_after(MethodBuffer(name='text'), ''))
+        d.close()
+
+    def test_read_only(self):
+        fn = tempfile.mktemp()
+        d = Dataset(fn)
+        tb = TargetBuffer(target_id='WI001')
+        d.new(tb, pedantic=False)
+        d.close()
+        d = Dataset(fn, mode='r')
+        self.assertEqual(d.elements['Target'][0].target_id, 'WI001')
+        with self.assertRaises(tables.FileModeError):
+            d.new(tb, pedantic=False)
+        d.close()
+
+    def test_in_memory(self):
+        d = Dataset(None, in_memory=True)
+        t = d.new(TargetBuffer(target_id='WI001'), pedantic=False)
+        self.assertEqual(t.target_id, 'WI001')
+        self.assertFalse(os.path.exists(d._f.filename))
+        d.close()
+        self.assertFalse(os.path.exists(d._f.filename))
+
+        fn = tempfile.mktemp()
+        d = Dataset(fn, in_memory=True, flush_interval=0.05)
+        d.new(TargetBuffer(target_id='WI001'), pedantic=False)
+        # the background thread writes the file without closing it
+        for i in range(100):
+            if os.path.exists(fn):
+                break
+            time.sleep(0.05)
+        d.new(TargetBuffer(target_id='WI002'), pedantic=False)
+        # a reader in another process sees the new element once the interval
+        # has passed, while the dataset is still open
+        reader = "\n".join([
+            "import dataset, spectroscopy_datamodel as sd",
+            "dataset.set_datamodel(sd)",
+            "d = dataset.Dataset(%r, mode='r')" % fn,
+            "print(' '.join(sorted(t.target_id for t in d.elements['Target'])))",
+            "d.close()"])
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        # the writer holds the lock on its backing file
+        env['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+        for i in range(50):
+            time.sleep(0.1)
+            ids = subprocess.check_output([sys.executable, '-c', reader],
+                                          env=env).split()
+            if len(ids) == 2:
+                break
+        self.assertTrue(d._f.isopen)
+        self.assertEqual(ids, ['WI001', 'WI002'])
+        d.close()
+        d = Dataset(fn, mode='r')
+        self.assertEqual(sorted([_t.target_id for _t in d.elements['Target']]),
+                         ['WI001', 'WI002'])
+        d.close()
+        with self.assertRaises(ValueError):
+            Dataset(None)
+        with self.assertRaises(ValueError):
+            Dataset(None, in_memory=True, flush_interval=1)
+
+    def test_threadsafe_reads(self):
+        """
+        Hammer a dataset with concurrent reads from many threads.
+        """
+        fn = tempfile.mktemp()
+        d = Dataset(fn)
+        tb = TargetBuffer(target_id='WI001')
+        t = d.new(tb, pedantic=False)
+        for i in range(8):
+            rb = RawDataBuffer(target=t, d_var=np.ones((20, 2048)) * i,
+                               ind_var=np.arange(2048),
+                               inc_angle=np.arange(20) + i,
+                               datetime=[datetime.datetime(2017, 1, 10, 15, 23, i)] * 20)
+            d.new(rb, pedantic=False)
+        d.close()
+
+        # lazily opened datasets load and drop elements while being read
+        for kwargs in [{}, {'lazy': True, 'cache_size': 5}]:
+            d = Dataset(fn, mode='r', threadsafe=True, **kwargs)
+            rs = d.elements['RawData']
+            errors = []
+
+            def reader(seed):
+                rnd = np.random.RandomState(seed)
+                out = np.empty((5, 2048))
+                try:
+                    for _ in range(200):
+                        r = rs[rnd.randint(len(rs))]
+                        i = int(r.inc_angle[0])
+                        start = rnd.randint(15)
+                        np.testing.assert_array_equal(r.d_var[start:start + 5], i)
+                        r.read_into('d_var', out, start, start + 5)
+                        np.testing.assert_array_equal(out, i)
+                        self.assertEqual(r.datetime[0],
+                                         datetime.datetime(2017, 1, 10, 15, 23, i))
+                        self.assertEqual(r.target.target_id, 'WI001')
+                except Exception, e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=reader, args=(_i,)) for _i in range(8)]
+            for _t in threads:
+                _t.start()
+            for _t in threads:
+                _t.join()
+            self.assertEqual(errors, [])
+            d.close()
+
+    def test_registry_threads(self):
+        """
+        Register, look up and drop elements of a size-limited registry from
+        many threads.
+        """
+        registry = _Registry(5)
+        errors = []
+
+        def worker(seed):
+            rnd = np.random.RandomState(seed)
+            try:
+                for _ in range(2000):
+                    rid = 'id{:d}'.format(rnd.randint(20))
+                    op = rnd.randint(3)
+                    if op == 0:
+                        registry.register(rid, rid)
+                    elif op == 1:
+                        e = registry.get(rid)
+                        self.assertTrue(e is None or e == rid)
+                    else:
+                        registry.discard(rid)
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(_i,))
+                   for _i in range(8)]
+        for _t in threads:
+            _t.start()
+        for _t in threads:
+            _t.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(registry), 5)
+        self.assertEqual(len(registry.values()), len(registry))
+
+    def test_swmr(self):
+        """
+        Read a dataset while another process keeps writing to it.
+        """
+        fn = tempfile.mktemp()
+        d = Dataset(fn, swmr=True)
+        rb = RawDataBuffer(d_var=np.zeros((1, 2048)), ind_var=np.arange(2048),
+                           datetime=[datetime.datetime(2017, 1, 10, 15, 23, 0)])
+        d.new(rb, pedantic=False)
+        d.close()
+
+        locking = os.environ.get('HDF5_USE_FILE_LOCKING')
+        reader = Dataset(fn, mode='r', swmr=True)
+        # file locking is only switched off for the reader's own open call
+        self.assertEqual(os.environ.get('HDF5_USE_FILE_LOCKING'), locking)
+        r = reader.elements['RawData'][0]
+        self.assertEqual(r.d_var.shape, (1, 2048))
+        writer = "\n".join([
+            "import datetime, numpy as np",
+            "import dataset, spectroscopy_datamodel as sd",
+            "dataset.set_datamodel(sd)",
+            "d = dataset.Dataset(%r, swmr=True)" % fn,
+            "r = d.elements['RawData'][0]",
+            "r.append(sd.RawDataBuffer(d_var=np.ones((2, 2048)),",
+            "         datetime=[datetime.datetime(2017, 1, 10, 15, 23, 1)] * 2),",
+            "         pedantic=False)",
+            "d.new(sd.ConcentrationBuffer(gas_species='SO2', value=np.ones(3)),",
+            "      pedantic=False)",
+            "d.close()"])
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        self.assertEqual(subprocess.call([sys.executable, '-c', writer],
+                                         env=env), 0)
+        self.assertEqual(r.d_var.shape, (1, 2048))
+        reader.refresh()
+        self.assertIs(reader.elements['RawData'][0], r)
+        self.assertEqual(r.d_var.shape, (3, 2048))
+        self.assertEqual(r.d_var[2][0], 1.)
+        self.assertEqual(len(reader.elements['Concentration']), 1)
+        self.assertEqual(reader.elements['Concentration'][0].gas_species, 'SO2')
+        # nothing new
+        c = reader.elements['Concentration'][0]
+        reader.refresh()
+        self.assertEqual(reader.elements['Concentration'], [c])
+        self.assertEqual(r.d_var.shape, (3, 2048))
+        self.assertEqual(os.environ.get('HDF5_USE_FILE_LOCKING'), locking)
+        reader.close()
+
+    def test_sharded(self):
+        dirname = tempfile.mkdtemp()
+        d = ShardedDataset(dirname, period='day')
+        d.register_tags(['WI001'])
+        ib = InstrumentBuffer(sensor_id='F00975')
+        i = d.new(ib, pedantic=False)
+        tb = TargetBuffer(target_id='WI001', tags=['WI001'])
+        t = d.new(tb, pedantic=False)
+        for day in (10, 11, 12):
+            times = [datetime.datetime(2017, 1, day, 15, 23, s) for s in range(2)]
+            rb = RawDataBuffer(instrument=i, target=t, d_var=np.ones((2, 2048)) * day,
+                               ind_var=np.arange(2048), datetime=times)
+            r = d.new(rb, pedantic=False)
+        # appending data from the same day extends the element...
+        rb = RawDataBuffer(d_var=np.ones((1, 2048)) * 12,
+                           datetime=[datetime.datetime(2017, 1, 12, 16, 0, 0)])
+        self.assertIs(d.append(r, rb, pedantic=False), r)
+        self.assertEqual(r.d_var.shape, (3, 2048))
+        # ...whereas data from the next day goes into a new shard
+        rb = RawDataBuffer(d_var=np.ones((1, 2048)) * 13, ind_var=np.arange(2048),
+                           datetime=[datetime.datetime(2017, 1, 13, 0, 0, 1)])
+        r1 = d.append(r, rb)
+        self.assertIsNot(r1, r)
+        self.assertEqual(d.shard_keys(), ['2017-01-10', '2017-01-11',
+                                          '2017-01-12', '2017-01-13'])
+        self.assertEqual(len(d.elements['RawData']), 4)
+        self.assertEqual(len(d.elements['Instrument']), 1)
+        d.close()
+
+        d = ShardedDataset(dirname, period='day')
+        e = d.select(etype='RawData', start=datetime.datetime(2017, 1, 11, 12),
+                     end=datetime.datetime(2017, 1, 12, 23))
+        self.assertEqual(sorted(e.keys()), ['RawData'])
+        self.assertEqual(sorted([_r.d_var[0][0] for _r in e['RawData']]),
+                         [11., 12.])
+        # only the shards overlapping the time range have been opened
+        self.assertEqual(sorted(d._shards.keys()), ['2017-01-11', '2017-01-12'])
+        self.assertEqual(e['RawData'][0].instrument.sensor_id, 'F00975')
+        self.assertEqual(list(e['RawData'][0].target.tags), ['WI001'])
+        with self.assertRaises(ValueError):
+            d.new(RawDataBuffer(d_var=np.ones((1, 2048))), pedantic=False)
+        d.close()
+
+    def test_sharded_continuation(self):
+        """
+        Test that an element continued in the next shard keeps the fixed
+        properties and references of the element it continues.
+        """
+        dirname = tempfile.mkdtemp()
+        d = ShardedDataset(dirname, period='day')
+        d.register_tags(['WI001'])
+        i = d.new(InstrumentBuffer(sensor_id='F00975'), pedantic=False)
+        t = d.new(TargetBuffer(target_id='WI001'), pedantic=False)
+        rdt = d.new(RawDataTypeBuffer(name='measurement'), pedantic=False)
+        rb = RawDataBuffer(instrument=i, target=t, type=rdt, temperature=21.5,
+                           user_notes='scan', tags=['WI001'],
+                           d_var=np.ones((1, 2048)), ind_var=np.arange(2048),
+                           datetime=[datetime.datetime(2017, 1, 12, 23, 59, 59)])
+        r = d.new(rb, pedantic=False)
+        rb = RawDataBuffer(d_var=np.ones((1, 2048)) * 2, ind_var=np.arange(2048),
+                           datetime=[datetime.datetime(2017, 1, 13, 0, 0, 1)])
+        r1 = d.append(r, rb)
+        self.assertIsNot(r1, r)
+        # the buffer passed in is left alone
+        self.assertIsNone(rb.instrument)
+        # a concentration in the new shard refers to data in the old one
+        cb = ConcentrationBuffer(rawdata=[r], value=[1.],
+                                 datetime=[datetime.datetime(2017, 1, 13, 0, 1)])
+        d.new(cb, pedantic=False)
+        d.close()
+
+        d = ShardedDataset(dirname, period='day')
+        e = d.select(start=datetime.datetime(2017, 1, 13))
+        self.assertEqual(sorted(d._shards.keys()), ['2017-01-13'])
+        self.assertEqual(len(e['RawData']), 1)
+        r1 = e['RawData'][0]
+        self.assertEqual(r1.d_var[0][0], 2.)
+        self.assertEqual(r1.instrument.sensor_id, 'F00975')
+        self.assertEqual(r1.target.target_id, 'WI001')
+        self.assertEqual(r1.type.name, 'measurement')
+        self.assertEqual(r1.temperature, 21.5)
+        self.assertEqual(r1.user_notes, 'scan')
+        self.assertEqual(list(r1.tags), ['WI001'])
+        # references into shards that haven't been opened yet are resolved
+        r = e['Concentration'][0].rawdata[0]
+        self.assertIsNotNone(r)
+        self.assertEqual(r.d_var[0][0], 1.)
+        self.assertEqual(r._root._v_file.filename,
+                         os.path.join(dirname, '2017-01-12.h5'))
+        d.close()
 
     def test_ResourceIdentifiers(self):
         d = Dataset(tempfile.mktemp())
@@ -133,6 +807,118 @@ class DatamodelTestCase(unittest.TestCase):
                            datetime=[datetime.datetime(2017,1,10,15,23,0)])
         r = d.new(rb, pedantic=False)
         self.assertEqual(r.target.target_id[:],'WI001')
+        # every dataset resolves references through its own registry
+        self.assertIs(d._ctx.registry.get(t._root._v_name), t)
+        self.assertIs(type(r._resource_id), str)
+        d2 = Dataset(tempfile.mktemp())
+        self.assertIsNone(d2._ctx.registry.get(t._root._v_name))
+        d2.close()
+        self.assertEqual(len(d._ctx.registry), 2)
+        d.close()
+        self.assertEqual(len(d._ctx.registry), 0)
+
+    def test_lazy(self):
+        fn = tempfile.mktemp()
+        d = Dataset(fn)
+        t = d.new(TargetBuffer(target_id='WI001'), pedantic=False)
+        for i in range(3):
+            rb = RawDataBuffer(target=t, d_var=np.ones((1, 2048)) * i,
+                               datetime=[datetime.datetime(2017, 1, 10, 15, 23, i)])
+            d.new(rb, pedantic=False)
+        ms = [d.new(MethodBuffer(name='Method%d' % i), pedantic=False)
+              for i in range(2)]
+        d.new(GasFlowBuffer(methods=ms), pedantic=False)
+        d.close()
+
+        d = Dataset(fn, lazy=True, cache_size=3)
+        self.assertEqual(len(d.elements['RawData']), 3)
+        self.assertEqual(len(d._ctx.registry), 0)
+        r = d.elements['RawData'][0]
+        self.assertEqual(len(d._ctx.registry), 1)
+        # the target is loaded on first access
+        self.assertEqual(r.target.target_id, 'WI001')
+        self.assertEqual(len(d._ctx.registry), 2)
+        self.assertIs(r.target, d.elements['Target'][0])
+        gf = d.elements['GasFlow'][0]
+        self.assertEqual([m.name for m in gf.methods], ['Method0', 'Method1'])
+        # only the most recently used elements are kept
+        self.assertEqual(len(d._ctx.registry), 3)
+        self.assertEqual(sorted([_r.d_var[0][0] for _r in d.elements['RawData']]),
+                         [0., 1., 2.])
+        self.assertEqual(len(d._ctx.registry), 3)
+        r = d.new(RawDataBuffer(target=d.elements['Target'][0],
+                                datetime=[datetime.datetime(2017, 1, 11)]),
+                  pedantic=False)
+        self.assertEqual(len(d.elements['RawData']), 4)
+        self.assertIn(r, d.elements['RawData'])
+        d.close()
+        self.assertEqual(len(d._ctx.registry), 0)
+
+    def test_referrers(self):
+        fn = tempfile.mktemp()
+        d = Dataset(fn)
+        i = d.new(InstrumentBuffer(sensor_id='F00975'), pedantic=False)
+        t = d.new(TargetBuffer(target_id='WI001'), pedantic=False)
+        rs = [d.new(RawDataBuffer(instrument=i, target=t,
+                                  datetime=[datetime.datetime(2017, 1, 10, 15, 23, s)]),
+                    pedantic=False) for s in range(3)]
+        ms = [d.new(MethodBuffer(name='Method%d' % s), pedantic=False)
+              for s in range(2)]
+        gf = d.new(GasFlowBuffer(methods=ms), pedantic=False)
+        self.assertEqual(sorted(r._resource_id for r in d.referrers(i)),
+                         sorted(r._resource_id for r in rs))
+        self.assertEqual(d.referrers(ms[1]), [gf])
+        self.assertEqual(d.referrers(t, etype='GasFlow'), [])
+        self.assertEqual(d.referrers(gf), [])
+        d2 = Dataset(tempfile.mktemp())
+        d2 += d
+        i2 = [_i for _i in d2.elements['Instrument']][0]
+        self.assertEqual(len(d2.referrers(i2, etype='RawData')), 3)
+        d.close()
+        d2.close()
+
+        # files without an index get one on first use
+        d = Dataset(fn)
+        d._f.remove_node('/referrers')
+        d.close()
+        d = Dataset(fn, mode='r')
+        self.assertEqual(len(d.referrers(d.elements['Target'][0])), 3)
+        d.close()
+        d = Dataset(fn, lazy=True)
+        self.assertEqual(len(d.referrers(d.elements['Target'][0])), 3)
+        self.assertIn('referrers', d._f.root)
+        d.close()
+
+    def test_stats(self):
+        d = Dataset(tempfile.mktemp(), collect_stats=True)
+        rb = RawDataBuffer(d_var=np.ones((2, 2048)), ind_var=np.arange(2048),
+                           datetime=[datetime.datetime(2017, 1, 10)] * 2)
+        r = d.new(rb, pedantic=False)
+        r.append(RawDataBuffer(d_var=np.ones((3, 2048)),
+                               datetime=[datetime.datetime(2017, 1, 11)] * 3),
+                 pedantic=False)
+        r.d_var[1:4]
+        d.flush()
+        stats = d.stats()
+        self.assertEqual(stats['RawData']['new']['calls'], 1)
+        self.assertEqual(stats['RawData']['create_arrays']['bytes'],
+                         2 * 2048 * 8 + 2048 * 8 + 2 * len('2017-01-10T00:00:00'))
+        # rows are counted once per buffer, not once per array
+        self.assertEqual(stats['RawData']['create_arrays']['rows'], 2)
+        self.assertEqual(stats['RawData']['append']['rows'], 3)
+        self.assertEqual(stats['RawData']['append']['bytes'],
+                         3 * 2048 * 8 + 3 * len('2017-01-11T00:00:00'))
+        self.assertEqual(stats['RawData']['read']['rows'], 3)
+        self.assertEqual(stats['RawData']['read']['bytes'], 3 * 2048 * 8)
+        self.assertEqual(stats['Dataset']['flush']['calls'], 1)
+        self.assertGreaterEqual(stats['RawData']['getattr']['time'], 0)
+        d.reset_stats()
+        self.assertEqual(d.stats(), {})
+        d.close()
+        d = Dataset(tempfile.mktemp())
+        with self.assertRaises(ValueError):
+            d.stats()
+        d.close()
 
     def test_repr(self):
         d = Dataset(tempfile.mktemp())
@@ -212,6 +998,44 @@ class DatamodelTestCase(unittest.TestCase):
         with self.assertRaises(ValueError):
             d1 += d1
 
+    def test_merge(self):
+        fns = []
+        for day in (10, 11):
+            fn = tempfile.mktemp()
+            d = Dataset(fn)
+            t = d.new(TargetBuffer(target_id='WI%03d' % day), pedantic=False)
+            rb = RawDataBuffer(target=t, d_var=np.ones((1, 2048)) * day,
+                               ind_var=np.arange(2048),
+                               datetime=[datetime.datetime(2017, 1, day)])
+            d.new(rb, pedantic=False)
+            d.close()
+            fns.append(fn)
+        fn = tempfile.mktemp()
+        d = Dataset(fn)
+        for _fn in fns:
+            d.merge(_fn)
+        # merging the same file again doesn't add anything
+        d.merge(fns[0])
+        with self.assertRaises(ValueError):
+            d.merge(d)
+        self.assertEqual(len(d.elements['RawData']), 2)
+        self.assertEqual(sorted([r.target.target_id for r in d.elements['RawData']]),
+                         ['WI010', 'WI011'])
+        # the merged file only holds links
+        self.assertIsInstance(d._f.get_node('/RawData')._v_links.values()[0],
+                              tables.link.ExternalLink)
+        self.assertLess(os.path.getsize(fn), os.path.getsize(fns[0]))
+        with self.assertRaises(tables.FileModeError):
+            d.elements['RawData'][0].append(RawDataBuffer(d_var=np.ones((1, 2048))))
+        d.close()
+        d = Dataset(fn, mode='r')
+        s = d.stitch('d_var', d.elements['RawData'])
+        np.testing.assert_array_equal(s[:, 0], [10, 11])
+        self.assertEqual(sorted(d.map(_dvar_sum, d.elements['RawData'], processes=2)),
+                         [10 * 2048, 11 * 2048])
+        self.assertEqual(s[1][0], 11)
+        d.close()
+
     def test_forbidden(self):
         d = Dataset(tempfile.mktemp())
         with self.assertRaises(AttributeError):
@@ -263,6 +1087,70 @@ class DatamodelTestCase(unittest.TestCase):
         #can add the same buffer twice if not pedantic
         d.new(tb, pedantic=False)
 
+    def test_compact(self):
+        fn = tempfile.mktemp()
+        d = Dataset(fn)
+        d.register_tags(['WI001', 'WI002'])
+        tb = TargetBuffer(tags=['WI001'], name='White Island main vent',
+                          target_id="WI001",
+                          position=(177.2, -37.5, 50),
+                          position_error=(0.2, 0.2, 20),
+                          description='Main vent in January 2017')
+        t = d.new(tb)
+        with self.assertRaises(ValueError):
+            d.new(tb)
+        t.tags.add('WI002')
+        t2 = d.new(TargetBuffer(target_id='WI002', tags=['WI002']), pedantic=False)
+        t2.tags.remove('WI002')
+        rb = RawDataBuffer(target=t, d_var=np.ones((2, 2048)),
+                           datetime=[datetime.datetime(2017, 1, 10)] * 2)
+        r = d.new(rb, pedantic=False)
+        d.stitch('d_var', [r], view='all')
+        # leave some dead space behind
+        d._f.create_array('/', 'junk', np.zeros(100000))
+        d._f.remove_node('/junk')
+        # the group of the failed insert is still in the file
+        self.assertEqual(len(d._f.root.Target._v_groups), 3)
+        saved = d.compact()
+        self.assertGreater(saved, 0)
+        self.assertEqual(len(d._f.root.Target._v_groups), 2)
+        d.close()
+
+        d = Dataset(fn)
+        self.assertEqual(len(d.elements['Target']), 2)
+        self.assertEqual(len(d._f.root.hash[:]), 3)
+        t = [_t for _t in d.elements['Target'] if _t.target_id == 'WI001'][0]
+        self.assertEqual(list(d._f.root.tags.WI001[:]), [t._root._v_name])
+        self.assertEqual(list(d._f.root.tags.WI002[:]), [t._root._v_name])
+        self.assertEqual(sorted(t.tags), ['WI001', 'WI002'])
+        self.assertEqual(d.elements['RawData'][0].target, t)
+        self.assertEqual(d.stitched('all')[1][0], 1)
+        with self.assertRaises(ValueError):
+            d.new(tb)
+        d.close()
+
+    def test_compact_evicted(self):
+        """
+        Test that elements dropped from a lazy dataset's cache but still
+        held by the caller are rebound when the file is replaced.
+        """
+        fn = tempfile.mktemp()
+        d = Dataset(fn)
+        for i in range(2):
+            rb = RawDataBuffer(d_var=np.ones((1, 2048)) * i,
+                               datetime=[datetime.datetime(2017, 1, 10, 0, i)])
+            d.new(rb, pedantic=False)
+        d.close()
+
+        d = Dataset(fn, lazy=True, cache_size=1)
+        r0, r1 = d.elements['RawData'][0], d.elements['RawData'][1]
+        self.assertEqual(len(d._ctx.registry), 1)
+        d.compact()
+        self.assertEqual(sorted([r0.d_var[0][0], r1.d_var[0][0]]), [0., 1.])
+        self.assertTrue(r0._root._v_file.isopen)
+        self.assertTrue(r1._root._v_file.isopen)
+        d.close()
+
 
     def test_append(self):
         d = Dataset(tempfile.mktemp())
@@ -373,6 +1261,74 @@ class DatamodelTestCase(unittest.TestCase):
         self.assertEqual(list(t.tags), ['SomethingElse'])
         self.assertEqual(len(d._f.root.tags._v_children['SomethingElse'][:]), 1)
 
+        # removed tags leave empty slots until more than half are empty
+        ts = [d.new(TargetBuffer(target_id='T%d' % i, tags=['measurement']),
+                    pedantic=False) for i in range(6)]
+        ea = d._f.root.tags.measurement
+        for _t in ts[:3]:
+            _t.tags.remove('measurement')
+        self.assertEqual(list(ea[:]), ['', '', ''] + [_t._root._v_name for _t in ts[3:]])
+        ts[3].tags.remove('measurement')
+        self.assertEqual(list(ea[:]), [_t._root._v_name for _t in ts[4:]])
+        ts[0].tags.add('measurement')
+        self.assertEqual(ea[-1], ts[0]._root._v_name)
+        self.assertEqual(sorted(t._root._v_name for t in ts if 'measurement' in t.tags),
+                         sorted(ea[:]))
+
+
+    def test_batch_tagging(self):
+        d = Dataset(tempfile.mktemp())
+        d.register_tags(['WI001', 'WI002'])
+        ts = [d.new(TargetBuffer(target_id='T%d' % i), pedantic=False)
+              for i in range(10)]
+        ts[0].tags.add('WI001')
+        d.tag(ts[:5], ['WI001', 'WI002'])
+        names = [t._root._v_name for t in ts]
+        self.assertEqual(list(d._f.root.tags.WI001[:]), names[:5])
+        self.assertEqual(list(d._f.root.tags.WI002[:]), names[:5])
+        self.assertEqual(sorted(ts[4].tags), ['WI001', 'WI002'])
+        d.untag(ts[1:3], ['WI001'])
+        self.assertEqual(list(d._f.root.tags.WI001[:]),
+                         [names[0], '', '', names[3], names[4]])
+        self.assertEqual(list(ts[1].tags), ['WI002'])
+        d.untag(ts[3:], ['WI001'])
+        self.assertEqual(list(d._f.root.tags.WI001[:]), [names[0]])
+        with self.assertRaises(ValueError):
+            d.tag(ts, ['blub'])
+        d.remove_tags(['WI002'])
+        self.assertNotIn('WI002', d._f.root.tags)
+        self.assertEqual(list(ts[0].tags), ['WI001'])
+        self.assertEqual(list(ts[4].tags), [])
+        # the tags are read back from the file
+        fn = d._f.filename
+        d.close()
+        d = Dataset(fn)
+        tagged = [t for t in d.elements['Target'] if 'WI001' in t.tags]
+        self.assertEqual([t.target_id for t in tagged], ['T0'])
+        d.close()
+
+    def test_remove_tags_evicted(self):
+        """
+        Test that removing a tag also clears it on elements dropped from a
+        lazy dataset's cache but still held by the caller.
+        """
+        fn = tempfile.mktemp()
+        d = Dataset(fn)
+        d.register_tags(['WI001'])
+        for i in range(2):
+            d.new(TargetBuffer(target_id='T%d' % i, tags=['WI001']),
+                  pedantic=False)
+        d.close()
+
+        d = Dataset(fn, lazy=True, cache_size=1)
+        t0, t1 = d.elements['Target'][0], d.elements['Target'][1]
+        self.assertEqual(len(d._ctx.registry), 1)
+        self.assertEqual(list(t0.tags), ['WI001'])
+        self.assertEqual(list(t1.tags), ['WI001'])
+        d.remove_tags(['WI001'])
+        self.assertEqual(list(t0.tags), [])
+        self.assertEqual(list(t1.tags), [])
+        d.close()
 
     def test_dtbuffer(self):
         """
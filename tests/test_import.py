@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import unittest
+
+import dataset
+
+# Seconds 'import dataset' may take in a fresh interpreter. Can be raised
+# for slow machines with the DATASET_IMPORT_BUDGET environment variable.
+IMPORT_BUDGET = float(os.environ.get('DATASET_IMPORT_BUDGET', 0.1))
+
+_IMPORT_CODE = """
+import sys, time
+t0 = time.time()
+import dataset
+import dataset.plugins
+dataset.plugins.get_registered_plugins()
+print(time.time() - t0)
+print(' '.join(sorted(m for m in sys.modules if sys.modules[m] is not None)))
+"""
+
+
+class ImportTestCase(unittest.TestCase):
+    """
+    Test that importing the package stays cheap.
+    """
+
+    def _run(self, code):
+        env = dict(os.environ)
+        src = os.path.dirname(os.path.dirname(
+            os.path.abspath(dataset.__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(
+            [src] + [p for p in [env.get('PYTHONPATH')] if p])
+        return subprocess.check_output([sys.executable, '-c', code],
+                                       env=env).splitlines()
+
+    def test_import_budget(self):
+        # take the best of a few runs to be robust against a busy machine
+        times = []
+        for i in range(3):
+            out = self._run(_IMPORT_CODE)
+            times.append(float(out[0]))
+        self.assertLess(min(times), IMPORT_BUDGET,
+                        "'import dataset' took {:.3f} s, the budget is "
+                        "{:.3f} s".format(min(times), IMPORT_BUDGET))
+
+    def test_lazy_dependencies(self):
+        modules = self._run(_IMPORT_CODE)[1].split()
+        for m in ['tables', 'numpy', 'pyproj', 'pytz', 'scipy',
+                  'dataset.plugins.minidoas']:
+            self.assertFalse(m in modules, '{} was imported'.format(m))
+        # the placeholder is replaced by the module once it is used
+        out = self._run('import dataset.util as u; u.bearing2vec(90.)\n'
+                        'import sys; print(u.np is sys.modules["numpy"])')
+        self.assertEqual(out[0], 'True')
+
+
+def suite():
+    return unittest.makeSuite(ImportTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,211 @@
+import codecs
+import datetime
+import inspect
+import math
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+import spectroscopy_datamodel
+
+import dataset
+dataset.set_datamodel(spectroscopy_datamodel)
+from dataset.plugins.flyspec import (FlySpecPluginException, _read_spectra,
+                                     _read_log, _datetimes)
+from dataset.plugins.minidoas import (MiniDoasException, MiniDoasScan,
+                                      _read_raw, _RAW_DTYPE)
+from dataset.util import bearing2vec
+
+
+def _scalar_bearing2vec(bearing, norm=1.0):
+    """
+    bearing2vec as it was before it accepted arrays.
+    """
+    if bearing >= 180:
+        x_sign = -1
+        if bearing < 270:
+            y_sign = -1
+            bearing -= 180
+        else:
+            y_sign = 1
+            bearing = 360 - bearing
+    elif bearing > 90:
+        y_sign = -1
+        x_sign = 1
+        bearing = bearing - 90
+    else:
+        y_sign = 1
+        x_sign = 1
+    y = y_sign * math.cos(math.radians(bearing)) * norm
+    x = x_sign * math.sin(math.radians(bearing)) * norm
+    return np.array([x, y])
+
+
+class MiniDoasReaderTestCase(unittest.TestCase):
+    """
+    Test the MiniDOAS parsers against the line by line parsing they
+    replaced.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_raw(self):
+        fn = os.path.join(self.tmpdir, 'NE_20161101.csv')
+        lines = []
+        for i in range(5):
+            counts = ','.join([str(i * 1000 + c) for c in range(482)])
+            lines.append(u'NE,20161101,%.3f,%d,%.6f,200,10,%.2f,%s' %
+                         (32400.07 + i * 1.3, i + 1, -1.570796 + i * 0.1,
+                          1234.56 + i, counts))
+        with codecs.open(fn, 'w', encoding='utf-8-sig') as fh:
+            fh.write(u'\r\n'.join(lines) + u'\r\n')
+        data = _read_raw(fn)
+        fh = codecs.open(fn, encoding='utf-8-sig')
+        ref = np.loadtxt(fh, converters={
+            1: lambda x: '%s-%s-%s' % (x[0:4], x[4:6], x[6:8])},
+            dtype=_RAW_DTYPE, delimiter=',')
+        fh.close()
+        self.assertEqual(data.dtype, ref.dtype)
+        self.assertEqual(data.shape, (5,))
+        for name in _RAW_DTYPE.names[1:]:
+            np.testing.assert_array_equal(data[name], ref[name])
+        self.assertEqual(list(data['station']), ['NE'] * 5)
+        self.assertEqual(data['date'][0], '2016-11-01')
+
+        # one value too many on one line and one too few on another
+        shifted = list(lines)
+        shifted[1] += u',0'
+        shifted[3] = shifted[3].rsplit(u',', 1)[0]
+        with codecs.open(fn, 'w', encoding='utf-8-sig') as fh:
+            fh.write(u'\r\n'.join(shifted) + u'\r\n')
+        with self.assertRaises(MiniDoasException):
+            _read_raw(fn)
+
+        with codecs.open(fn, 'w', encoding='utf-8-sig') as fh:
+            fh.write(u'\r\n'.join(lines) + u'\r\n')
+        with open(fn, 'a') as fh:
+            fh.write('NE,20161101,1,2,3\n')
+        with self.assertRaises(MiniDoasException):
+            _read_raw(fn)
+
+    def test_plumegeometry2gasflow(self):
+        import pyproj
+        height = np.array([1000., 1200., 800.])
+        width = np.array([200., 500., 300.])
+        easting = np.array([2852000., 2853500., 2851000.])
+        northing = np.array([6341000., 6340500., 6342000.])
+        track = np.array([45., 135., 300.])
+        dt = np.array(['2016-11-01T10:00:00', '2016-11-01T10:05:00',
+                       '2016-11-01T10:10:00'], dtype='datetime64[s]')
+        mb, gfb = MiniDoasScan()._plumegeometry2gasflow(
+            height, width, easting, northing, track, dt)
+        # one scan at a time as before
+        srcp = pyproj.Proj(init='epsg:27200')
+        destp = pyproj.Proj(init='epsg:4326')
+        position = []
+        vx = []
+        vy = []
+        for h, w, e, n, t in zip(height, width, easting, northing, track):
+            lon, lat = pyproj.transform(srcp, destp, e, n)
+            position.append([lon, lat, h - w / 2.])
+            position.append([lon, lat, h])
+            position.append([lon, lat, h + w / 2.])
+            x, y = _scalar_bearing2vec(t)
+            vx.extend([x] * 3)
+            vy.extend([y] * 3)
+        np.testing.assert_allclose(gfb.position, position, rtol=0, atol=1e-9)
+        np.testing.assert_array_equal(gfb.vx, vx)
+        np.testing.assert_array_equal(gfb.vy, vy)
+        self.assertTrue(np.all(np.isnan(gfb.vz)))
+        self.assertEqual(list(gfb.datetime), list(np.repeat(dt, 3).astype(str)))
+        self.assertEqual(mb.name, 'WS2PV')
+
+    def test_bearing2vec(self):
+        bearings = np.arange(0., 360., 7.5)
+        vec = bearing2vec(bearings, 3.)
+        self.assertEqual(vec.shape, (2, bearings.size))
+        for i, b in enumerate(bearings):
+            np.testing.assert_array_equal(vec[:, i], _scalar_bearing2vec(b, 3.))
+            np.testing.assert_array_equal(bearing2vec(b, 3.),
+                                          _scalar_bearing2vec(b, 3.))
+
+
+class FlySpecReaderTestCase(unittest.TestCase):
+    """
+    Test the FlySpec parsers against the line by line parsing they
+    replaced.
+    """
+
+    def setUp(self):
+        self.data_dir = os.path.join(os.path.dirname(os.path.abspath(
+            inspect.getfile(inspect.currentframe()))), "data")
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_log(self):
+        def todd(x):
+            idx = x.find('.')
+            return float(x[:idx - 2]) + float(x[idx - 2:]) / 60.
+
+        for fn in ['2012_02_29_1340_CHILE.txt', '2016_06_11_0830_TOFP04.txt']:
+            fin = os.path.join(self.data_dir, fn)
+            ref = np.loadtxt(fin, usecols=range(0, 21),
+                             converters={
+                                 8: todd,
+                                 9: lambda x: -1.0 if x.lower() == 's' else 1.0,
+                                 10: todd,
+                                 11: lambda x: -1.0 if x.lower() == 'w' else 1.0})
+            data = _read_log(fin)
+            self.assertEqual(data.shape, ref.shape)
+            np.testing.assert_allclose(data, ref, rtol=0, atol=1e-10)
+            int_times = np.zeros(ref[:, :7].shape, dtype='int')
+            int_times[:, :6] = ref[:, 1:7]
+            int_times[:, 6] = (ref[:, 6] - int_times[:, 5]) * 1e6
+            times = [datetime.datetime(*int_times[i, :])
+                     for i in range(int_times.shape[0])]
+            self.assertEqual(_datetimes(data).tolist(), times)
+
+        fn = os.path.join(self.tmpdir, 'short.txt')
+        with open(fn, 'w') as fh:
+            fh.write('1 2012 2 29 13 40\n')
+        with self.assertRaises(FlySpecPluginException):
+            _read_log(fn)
+
+    def test_read_spectra(self):
+        fin = os.path.join(self.data_dir, 'TOFP04', 'Cal_20170602_0956_ref.bin')
+        spectra = _read_spectra(fin)
+        self.assertIs(type(spectra), np.ndarray)
+        self.assertEqual(spectra.dtype, np.float32)
+        self.assertEqual(spectra.shape, (10, 2048))
+        with open(fin, 'rb') as fh:
+            raw = fh.read()
+        ref = [struct.unpack('2048f', raw[i:i + 2048 * 4])
+               for i in range(0, len(raw), 2048 * 4)]
+        np.testing.assert_array_equal(spectra, np.array(ref))
+
+        fn = os.path.join(self.tmpdir, 'truncated.bin')
+        with open(fn, 'wb') as fh:
+            fh.write(raw[:-4])
+        with self.assertRaises(FlySpecPluginException):
+            _read_spectra(fn)
+        open(fn, 'wb').close()
+        self.assertEqual(_read_spectra(fn).shape, (0, 2048))
+
+
+def suite():
+    return unittest.TestSuite(
+        [unittest.makeSuite(MiniDoasReaderTestCase, 'test'),
+         unittest.makeSuite(FlySpecReaderTestCase, 'test')])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,86 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from dataset.plugins import (DatasetPluginBase, PluginRegistry,
+                             get_registered_plugins, scan_plugins)
+
+
+class PluginRegistryTestCase(unittest.TestCase):
+    """
+    Test the registry of dataset plugins.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_scan(self):
+        cwd = os.getcwd()
+        loaded = set(m for m, v in sys.modules.items() if v is not None)
+        plugins = PluginRegistry(scan_plugins())
+        self.assertEqual(os.getcwd(), cwd)
+        for fmt in ['flyspec', 'flyspecflux', 'minidoas-raw',
+                    'minidoas-scan', 'nzmetservice']:
+            self.assertTrue(fmt in plugins)
+        self.assertEqual(plugins.module('flyspec'), 'dataset.plugins.flyspec')
+        # scanning must not import any of the plugin modules
+        new = [m for m, v in sys.modules.items()
+               if v is not None and m not in loaded]
+        self.assertEqual(new, [])
+
+    def test_shipped_plugins(self):
+        plugins = get_registered_plugins()
+        for fmt, module in [('minidoas-raw', 'dataset.plugins.minidoas'),
+                            ('flyspec', 'dataset.plugins.flyspec')]:
+            c = plugins[fmt]
+            self.assertTrue(issubclass(c, DatasetPluginBase))
+            self.assertEqual(c.__module__, module)
+            self.assertEqual(c.get_format(), fmt)
+
+    def test_lazy_import(self):
+        pkg = os.path.join(self.tmpdir, 'fakeplugins')
+        os.mkdir(pkg)
+        open(os.path.join(pkg, '__init__.py'), 'w').close()
+        with open(os.path.join(pkg, 'fake.py'), 'w') as fh:
+            fh.write('from dataset.plugins import DatasetPluginBase\n'
+                     'class FakePlugin(DatasetPluginBase):\n'
+                     '    @staticmethod\n'
+                     '    def get_format():\n'
+                     '        return "fake"\n'
+                     'class FakeChildPlugin(FakePlugin):\n'
+                     '    @staticmethod\n'
+                     '    def get_format():\n'
+                     '        return "fakechild"\n'
+                     'class NotAPlugin(object):\n'
+                     '    @staticmethod\n'
+                     '    def get_format():\n'
+                     '        return "nope"\n')
+        manifest = scan_plugins(pkg)
+        self.assertEqual(manifest, {'fake': ('fake', 'FakePlugin'),
+                                    'fakechild': ('fake', 'FakeChildPlugin')})
+        sys.path.insert(0, self.tmpdir)
+        try:
+            registry = PluginRegistry(manifest, package='fakeplugins')
+            self.assertFalse('fakeplugins.fake' in sys.modules)
+            c = registry['fake']
+            self.assertTrue('fakeplugins.fake' in sys.modules)
+            self.assertTrue(issubclass(c, DatasetPluginBase))
+            self.assertEqual(c.get_format(), 'fake')
+            self.assertTrue(registry['fake'] is c)
+            self.assertRaises(KeyError, registry.__getitem__, 'nope')
+        finally:
+            sys.path.remove(self.tmpdir)
+            for m in ['fakeplugins', 'fakeplugins.fake']:
+                sys.modules.pop(m, None)
+
+
+def suite():
+    return unittest.makeSuite(PluginRegistryTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,79 @@
+import codecs
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from benchmarks import synthetic
+from dataset.plugins import get_registered_plugins
+
+
+class SyntheticFilesTestCase(unittest.TestCase):
+    """
+    Test that the synthetic raw files are read back by their plugins.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_minidoas_raw(self):
+        fn = os.path.join(self.tmpdir, 'NE_20161101.csv')
+        nrows = synthetic.write_minidoas_raw(fn, scans=3, spectra=4)
+        with codecs.open(fn, encoding='utf-8-sig') as fh:
+            lines = [l.split(',') for l in fh]
+        plugin = get_registered_plugins()['minidoas-raw']
+        buffers = plugin().read(None, fn)
+        rb = buffers['RawDataBuffer']
+        self.assertEqual(rb.d_var.shape, (nrows, synthetic.MINIDOAS_CHANNELS))
+        np.testing.assert_array_equal(
+            rb.d_var, [[float(c) for c in l[8:]] for l in lines])
+        np.testing.assert_allclose(
+            rb.inc_angle, np.degrees([float(l[4]) for l in lines]))
+        np.testing.assert_array_equal(
+            rb.integration_time, [float(l[5]) for l in lines])
+        self.assertEqual(rb.datetime[0], '2016-11-01T06:00:00')
+        self.assertEqual(rb.datetime[-1], '2016-11-01T06:20:06')
+        self.assertEqual(buffers['RawDataTypeBuffer'].acquisition,
+                         'stationary')
+
+    def test_flyspec(self):
+        fn = os.path.join(self.tmpdir, '2016_06_11_0830_TOFP04.txt')
+        specfn = os.path.join(self.tmpdir, '2016_06_11_0830_TOFP04.bin')
+        start = datetime.datetime(2016, 6, 11, 8, 30)
+        nrows = synthetic.write_flyspec(fn, specfn, nrows=20, start=start)
+        log = np.loadtxt(fn, usecols=(12, 16, 17))
+        spectra = np.fromfile(specfn, dtype=np.float32).reshape(
+            (nrows, synthetic.FLYSPEC_CHANNELS))
+        plugin = get_registered_plugins()['flyspec']
+        buffers = plugin().read(None, fn, spectra=specfn,
+                                wavelengths=np.arange(2048.))
+        rb = buffers['RawDataBuffer']
+        np.testing.assert_array_equal(rb.d_var, spectra)
+        np.testing.assert_array_equal(rb.inc_angle, log[:, 2])
+        np.testing.assert_array_equal(buffers['ConcentrationBuffer'].value,
+                                      log[:, 1])
+        self.assertEqual(rb.datetime[0], start.isoformat())
+        self.assertEqual(rb.datetime[-1], (start + datetime.timedelta(
+            seconds=1.5 * (nrows - 1))).isoformat())
+        # positions are written as degrees and decimal minutes
+        np.testing.assert_allclose(rb.position[0, :2], [177.1, -37.55],
+                                   atol=1e-4)
+        np.testing.assert_allclose(rb.position[-1, :2], [177.3, -37.6],
+                                   atol=1e-4)
+        np.testing.assert_array_equal(rb.position[:, 2], log[:, 0])
+
+
+def suite():
+    return unittest.makeSuite(SyntheticFilesTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')